@@ -44,6 +44,7 @@
 #include "sound.h"
 #include "cpu-emu.h"
 #include "sig.h"
+#include "prof.h"
 
 #define SIGALTSTACK_WA_DEFAULT 1
 #if SIGALTSTACK_WA_DEFAULT
@@ -1185,6 +1186,8 @@ static void sigasync0_std(int sig, sigcontext_t *scp, siginfo_t *si)
     error("handler for sig %i not registered\n", sig);
     return;
   }
+  if (sig == SIGALRM)
+    prof_signal();
   e_gen_sigalrm(scp);
   SIGNAL_save(asighandlers[sig], NULL, 0, __func__);
   if (!in_vm86)
@@ -25,6 +25,7 @@
 #include "cpu-emu.h"
 #include "dosemu_config.h"
 #include "sig.h"
+#include "counters.h"
 
 /*
  * All of the functions in this module need to be declared with
@@ -73,6 +74,7 @@ static void dosemu_fault1(int signal, sigcontext_t *scp)
     }
     goto bad;
   }
+  count_event(CNT_FAULT + (_trapno & 0x1f));
 #ifdef __x86_64__
   if (_trapno == 0x0e && _cr2 > 0xffffffff)
   {
@@ -35,6 +35,7 @@
 #include "hlt.h"
 #include "libpcl/pcl.h"
 #include "coopth.h"
+#include "counters.h"
 
 enum CoopthRet { COOPTH_YIELD, COOPTH_WAIT, COOPTH_SLEEP, COOPTH_SCHED,
 	COOPTH_DONE, COOPTH_ATTACH, COOPTH_DETACH, COOPTH_LEAVE,
@@ -217,6 +218,7 @@ static sw_fn sw_list[] = {
 static enum CoopthRet do_call(struct coopth_per_thread_t *pth)
 {
     enum CoopthRet ret;
+    count_event(CNT_COOPTH_SWITCH);
     co_call(pth->thread);
     ret = pth->data.ret;
     if (ret == COOPTH_DONE && !pth->data.attached) {
@@ -887,6 +889,11 @@ static int __coopth_is_in_thread(int warn, const char *f)
 #define _coopth_is_in_thread() __coopth_is_in_thread(1, __func__)
 #define _coopth_is_in_thread_nowarn() __coopth_is_in_thread(0, __func__)
 
+int coopth_get_active_count(void)
+{
+    return threads_active;
+}
+
 int coopth_get_tid(void)
 {
     struct coopth_thrdata_t *thdata;
@@ -92,10 +92,13 @@
 #include "keyboard/keyb_server.h"
 #include "sig.h"
 #include "sound.h"
+#include "evlog.h"
 #ifdef X86_EMULATOR
 #include "cpu-emu.h"
 #endif
 #include "kvm.h"
+#include "prof.h"
+#include "counters.h"
 
 static int ld_tid;
 static int can_leavedos;
@@ -302,6 +305,9 @@ int main(int argc, char **argv, char * const *envp)
     /* threads can be created only after signal_pre_init() so
      * it should be above device_init(), iodev_init(), cpu_setup() etc */
     signal_pre_init();          /* initialize sig's & sig handlers */
+    evlog_init();		/* start the event log writer thread */
+    prof_init();		/* guest profiler */
+    counters_init();		/* hot path counters */
     cpu_setup();		/* setup the CPU */
     pci_setup();
     device_init();		/* priv initialization of video etc. */
@@ -519,6 +525,14 @@ void __leavedos_main(int code, int sig)
     for (i = 0; i < exit_hndl_num; i++)
       exit_hndl[i].handler();
 
+    if (evlog_enabled) {
+      struct evlog_rec r;
+      evlog_begin(&r, 'g', "exit");
+      evlog_int(&r, "code", code);
+      evlog_int(&r, "signal", sig);
+      evlog_end(&r);
+    }
+    evlog_done();
     flush_log();
 
     /* We don't need to use _exit() here; this is the graceful exit path. */
@@ -45,6 +45,7 @@
 #include "vgaemu.h"
 #include "hlt.h"
 #include "coopth.h"
+#include "snapshot.h"
 #include "mhpdbg.h"
 #include "ipx.h"
 #ifdef X86_EMULATOR
@@ -54,6 +55,8 @@
 #include "dpmi.h"
 
 #include "keyboard/keyb_server.h"
+#include "prof.h"
+#include "counters.h"
 
 #undef  DEBUG_INT1A
 
@@ -737,6 +740,8 @@ static int dos_helper(int stk_offs)
 	mimic_boot_blk();
 	break;
     case DOS_HELPER_READ_MBR:
+	if (snapshot_want_restore())
+	    break;
 	boot();
 	break;
     case DOS_HELPER_MBR:
@@ -1390,6 +1395,7 @@ Return: nothing
  */
 static int msdos(void)
 {
+    count_event(CNT_INT21 + HI(ax));
     ds_printf
 	("INT21 at %04x:%04x: AX=%04x, BX=%04x, CX=%04x, DX=%04x, DS=%04x, ES=%04x\n",
 	SREG(cs), LWORD(eip), LWORD(eax), LWORD(ebx),
@@ -2726,7 +2732,9 @@ static void debug_int(const char *s, int i)
 static void do_int_from_thr(void *arg)
 {
     u_char i = (long) arg;
+    int pz = prof_enter(PROF_INT + i);
     run_caller_func(i, NO_REVECT, 6);
+    prof_leave(pz);
 /* for now dosdebug uses int_revect feature, so this should be disabled
  * or it will display the same entry twice */
 #if 0
@@ -2761,7 +2769,9 @@ static void do_int_from_hlt(Bit16u i, void *arg)
 
 static void do_rvc_chain(int i, int stk_offs)
 {
+    int pz = prof_enter(PROF_INT + i);
     int ret = run_caller_func(i, REVECT, stk_offs);
+    prof_leave(pz);
     switch (ret) {
     case I_SECOND_REVECT:
 	di_printf("int_rvc 0x%02x setup\n", i);
@@ -2784,7 +2794,9 @@ static void do_rvc_chain(int i, int stk_offs)
 static void do_basic_revect_thr(void *arg)
 {
     int i = (long) arg;
+    int pz = prof_enter(PROF_INT + i);
     run_caller_func(i, REVECT, 0);
+    prof_leave(pz);
 }
 
 void do_int(int i)
@@ -46,6 +46,7 @@
 #include "mapping.h"
 #include "dosemu_config.h"
 #include "sig.h"
+#include "counters.h"
 #ifdef X86_EMULATOR
 #include "cpu-emu.h"
 #include "bitops.h"
@@ -191,6 +192,7 @@ static void log_port_write_d(ioport_t port, Bit32u w)
 Bit8u port_inb(ioport_t port)
 {
 	Bit8u res;
+	count_event(CNT_PORT_IN);
 	res = EMU_HANDLER(port).read_portb(port);
 	return LOG_PORT_READ(port, res);
 }
@@ -205,6 +207,7 @@ Bit8u port_inb(ioport_t port)
 void port_outb(ioport_t port, Bit8u byte)
 {
 	LOG_PORT_WRITE(port, byte);
+	count_event(CNT_PORT_OUT);
 	EMU_HANDLER(port).write_portb(port,byte);
 }
 
@@ -222,6 +225,7 @@ Bit16u port_inw(ioport_t port)
 	Bit16u res;
 
 	if (EMU_HANDLER(port).read_portw != NULL) {
+		count_event(CNT_PORT_IN);
 		res = EMU_HANDLER(port).read_portw(port);
 		return LOG_PORT_READ_W(port, res);
 	}
@@ -242,6 +246,7 @@ void port_outw(ioport_t port, Bit16u word)
 {
 	if (EMU_HANDLER(port).write_portw != NULL) {
 		LOG_PORT_WRITE_W(port, word);
+		count_event(CNT_PORT_OUT);
 		EMU_HANDLER(port).write_portw(port, word);
 	}
 	else {
@@ -263,6 +268,7 @@ Bit32u port_ind(ioport_t port)
 	Bit32u res;
 
 	if (EMU_HANDLER(port).read_portd != NULL) {
+		count_event(CNT_PORT_IN);
 		res = EMU_HANDLER(port).read_portd(port);
 	}
 	else {
@@ -275,6 +281,7 @@ void port_outd(ioport_t port, Bit32u dword)
 {
 	LOG_PORT_WRITE_D(port, dword);
 	if (EMU_HANDLER(port).write_portd != NULL) {
+		count_event(CNT_PORT_OUT);
 		EMU_HANDLER(port).write_portd(port, dword);
 	}
 	else {
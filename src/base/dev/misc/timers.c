@@ -689,3 +689,28 @@ void pit_reset(void)
 #endif
   port61 = 0x0c;
 }
+
+void pit_snapshot_save(struct pit_snapshot *s)
+{
+  hitimer_t cur_time = GETtickTIME(0);
+  int i;
+
+  for (i = 0; i < PIT_TIMERS; i++) {
+    s->pit[i] = pit[i];
+    s->pit[i].time.td = cur_time - pit[i].time.td;
+  }
+  s->port61 = port61;
+}
+
+void pit_snapshot_restore(const struct pit_snapshot *s)
+{
+  hitimer_t cur_time = GETtickTIME(0);
+  int i;
+
+  for (i = 0; i < PIT_TIMERS; i++) {
+    pit[i] = s->pit[i];
+    pit[i].time.td = cur_time - s->pit[i].time.td;
+  }
+  port61 = s->port61;
+  timer_div = (pit[0].cntr * 10000) / PIT_TICK_RATE;
+}
@@ -975,3 +975,50 @@ void pic_reset(void)
 {
   pic_set_mask;
 }
+
+void pic_snapshot_save(struct pic_snapshot *s)
+{
+  int i;
+
+  s->irr = pic_irr;
+  s->isr = pic_isr;
+  s->pirr = pic_pirr;
+  s->pic1_isr = pic1_isr;
+  s->pic0_imr = pic0_imr;
+  s->pic1_imr = pic1_imr;
+  s->smm = pic_smm;
+  s->iflag = pic_iflag;
+  s->irq2_ivec = pic_irq2_ivec;
+  for (i = 0; i < 16; i++)
+    s->ivec[i] = pic_iinfo[i].ivec;
+  s->isr_requested[0] = pic0_isr_requested;
+  s->isr_requested[1] = pic1_isr_requested;
+  s->icw_state[0] = pic0_icw_state;
+  s->icw_state[1] = pic1_icw_state;
+  s->cmd[0] = pic0_cmd;
+  s->cmd[1] = pic1_cmd;
+}
+
+void pic_snapshot_restore(const struct pic_snapshot *s)
+{
+  int i;
+
+  pic_irr = s->irr;
+  pic_isr = s->isr;
+  pic_pirr = s->pirr;
+  pic1_isr = s->pic1_isr;
+  pic0_imr = s->pic0_imr;
+  pic1_imr = s->pic1_imr;
+  pic_smm = s->smm;
+  pic_iflag = s->iflag;
+  pic_irq2_ivec = s->irq2_ivec;
+  for (i = 0; i < 16; i++)
+    pic_iinfo[i].ivec = s->ivec[i];
+  pic0_isr_requested = s->isr_requested[0];
+  pic1_isr_requested = s->isr_requested[1];
+  pic0_icw_state = s->icw_state[0];
+  pic1_icw_state = s->icw_state[1];
+  pic0_cmd = s->cmd[0];
+  pic1_cmd = s->cmd[1];
+  pic_set_mask;
+}
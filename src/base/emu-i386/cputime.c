@@ -25,6 +25,7 @@
 #include "speaker.h"
 #include "dosemu_config.h"
 #include "sig.h"
+#include "prof.h"
 
 /* --------------------------------------------------------------------- */
 /*
@@ -384,9 +385,12 @@ void trigger_idle(void)
 void dosemu_sleep(void)
 {
   sigset_t mask;
+  int pz;
   uncache_time();
   pthread_sigmask(SIG_SETMASK, NULL, &mask);
+  pz = prof_enter(PROF_IDLE);
   sigsuspend(&mask);
+  prof_leave(pz);
 }
 
 /* "strong" idle callers will have threshold1 = 0 so only the
@@ -51,6 +51,8 @@
 #include "ipx.h"
 #include "vgaemu.h"
 #include "sig.h"
+#include "snapshot.h"
+#include "prof.h"
 
 int vm86_fault(unsigned trapno, unsigned err, dosaddr_t cr2)
 {
@@ -451,7 +453,7 @@ static int do_vm86(union vm86_union *x)
 
 static void _do_vm86(void)
 {
-    int retval;
+    int retval, pz;
 #ifdef USE_MHPDBG
     int dret;
 #endif
@@ -460,9 +462,11 @@ static void _do_vm86(void)
 	error("both IF and VIP set\n");
 	clear_VIP();
     }
+    pz = prof_enter(PROF_GUEST);
     in_vm86 = 1;
     retval = do_vm86(&vm86u);
     in_vm86 = 0;
+    prof_leave(pz);
 
     if (
 #ifdef X86_EMULATOR
@@ -620,7 +624,9 @@ void vm86_helper(void)
  */
 void loopstep_run_vm86(void)
 {
+    prof_zone = PROF_EMU;
     uncache_time();
+    snapshot_run();
     if (!dosemu_frozen && !signal_pending()) {
 	if (in_dpmi_pm())
 	    run_dpmi();
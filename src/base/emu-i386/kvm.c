@@ -43,6 +43,7 @@
 #define X86_EFLAGS_FIXED 2
 #endif
 #include "dpmi.h"
+#include "counters.h"
 
 #define SAFE_MASK (X86_EFLAGS_CF|X86_EFLAGS_PF| \
                    X86_EFLAGS_AF|X86_EFLAGS_ZF|X86_EFLAGS_SF| \
@@ -749,6 +750,7 @@ static unsigned int kvm_run(struct vm86_regs *regs)
       leavedos_main(99);
     }
     exit_reason = run->exit_reason;
+    count_event(CNT_KVM_EXIT + (exit_reason < 64 ? exit_reason : 63));
 
     switch (exit_reason) {
     case KVM_EXIT_HLT:
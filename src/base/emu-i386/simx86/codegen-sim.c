@@ -68,6 +68,7 @@
 #include "video.h"
 #include "codegen.h"
 #include "codegen-sim.h"
+#include "tier.h"
 
 #undef	DEBUG_MORE
 
@@ -98,6 +99,30 @@ flgtmp RFL;
 
 /////////////////////////////////////////////////////////////////////////////
 
+/* In tiered mode translated code can live in the memory we write to.
+ * Stores of the JIT fault on its write protected pages, but ours go
+ * through the unprotected mirror of low memory, or would fault inside
+ * dosemu, so invalidate the code beforehand. */
+static inline void sim_write_byte(dosaddr_t addr, uint8_t byte)
+{
+	if (tier_enabled) e_invalidate(addr, 1);
+	write_byte(addr, byte);
+}
+
+static inline void sim_write_word(dosaddr_t addr, uint16_t word)
+{
+	if (tier_enabled) e_invalidate(addr, 2);
+	write_word(addr, word);
+}
+
+static inline void sim_write_dword(dosaddr_t addr, uint32_t dword)
+{
+	if (tier_enabled) e_invalidate(addr, 4);
+	write_dword(addr, dword);
+}
+
+/////////////////////////////////////////////////////////////////////////////
+
 /* empirical!! */
 //static int goodmemref(long m)
 //{
@@ -534,11 +559,11 @@ void Gen_sim(int op, int mode, ...)
 		dosaddr_t addr = AR1.d;
 		if (mode&MBYTE) {
 			GTRACE3("S_DI_IMM_B",0xff,0xff,v);
-			write_byte(addr, v);
+			sim_write_byte(addr, v);
 		} else {
 			GTRACE3("S_DI_IMM_WL",0xff,0xff,v);
-			if (mode&DATA16) write_word(addr, v);
-			else write_dword(addr, v);
+			if (mode&DATA16) sim_write_word(addr, v);
+			else sim_write_dword(addr, v);
 		} }
 		break;
 
@@ -639,13 +664,13 @@ void Gen_sim(int op, int mode, ...)
 		dosaddr_t addr = AR1.d;
 		GTRACE0("S_DI");
 		if (mode&MBYTE) {
-		    write_byte(addr, DR1.b.bl);
+		    sim_write_byte(addr, DR1.b.bl);
 		}
 		else if (mode & DATA16) {
-		    write_word(addr, DR1.w.l);
+		    sim_write_word(addr, DR1.w.l);
 		}
 		else {
-		    write_dword(addr, DR1.d);
+		    sim_write_dword(addr, DR1.d);
 		}
 		if (debug_level('e')>3) dbug_printf("(V) %08x\n",DR1.d);
 		}
@@ -2049,7 +2074,7 @@ void Gen_sim(int op, int mode, ...)
 			AR2.d = CPULONG(Ofs_XSS);
 			SR1.d = CPULONG(Ofs_ESP) - 2;
 			SR1.d &= CPULONG(Ofs_STACKM);
-			write_word(AR2.d + SR1.d, DR1.w.l);
+			sim_write_word(AR2.d + SR1.d, DR1.w.l);
 			CPULONG(Ofs_ESP) = SR1.d;
 		}
 		else {
@@ -2058,7 +2083,7 @@ void Gen_sim(int op, int mode, ...)
 			AR2.d = CPULONG(Ofs_XSS);
 			SR1.d = (tesp = CPULONG(Ofs_ESP)) - 4;
 			SR1.d &= stackm;
-			write_dword(AR2.d + SR1.d, DR1.d);
+			sim_write_dword(AR2.d + SR1.d, DR1.d);
 #if 0	/* keep high 16-bits of ESP in small-stack mode */
 			SR1.d |= (tesp & ~stackm);
 #endif
@@ -2081,13 +2106,13 @@ void Gen_sim(int op, int mode, ...)
 			DR1.w.l = CPUWORD(o);
 			SR1.d -= 2;
 			SR1.d &= CPULONG(Ofs_STACKM);
-			write_word(AR2.d + SR1.d, DR1.w.l);
+			sim_write_word(AR2.d + SR1.d, DR1.w.l);
 		}
 		else {
 			DR1.d = CPULONG(o);
 			SR1.d -= 4;
 			SR1.d &= CPULONG(Ofs_STACKM);
-			write_dword(AR2.d + SR1.d, DR1.d);
+			sim_write_dword(AR2.d + SR1.d, DR1.d);
 		}
 		if (debug_level('e')>3) dbug_printf("(V) %08x\n",DR1.d);
 		} break;
@@ -2110,11 +2135,11 @@ void Gen_sim(int op, int mode, ...)
 		SR1.d = CPULONG(Ofs_ESP);
 		if (mode & DATA16) {
 			SR1.d = (SR1.d - 2) & CPULONG(Ofs_STACKM);
-			write_word(AR2.d + SR1.d, ftmp);
+			sim_write_word(AR2.d + SR1.d, ftmp);
 		}
 		else {
 			SR1.d = (SR1.d - 4) & CPULONG(Ofs_STACKM);
-			write_dword(AR2.d + SR1.d, ftmp);
+			sim_write_dword(AR2.d + SR1.d, ftmp);
 		}
 		CPULONG(Ofs_ESP) = SR1.d;
 		if (debug_level('e')>3) dbug_printf("(V) %08x\n",ftmp);
@@ -2128,7 +2153,7 @@ void Gen_sim(int op, int mode, ...)
 			AR2.d = CPULONG(Ofs_XSS);
 			SR1.d = CPULONG(Ofs_ESP) - 2;
 			SR1.d &= CPULONG(Ofs_STACKM);
-			write_word(AR2.d + SR1.d, DR1.w.l);
+			sim_write_word(AR2.d + SR1.d, DR1.w.l);
 			CPULONG(Ofs_ESP) = SR1.d;
 		}
 		else {
@@ -2136,7 +2161,7 @@ void Gen_sim(int op, int mode, ...)
 			AR2.d = CPULONG(Ofs_XSS);
 			SR1.d = CPULONG(Ofs_ESP) - 4;
 			SR1.d &= CPULONG(Ofs_STACKM);
-			write_dword(AR2.d + SR1.d, DR1.d);
+			sim_write_dword(AR2.d + SR1.d, DR1.d);
 			CPULONG(Ofs_ESP) = SR1.d;
 		}
 		} break;
@@ -2334,27 +2359,27 @@ void Gen_sim(int op, int mode, ...)
 		src = AR2.d;
 		if (df<0) {
 		    if (mode&MBYTE) {
-			while (i--) write_byte(dest--, read_byte(src--));
+			while (i--) sim_write_byte(dest--, read_byte(src--));
 		    }
 		    else if (mode&DATA16) {
-			while (i--) { write_word(dest, read_word(src));
+			while (i--) { sim_write_word(dest, read_word(src));
 			    dest -= 2; src -= 2; }
 		    }
 		    else {
-			while (i--) { write_dword(dest, read_dword(src));
+			while (i--) { sim_write_dword(dest, read_dword(src));
 			    dest -= 4; src -= 4; }
 		    }
 		}
 	    	else {
 		    if (mode&MBYTE) {
-			while (i--) write_byte(dest++, read_byte(src++));
+			while (i--) sim_write_byte(dest++, read_byte(src++));
 		    }
 		    else if (mode&DATA16) {
-			while (i--) { write_word(dest, read_word(src));
+			while (i--) { sim_write_word(dest, read_word(src));
 			    dest += 2; src += 2; }
 		    }
 		    else {
-			while (i--) { write_dword(dest, read_dword(src));
+			while (i--) { sim_write_dword(dest, read_dword(src));
 			    dest += 4; src += 4; }
 		    }
 		}
@@ -2425,13 +2450,13 @@ void Gen_sim(int op, int mode, ...)
 		}
 		addr = AR1.d;
 		if (mode&MBYTE) {
-		    while (i--) { write_byte(addr, DR1.b.bl); addr += df; }
+		    while (i--) { sim_write_byte(addr, DR1.b.bl); addr += df; }
 		}
 		else if (mode&DATA16) {
-		    while (i--) { write_word(addr, DR1.w.l); addr += 2*df; }
+		    while (i--) { sim_write_word(addr, DR1.w.l); addr += 2*df; }
 		}
 		else {
-		    while (i--) { write_dword(addr, DR1.d); addr += 4*df; }
+		    while (i--) { sim_write_dword(addr, DR1.d); addr += 4*df; }
 		}
 		AR1.d = addr;
 		TR1.d = 0;
@@ -114,6 +114,8 @@
 #include "mapping.h"
 #ifdef HOST_ARCH_X86
 #include "codegen-x86.h"
+#include "jitcache.h"
+#include "counters.h"
 
 static void Gen_x86(int op, int mode, ...);
 static void AddrGen_x86(int op, int mode, ...);
@@ -2071,8 +2073,25 @@ shrot0:
 		G3M(0x03,0x43,Ofs_XCS,Cp);
 		// subl Ofs_MEMBASE(%%ebx),%%eax
 		G3M(0x2b,0x43,Ofs_MEMBASE,Cp);
-		// pop %%edx; ret
-		G2M(0x5a,0xc3,Cp);
+		if (IG->p0) {
+		    /* inline cache for near jumps, see NodeLinker() */
+		    // cmpl $target,%%eax; jne miss
+		    G1(0x3d,Cp);
+		    lt->t_link.rel = Cp-BaseGenBuf;
+		    G4(0,Cp); G2M(0x75,0x06,Cp);
+		    // movzwl Ofs_SIGAPEND(%%ebx),%%ecx; jecxz hit
+		    G4M(0x0f,0xb7,0x4b,Ofs_SIGAPEND,Cp);
+		    G2M(0xe3,0x02,Cp);
+		    // miss: pop %%edx; ret
+		    G2M(0x5a,0xc3,Cp);
+		    // hit: jmp {miss|target}
+		    G1(0xe9,Cp);
+		    lt->nt_link.rel = Cp-BaseGenBuf;
+		    G4(IC_MISS,Cp);
+		}
+		else
+		    // pop %%edx; ret
+		    G2M(0x5a,0xc3,Cp);
 		}
 		break;
 
@@ -2589,6 +2608,7 @@ static void Gen_x86(int op, int mode, ...)
 		} break;
 
 	case JMP_INDIRECT:
+		IG->p0 = va_arg(ap,int);	// near
 		IG->lt = va_arg(ap,linkdesc *);	// lt
 		break;
 
@@ -2650,7 +2670,7 @@ static CodeBuf *ProduceCode(unsigned int PC, IMeta *I0)
 	 *	0000	(GenCodeBuf) pointed from {TNode}.mblock
 	 *		contains a back pointer to the TNode
 	 * 0008/0004	self-pointer (address of this location)
-	 * 0010/0008	Addr2Pc table (nap) pointed from {TNode}.pmeta
+	 * 0010/0008	Addr2Pc table (nap), {TNode}.mblock->meta
 	 *	nap+10/8 actual code produced (BaseGenBuf)
 	 *		plus tail code
 	 * Only the code part is filled here.
@@ -2918,6 +2938,36 @@ static void NodeLinker(TNode *LG, TNode *G)
 			}
 		    }
 		}
+		/* an inline cache takes the first node run after it that
+		 * has the same CS; the compare keeps it right if the jump
+		 * goes elsewhere later */
+		if ((L->unlinked_jmp_targets & TARGET_IC) && LG->cs == G->cs) {
+		    if (L->t_ref!=0) {
+			dbug_printf("Linker: ic_ref at %08x busy\n",LG->key);
+			leavedos_main(0x8104);
+		    }
+		    L->unlinked_jmp_targets &= ~TARGET_IC;
+		    L->t_target = G->key;
+		    *L->t_link.abs = G->key;
+		    lp = L->nt_link.abs;
+		    *lp = G->addr - (unsigned char *)(lp+1);
+		    L->t_ref = &G->mblock->bkptr;
+		    B = calloc(1,sizeof(backref));
+		    // head insertion
+		    B->next = T->bkr.next;
+		    T->bkr.next = B;
+		    B->ref = &LG->mblock->bkptr;
+		    B->branch = 'I';
+		    T->nrefs++;
+		    count_event(CNT_JIT_IC_LINK);
+		    if (debug_level('e')>1)
+			e_printf("Linker: indirect jump of (%p:%08x:%p)\n"
+			    "\t\tcached to (%p:%08x:%p), t_ref %d=%p->%p\n",
+			    LG,LG->key,LG->addr,
+			    G,G->key,G->addr,
+			    T->nrefs, L->t_ref, *L->t_ref);
+		    _nodeflagbackrefs(LG, G->flags);
+		}
 	    }
 	}
 #ifdef PROFILE
@@ -2980,6 +3030,20 @@ void NodeUnlinker(TNode *G)
 		L->nt_ref = NULL; L->unlinked_jmp_targets |= TARGET_NT;
 		T->nrefs--;
 	    }
+	    else if (B->branch=='I') {
+		TNode *H = *B->ref;
+		linkdesc *L = &H->clink;
+		if (debug_level('e')>2) e_printf("Unlinking I ref from node %p(%08x) to %08x\n",
+			H, L->t_target, G->key);
+		if (L->t_target != G->key) {
+		    dbug_printf("Unlinker: BK ref error i=%08x k=%08x\n",
+			L->t_target, G->key);
+		    leavedos_main(0x8110);
+		}
+		*L->nt_link.abs = IC_MISS;
+		L->t_ref = NULL; L->unlinked_jmp_targets |= TARGET_IC;
+		T->nrefs--;
+	    }
 	    else {
 		e_printf("Invalid unlink [%c] ref %p from node ?(?) to %08x\n",
 			B->branch, B->ref, G->key);
@@ -3090,6 +3154,7 @@ static unsigned int CloseAndExec_x86(unsigned int PC, int mode, int ln)
 		e_printf("== (%d) == Closing sequence at %08x\n",ln,PC);
 	}
 
+	jitcache_store(PC);
 	GenCodeBuf = ProduceCode(PC, I0);
 
 	NodesParsed++;
@@ -3329,7 +3394,8 @@ unsigned int Exec_x86_fast(TNode *G)
 		if (G->alive > 0) {
 			if (LastXNode->clink.unlinked_jmp_targets &&
 			    (LastXNode->clink.t_target == G->key ||
-			     LastXNode->clink.nt_target == G->key))
+			     LastXNode->clink.nt_target == G->key ||
+			     (LastXNode->clink.unlinked_jmp_targets & TARGET_IC)))
 				NodeLinker(LastXNode, G);
 			LastXNode = G;
 		}
@@ -43,6 +43,8 @@
 
 #define TAILSIZE	7
 #define TAILFIX		1
+/* jmp offset of an unlinked inline cache, back to its pop/ret */
+#define IC_MISS		(-7)
 
 /* If you undefine this, in 16-bit stack mode the high 16 bits of ESP
  * will be zeroed after every push/pop operation. There's a small
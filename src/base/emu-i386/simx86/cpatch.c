@@ -36,15 +36,18 @@
 #include "trees.h"
 #include "codegen-arch.h"
 #include "cpatch.h"
+#include "counters.h"
 
 #ifdef HOST_ARCH_X86
 
 static int in_cpatch;
 
 /*
- * Return address of the stub function is passed into eip
+ * Return address of the stub function is passed into eip.
+ * Returns 1 if the page was unprotected for this write only; the
+ * caller has to call e_wthru_end() after writing.
  */
-void m_munprotect(unsigned int addr, unsigned int len, unsigned char *eip)
+int m_munprotect(unsigned int addr, unsigned int len, unsigned char *eip)
 {
 	if (debug_level('e')>1) {
 		if (debug_level('e')>3)
@@ -54,20 +57,39 @@ void m_munprotect(unsigned int addr, unsigned int len, unsigned char *eip)
 	}
 	/* if only data in aliased low memory is hit, nothing to do */
 	if (LINEAR2UNIX(addr) != MEM_BASE32(addr)) {
-		if (e_querymark(addr, len))
+		if (e_querymark(addr, len)) {
 			// no need to invalidate the whole page here,
 			// as the page does not need to be unprotected
+			count_event(CNT_SMC_CODE);
 			InvalidateNodeRange(addr,len,eip);
-		return;
+		}
+		return 0;
+	}
+	/* nothing to do if the page was already unprotected */
+	if (!e_querymprotrange(addr, len))
+		return 0;
+	/* DPMI memory has no unprotected alias, so the page has to be
+	 * writable for the write. Only drop the code that is written to
+	 * and let the write through, keeping the page protected. */
+	if (e_querymark(addr, len)) {
+		count_event(CNT_SMC_CODE);
+		InvalidateNodeRange(addr,len,eip);
+		if (!e_querymprotrange(addr, len))
+			return 0;
+	} else {
+		count_event(CNT_SMC_DATA);
 	}
-	/* Always unprotect and clear all code in the pages
-	 * for DPMI data and code
+	if (e_wthru_begin(addr, len))
+		return 1;
+	/* Otherwise unprotect and clear all code in the pages.
 	 * Maybe the stub was set up before that code was parsed.
 	 * Clear that code */
 /*	if (UnCpatch((void *)(eip-3))) leavedos_main(0); */
+	count_event(CNT_SMC_PAGE);
 	len = PAGE_ALIGN(addr+len-1) - (addr & PAGE_MASK);
 	addr &= PAGE_MASK;
 	InvalidateNodeRange(addr,len,eip);
+	return 0;
 }
 
 #define repmovs(std,letter,cld)			       \
@@ -97,11 +119,12 @@ asmlinkage void rep_movs_stos(struct rep_stack *stack)
 	unsigned char *paddr = stack->edi;
 	unsigned int ecx = stack->ecx;
 	unsigned char *eip = stack->eip;
-	dosaddr_t addr;
+	dosaddr_t addr, waddr;
 	unsigned int len = ecx;
 	unsigned char *edi;
 	unsigned char op;
 	unsigned int size;
+	int wthru;
 
 	in_cpatch++;
 	assert(InCompiledCode);
@@ -118,8 +141,8 @@ asmlinkage void rep_movs_stos(struct rep_stack *stack)
 	else if (*eip & 1)
 		size = 4;
 	len *= size;
-	m_munprotect(addr - ((EFLAGS & EFLAGS_DF) ? (len - size) : 0),
-		     len, eip);
+	waddr = addr - ((EFLAGS & EFLAGS_DF) ? (len - size) : 0);
+	wthru = m_munprotect(waddr, len, eip);
 	edi = LINEAR2UNIX(addr);
 	if ((op & 0xfe) == 0xa4) { /* movs */
 		dosaddr_t source = DOSADDR_REL(stack->esi);
@@ -211,6 +234,8 @@ asmlinkage void rep_movs_stos(struct rep_stack *stack)
 	stack->edi = MEM_BASE32(addr);
 	stack->ecx = ecx;
 done:
+	if (wthru)
+		e_wthru_end(waddr);
 	InCompiledCode++;
 	in_cpatch--;
 }
@@ -248,12 +273,13 @@ asmlinkage void stk_32(unsigned char *paddr, Bit32u value)
 asmlinkage void wri_8(unsigned char *paddr, Bit8u value, unsigned char *eip)
 {
 	dosaddr_t addr;
+	int wthru;
 
 	in_cpatch++;
 	assert(InCompiledCode);
 	InCompiledCode--;
 	addr = DOSADDR_REL(paddr);
-	m_munprotect(addr, 1, eip);
+	wthru = m_munprotect(addr, 1, eip);
 	InCompiledCode++;
 	if (!emu_ldt_write(paddr, value, 1)) {
 		if (vga_write_access(addr))
@@ -261,18 +287,21 @@ asmlinkage void wri_8(unsigned char *paddr, Bit8u value, unsigned char *eip)
 		else
 			WRITE_BYTE(addr,value);
 	}
+	if (wthru)
+		e_wthru_end(addr);
 	in_cpatch--;
 }
 
 asmlinkage void wri_16(unsigned char *paddr, Bit16u value, unsigned char *eip)
 {
 	dosaddr_t addr;
+	int wthru;
 
 	in_cpatch++;
 	assert(InCompiledCode);
 	InCompiledCode--;
 	addr = DOSADDR_REL(paddr);
-	m_munprotect(addr, 2, eip);
+	wthru = m_munprotect(addr, 2, eip);
 	InCompiledCode++;
 	if (!emu_ldt_write(paddr, value, 2)) {
 		if (vga_write_access(addr))
@@ -280,18 +309,21 @@ asmlinkage void wri_16(unsigned char *paddr, Bit16u value, unsigned char *eip)
 		else
 			WRITE_WORD(addr,value);
 	}
+	if (wthru)
+		e_wthru_end(addr);
 	in_cpatch--;
 }
 
 asmlinkage void wri_32(unsigned char *paddr, Bit32u value, unsigned char *eip)
 {
 	dosaddr_t addr;
+	int wthru;
 
 	in_cpatch++;
 	assert(InCompiledCode);
 	InCompiledCode--;
 	addr = DOSADDR_REL(paddr);
-	m_munprotect(addr, 4, eip);
+	wthru = m_munprotect(addr, 4, eip);
 	InCompiledCode++;
 	if (!emu_ldt_write(paddr, value, 4)) {
 		if (vga_write_access(addr))
@@ -299,6 +331,8 @@ asmlinkage void wri_32(unsigned char *paddr, Bit32u value, unsigned char *eip)
 		else
 			WRITE_DWORD(addr,value);
 	}
+	if (wthru)
+		e_wthru_end(addr);
 	in_cpatch--;
 }
 
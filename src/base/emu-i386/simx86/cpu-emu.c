@@ -48,6 +48,8 @@
 #include "mapping.h"
 #include "dis8086.h"
 #include "sig.h"
+#include "jitcache.h"
+#include "tier.h"
 
 /* ======================================================================= */
 
@@ -787,10 +789,13 @@ void init_emu_cpu(void)
   }
   e_printf("EMU86: tss mask=%08lx\n", eTSSMASK);
 #ifdef HOST_ARCH_X86
-  if (config.cpusim)
+  if (config.cpusim) {
     InitGen_sim();
-  else
+  } else {
     InitGen_x86();
+    jitcache_init();
+    tier_init();
+  }
 #else
   InitGen_sim();
 #endif
@@ -738,7 +738,9 @@ int e_markpage(unsigned int addr, size_t len);
 int e_unmarkpage(unsigned int addr, size_t len);
 int e_querymark(unsigned int addr, size_t len);
 int e_querymark_all(unsigned int addr, size_t len);
-void m_munprotect(unsigned int addr, unsigned int len, unsigned char *eip);
+int e_wthru_begin(unsigned int addr, size_t len);
+void e_wthru_end(unsigned int addr);
+int m_munprotect(unsigned int addr, unsigned int len, unsigned char *eip);
 void mprot_init(void);
 void mprot_end(void);
 void InitGenCodeBuf(void);
@@ -40,6 +40,14 @@
 #include "dpmi.h"
 #include "mhpdbg.h"
 #include "video.h"
+#include "jitcache.h"
+#include "tier.h"
+
+#ifdef HOST_ARCH_X86
+/* in tiered mode cold code is decoded for the simulator, see tier.c */
+#undef CONFIG_CPUSIM
+#define CONFIG_CPUSIM	(config.cpusim || tier_sim)
+#endif
 
 #ifdef PROFILE
 int EmuSignals = 0;
@@ -312,12 +320,17 @@ static unsigned int _JumpGen(unsigned int P2, int mode, int opc,
 		Gen(S_REG, mode, Ofs_CS);
 		AddrGen(A_SR_SH4, mode, Ofs_CS, Ofs_XCS);
 		Gen(L_REG, mode, Ofs_EIP);
-		/* fall through */
+		/* CS changes, always go back to FindTree() */
+		if (CONFIG_CPUSIM)
+			Gen(JMP_INDIRECT, mode);
+		else
+			Gen(JMP_INDIRECT, mode, 0, &InstrMeta[0].clink);
+		break;
 	case RET: case RETisp: case JMPi: case CALLi: // ret, indirect
 		if (CONFIG_CPUSIM)
 			Gen(JMP_INDIRECT, mode);
 		else
-			Gen(JMP_INDIRECT, mode, &InstrMeta[0].clink);
+			Gen(JMP_INDIRECT, mode, 1, &InstrMeta[0].clink);
 		break;
 	default: dbug_printf("JumpGen: unknown condition\n");
 		break;
@@ -453,6 +466,9 @@ static unsigned int _Interp86(unsigned int PC, int mod0);
 unsigned int Interp86(unsigned int PC, int mod0)
 {
     unsigned int ret = _Interp86(PC, mod0);
+#ifdef HOST_ARCH_X86
+    tier_set(0);
+#endif
     TheCPU.eip = ret - LONG_CS;
     return ret;
 }
@@ -489,6 +505,9 @@ static unsigned int _Interp86(unsigned int PC, int basemode)
 				CEmuStat |= CeS_TRAP;
 		}
 #ifdef HOST_ARCH_X86
+		if (tier_enabled && !NewNode && CurrIMeta <= 0 &&
+		    !InstrMeta[0].ngen)
+			tier_set(!e_querymark(PC, 1) && !tier_hot(PC));
 		if (!CONFIG_CPUSIM && e_querymark(PC, 1)) {
 			unsigned int P2 = PC;
 			if (NewNode) {
@@ -512,6 +531,9 @@ static unsigned int _Interp86(unsigned int PC, int basemode)
 				InvalidateNodeRange(P2, 1, NULL);
 			}
 			PC = P2;
+			/* the code following a node may still be cold */
+			if (tier_enabled && !e_querymark(PC, 1))
+				tier_set(!tier_hot(PC));
 		}
 #if 0
 		/* this obviously can't happen with current code, but
@@ -522,6 +544,20 @@ static unsigned int _Interp86(unsigned int PC, int basemode)
 #endif
 		P0 = PC;	// P0 changes on instruction boundaries
 		NewNode = 1;
+#if defined(HOST_ARCH_X86) && !defined(SINGLESTEP)
+		if (jitcache_enabled && !CONFIG_CPUSIM && CurrIMeta <= 0 &&
+		    !InstrMeta[0].ngen && !(EFLAGS & TF)) {
+			unsigned int P2 = jitcache_replay(PC, basemode);
+			if (P2 != (unsigned)-1) {
+				/* close the cached sequence where it ended */
+				P0 = P2;
+				CODE_FLUSH();
+				PC = P0;
+				continue;
+			}
+			jitcache_open(PC, basemode);
+		}
+#endif
 		if (debug_level('e')==9) dbug_printf("\n%s",e_print_regs());
 		if (debug_level('e')>2) {
 		    char *ds = e_emu_disasm(MEM_BASE32(P0),(~basemode&3),ocs);
@@ -2663,6 +2699,14 @@ repag0:
 /*de*/	case ESC6:
 /*df*/	case ESC7:  {
 			unsigned char b=Fetch(PC+1);
+#ifdef HOST_ARCH_X86
+			if (tier_sim) {
+				/* the FPU state is kept by the JIT, start
+				   a sequence here */
+				tier_promote(P0);
+				tier_set(0);
+			}
+#endif
 			// extended opcode
 			// 1101.1ooo xxeeerrr -> eeeooo,rrr
 			// D8 -> 00,08,10,18...38
@@ -0,0 +1,456 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+/*
+ * Translation cache kept across runs, enabled with $_jit_cache.
+ *
+ * What is kept is the output of the decoder: the IGen list of every
+ * instruction of a code sequence, as it stands when the sequence is
+ * closed. That list only holds guest addresses and register offsets,
+ * so unlike the generated host code it can be reused by another
+ * process. When the interpreter opens a new sequence at an address
+ * that has a cached entry for the same CPU state and CS base, and the
+ * guest code bytes still match the ones the entry was decoded from,
+ * the list is copied back into InstrMeta and the sequence is closed
+ * right away, skipping the decoder. ProduceCode() still emits the
+ * host code, so the cache doesn't depend on where things are mapped.
+ *
+ * A sequence is only replayed if the decoder would have stopped at
+ * the same place, i.e. no other node starts inside it. The cache is
+ * read at startup and written back at exit. The file is tied to the
+ * dosemu build that wrote it and is ignored by other builds.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <stdint.h>
+#include <stddef.h>
+#include <string.h>
+#include <errno.h>
+#include <unistd.h>
+
+#include "emu.h"
+#include "version.h"
+#include "counters.h"
+#include "emu86.h"
+#include "trees.h"
+#include "codegen.h"
+#include "jitcache.h"
+
+#define JC_MAGIC	"DOSEMUJC"
+#define JC_VERSION	2
+#define JC_HASH_BITS	14
+#define JC_HASH_SIZE	(1 << JC_HASH_BITS)
+#define JC_MAX_SEQS	65536
+#define JC_MAX_VARIANTS	4
+/* bytes after the sequence that the Jcc+JMP folding in _JumpGen() reads */
+#define JC_TAIL		5
+#define JC_META_WORDS	3
+#define JC_GEN_WORDS	9
+
+struct jc_header {
+  char magic[8];
+  uint32_t version;
+  uint32_t build;
+  uint32_t count;
+};
+
+struct jc_rec {
+  uint32_t pc, end, state, cs_base;
+  uint16_t nbytes, nmeta;
+  uint32_t nwords;
+};
+
+struct jc_seq {
+  struct jc_seq *next;
+  struct jc_rec r;
+  uint32_t *words;
+  unsigned char *bytes;
+};
+
+int jitcache_enabled;
+
+static struct jc_seq *jc_hash[JC_HASH_SIZE];
+static int jc_count;
+static unsigned int jc_open_pc;
+static uint32_t jc_open_state;
+static int jc_is_open;
+static int jc_loaded, jc_replayed, jc_stored;
+
+static uint32_t jc_build(void)
+{
+  const char *v = VERSTR;
+  uint32_t h = 2166136261u;
+
+  for (; *v; v++)
+    h = (h ^ (unsigned char)*v) * 16777619u;
+  h = (h ^ sizeof(IGen)) * 16777619u;
+  h = (h ^ NUMGENS) * 16777619u;
+  h = (h ^ JLOOP_LINK) * 16777619u;
+  return h;
+}
+
+/* everything besides the code bytes that the decoder looks at */
+static uint32_t jc_state(int basemode)
+{
+  uint32_t s = basemode & (ADDR16 | DATA16);
+
+  if (V86MODE())
+    s |= 1u << 31;
+  if (REALMODE())
+    s |= 1u << 30;
+  s |= IOPL << 28;
+  if (TheCPU.cr[4] & CR4_VME)
+    s |= 1u << 27;
+  if (TheCPU.StackMask == 0xffffffff)
+    s |= 1u << 26;
+  s |= (TheCPU.cs & 3) << 24;
+  return s;
+}
+
+static unsigned jc_bucket(unsigned int pc, uint32_t state)
+{
+  return ((pc ^ state) * 2654435761u) >> (32 - JC_HASH_BITS);
+}
+
+static struct jc_seq *jc_alloc(const struct jc_rec *r)
+{
+  struct jc_seq *s = malloc(sizeof(*s) + r->nwords * sizeof(uint32_t) +
+      r->nbytes);
+
+  if (!s)
+    return NULL;
+  s->r = *r;
+  s->words = (uint32_t *)(s + 1);
+  s->bytes = (unsigned char *)(s->words + r->nwords);
+  return s;
+}
+
+/* add s, dropping the oldest variants of the same sequence */
+static void jc_insert(struct jc_seq *s)
+{
+  struct jc_seq **pp = &jc_hash[jc_bucket(s->r.pc, s->r.state)];
+  int n = 0;
+
+  s->next = *pp;
+  *pp = s;
+  jc_count++;
+  for (pp = &s->next; *pp;) {
+    struct jc_seq *o = *pp;
+    if (o->r.pc == s->r.pc && o->r.state == s->r.state &&
+        (++n >= JC_MAX_VARIANTS || (o->r.nbytes == s->r.nbytes &&
+        memcmp(o->bytes, s->bytes, s->r.nbytes) == 0))) {
+      *pp = o->next;
+      free(o);
+      jc_count--;
+      continue;
+    }
+    pp = &o->next;
+  }
+}
+
+/* the words must hold exactly nmeta instructions with their gens */
+static int jc_valid(const struct jc_seq *s)
+{
+  const uint32_t *w = s->words, *end = s->words + s->r.nwords;
+  int i;
+
+  for (i = 0; i < s->r.nmeta; i++) {
+    if (end - w < JC_META_WORDS || w[2] > NUMGENS ||
+        end - w < JC_META_WORDS + (long)w[2] * JC_GEN_WORDS)
+      return 0;
+    w += JC_META_WORDS + w[2] * JC_GEN_WORDS;
+  }
+  return w == end;
+}
+
+static void jc_load(void)
+{
+  struct jc_header h;
+  struct jc_rec r;
+  struct jc_seq *list = NULL, **tail = &list, *s;
+  unsigned char *buf, *p, *end;
+  long len;
+  FILE *f;
+  int i, bad = 0;
+
+  f = fopen(config.jit_cache, "r");
+  if (!f)
+    return;
+  fseek(f, 0, SEEK_END);
+  len = ftell(f);
+  rewind(f);
+  buf = malloc(len > 0 ? len : 1);
+  if (!buf || len < (long)sizeof(h) || fread(buf, len, 1, f) != 1) {
+    free(buf);
+    fclose(f);
+    return;
+  }
+  fclose(f);
+
+  memcpy(&h, buf, sizeof(h));
+  if (memcmp(h.magic, JC_MAGIC, sizeof(h.magic)) != 0 ||
+      h.version != JC_VERSION || h.build != jc_build()) {
+    e_printf("JIT cache: ignoring %s, written by another build\n",
+        config.jit_cache);
+    free(buf);
+    return;
+  }
+  p = buf + sizeof(h);
+  end = buf + len;
+  for (i = 0; i < h.count && i < JC_MAX_SEQS; i++) {
+    size_t wlen;
+
+    if (end - p < (long)sizeof(r)) {
+      bad = 1;
+      break;
+    }
+    memcpy(&r, p, sizeof(r));
+    p += sizeof(r);
+    if (r.nmeta == 0 || r.nmeta >= MAXINODES || r.nbytes == 0 ||
+        r.nwords < r.nmeta * JC_META_WORDS ||
+        r.nwords > r.nmeta * (JC_META_WORDS + NUMGENS * JC_GEN_WORDS)) {
+      bad = 1;
+      break;
+    }
+    wlen = r.nwords * sizeof(uint32_t);
+    if (end - p < (long)(wlen + r.nbytes)) {
+      bad = 1;
+      break;
+    }
+    s = jc_alloc(&r);
+    if (!s)
+      break;
+    memcpy(s->words, p, wlen);
+    memcpy(s->bytes, p + wlen, r.nbytes);
+    p += wlen + r.nbytes;
+    s->next = NULL;
+    *tail = s;
+    tail = &s->next;
+    if (!jc_valid(s)) {
+      bad = 1;
+      break;
+    }
+  }
+  free(buf);
+
+  /* one broken record means the file can't be trusted at all */
+  if (bad)
+    e_printf("JIT cache: ignoring %s, record %i is corrupt\n",
+        config.jit_cache, i);
+  while (list) {
+    s = list;
+    list = s->next;
+    if (bad) {
+      free(s);
+      continue;
+    }
+    jc_insert(s);
+    jc_loaded++;
+  }
+}
+
+static void jitcache_save(void)
+{
+  struct jc_header h;
+  char *tmpname;
+  FILE *f;
+  int i, ret;
+
+  e_printf("JIT cache: %i loaded, %i replayed, %i stored\n",
+      jc_loaded, jc_replayed, jc_stored);
+  if (!jc_stored)
+    return;
+  if (asprintf(&tmpname, "%s.tmp", config.jit_cache) == -1)
+    return;
+  f = fopen(tmpname, "w");
+  if (!f) {
+    error("JIT cache: can't create %s: %s\n", tmpname, strerror(errno));
+    free(tmpname);
+    return;
+  }
+  memcpy(h.magic, JC_MAGIC, sizeof(h.magic));
+  h.version = JC_VERSION;
+  h.build = jc_build();
+  h.count = jc_count;
+  ret = fwrite(&h, sizeof(h), 1, f) == 1 ? 0 : -1;
+  for (i = 0; i < JC_HASH_SIZE && ret == 0; i++) {
+    struct jc_seq *s;
+    for (s = jc_hash[i]; s && ret == 0; s = s->next) {
+      if (fwrite(&s->r, sizeof(s->r), 1, f) != 1 ||
+          fwrite(s->words, sizeof(uint32_t), s->r.nwords, f) !=
+              s->r.nwords ||
+          fwrite(s->bytes, 1, s->r.nbytes, f) != s->r.nbytes)
+        ret = -1;
+    }
+  }
+  if (fclose(f) != 0)
+    ret = -1;
+  if (ret != 0 || rename(tmpname, config.jit_cache) != 0) {
+    error("JIT cache: failed to write %s: %s\n", config.jit_cache,
+        strerror(errno));
+    unlink(tmpname);
+  }
+  free(tmpname);
+}
+
+void jitcache_init(void)
+{
+  if (!config.jit_cache)
+    return;
+  jc_load();
+  e_printf("JIT cache: %i sequences from %s\n", jc_loaded, config.jit_cache);
+  register_exit_handler(jitcache_save);
+  jitcache_enabled = 1;
+}
+
+/* the interpreter starts decoding a new sequence at pc */
+void jitcache_open(unsigned int pc, int basemode)
+{
+  jc_open_pc = pc;
+  jc_open_state = jc_state(basemode);
+  jc_is_open = 1;
+}
+
+static int jc_match(const struct jc_seq *s)
+{
+  int i;
+
+  for (i = 0; i < s->r.nbytes; i++) {
+    if (Fetch(s->r.pc + i) != s->bytes[i])
+      return 0;
+  }
+  return 1;
+}
+
+/* the decoder stops at code that is already translated, so must we */
+static int jc_unmarked(const struct jc_seq *s)
+{
+  const uint32_t *w = s->words;
+  int i;
+
+  for (i = 0; i < s->r.nmeta; i++) {
+    if (i && e_querymark(s->r.pc + w[0], 1))
+      return 0;
+    w += JC_META_WORDS + w[2] * JC_GEN_WORDS;
+  }
+  return 1;
+}
+
+static void jc_restore(const struct jc_seq *s)
+{
+  const uint32_t *w = s->words;
+  int i, j;
+
+  for (i = 0; i < s->r.nmeta; i++) {
+    IMeta *I = &InstrMeta[i];
+
+    memset(I, 0, offsetof(IMeta, gen));
+    I->npc = s->r.pc + *w++;
+    I->flags = *w++;
+    I->ngen = *w++;
+    for (j = 0; j < I->ngen; j++) {
+      IGen *IG = &I->gen[j];
+      IG->op = *w++;
+      IG->mode = *w++;
+      IG->ovds = *w++;
+      IG->p0 = *w++;
+      IG->p1 = *w++;
+      IG->p2 = *w++;
+      IG->p3 = *w++;
+      IG->p4 = *w++;
+      IG->lt = *w++ ? &InstrMeta[0].clink : NULL;
+    }
+  }
+  InstrMeta[0].ncount = s->r.nmeta;
+  InstrMeta[i].ngen = 0;
+  InstrMeta[i].flags = 0;
+  CurrIMeta = s->r.nmeta;
+}
+
+/* Fill InstrMeta with a cached sequence starting at pc. Returns the
+ * address the sequence ends at, or -1 if there is none. */
+unsigned int jitcache_replay(unsigned int pc, int basemode)
+{
+  uint32_t state = jc_state(basemode);
+  struct jc_seq *s;
+
+  jc_is_open = 0;
+  for (s = jc_hash[jc_bucket(pc, state)]; s; s = s->next) {
+    if (s->r.pc != pc || s->r.state != state || s->r.cs_base != LONG_CS)
+      continue;
+    if (!jc_match(s)) {
+      count_event(CNT_JIT_CACHE_STALE);
+      continue;
+    }
+    if (!jc_unmarked(s))
+      continue;
+    jc_restore(s);
+    jc_replayed++;
+    count_event(CNT_JIT_CACHE_HIT);
+    return s->r.end;
+  }
+  return (unsigned)-1;
+}
+
+/* called when the sequence in InstrMeta is closed at end */
+void jitcache_store(unsigned int end)
+{
+  struct jc_rec r;
+  struct jc_seq *s;
+  uint32_t *w;
+  int i, j;
+
+  if (!jc_is_open)
+    return;
+  jc_is_open = 0;
+  if (CurrIMeta <= 0 || InstrMeta[0].npc != jc_open_pc ||
+      end <= jc_open_pc || jc_count >= JC_MAX_SEQS)
+    return;
+  /* the bytes past the end must not cross into a page the guest
+   * may not have mapped */
+  if (((end - 1) ^ (end + JC_TAIL - 1)) & ~(PAGE_SIZE - 1))
+    return;
+  r.pc = jc_open_pc;
+  r.end = end;
+  r.state = jc_open_state;
+  r.cs_base = LONG_CS;
+  if (end - r.pc + JC_TAIL > 0xffff)
+    return;
+  r.nbytes = end - r.pc + JC_TAIL;
+  r.nmeta = CurrIMeta;
+  r.nwords = 0;
+  for (i = 0; i < CurrIMeta; i++)
+    r.nwords += JC_META_WORDS + InstrMeta[i].ngen * JC_GEN_WORDS;
+
+  s = jc_alloc(&r);
+  if (!s)
+    return;
+  w = s->words;
+  for (i = 0; i < CurrIMeta; i++) {
+    IMeta *I = &InstrMeta[i];
+
+    *w++ = I->npc - r.pc;
+    *w++ = I->flags;
+    *w++ = I->ngen;
+    for (j = 0; j < I->ngen; j++) {
+      IGen *IG = &I->gen[j];
+      *w++ = IG->op;
+      *w++ = IG->mode;
+      *w++ = IG->ovds;
+      *w++ = IG->p0;
+      *w++ = IG->p1;
+      *w++ = IG->p2;
+      *w++ = IG->p3;
+      *w++ = IG->p4;
+      *w++ = IG->lt != NULL;
+    }
+  }
+  for (i = 0; i < r.nbytes; i++)
+    s->bytes[i] = Fetch(r.pc + i);
+  jc_insert(s);
+  jc_stored++;
+}
@@ -0,0 +1,17 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+#ifndef _EMU86_JITCACHE_H
+#define _EMU86_JITCACHE_H
+
+extern int jitcache_enabled;
+
+void jitcache_init(void);
+void jitcache_open(unsigned int pc, int basemode);
+unsigned int jitcache_replay(unsigned int pc, int basemode);
+void jitcache_store(unsigned int end);
+
+#endif
@@ -41,6 +41,7 @@
 
 #include "mapping.h"
 #include "dosemu_debug.h"
+#include "counters.h"
 #include "dlmalloc.h"
 #include "emu86.h"
 #include "trees.h"
@@ -49,6 +50,12 @@
 
 #define CGRAN		0		/* 2^n */
 #define CGRMASK		(0xfffff>>CGRAN)
+/* Writes let through to a protected page before it is unprotected.
+ * Each costs two mprotect() calls, about 3-4us together, so a page
+ * that only takes data writes wastes at most ~60us per protection
+ * before it falls back to invalidating its code, which then has to be
+ * parsed and translated again. */
+#define WTHRU_MAX	16
 
 #ifndef UINT64_WIDTH
 #define UINT64_WIDTH 64
@@ -59,6 +66,7 @@ typedef struct _mpmap {
 	int mega;
 	unsigned char pagemap[32];	/* (32*8)=256 pages *4096 = 1M */
 	uint64_t subpage[(0x100000>>CGRAN)/UINT64_WIDTH];	/* 2^CGRAN-byte granularity, 1M/2^CGRAN bits */
+	unsigned char wthru[256];	/* writes let through since protected */
 } tMpMap;
 
 static tMpMap *MpH = NULL;
@@ -105,6 +113,8 @@ static int AddMpMap(unsigned int addr, unsigned int aend, int onoff)
 		M->next = MpH; MpH = M;
 		M->mega = (page>>8);
 	    }
+	    if (onoff)
+		M->wthru[page&255] = 0;
 	    if (bp < 32) {
 		bs |= (((unsigned)(onoff? set_bit(page&255, M->pagemap) :
 			    clear_bit(page&255, M->pagemap)) & 1) << bp);
@@ -363,6 +373,44 @@ static int e_munprotect(unsigned int addr, size_t len)
 	return ret;
 }
 
+/* Temporarily unprotect a protected page for a write that doesn't
+ * change its code (anymore), so that the code in the rest of the page
+ * stays valid. Returns 0 if the range crosses a page or if the page
+ * had too many writes since it was protected; the caller then has to
+ * invalidate the whole page as it did before. */
+int e_wthru_begin(unsigned int addr, size_t len)
+{
+	unsigned int page = addr & PAGE_MASK;
+	tMpMap *M = FindM(addr);
+
+	if (M == NULL || ((addr+len-1) & PAGE_MASK) != page)
+		return 0;
+	if (M->wthru[(page >> PAGE_SHIFT) & 255] >= WTHRU_MAX)
+		return 0;
+	if (mprotect_mapping(MAPPING_CPUEMU, page, PAGE_SIZE,
+			PROT_READ|PROT_WRITE|PROT_EXEC) < 0) {
+		e_printf("MPWTHRU: %s\n",strerror(errno));
+		return 0;
+	}
+	M->wthru[(page >> PAGE_SHIFT) & 255]++;
+	count_event(CNT_SMC_WTHRU);
+	if (debug_level('e')>1)
+		dbug_printf("MPMAP: write through %08x len=%zx\n",addr,len);
+	return 1;
+}
+
+void e_wthru_end(unsigned int addr)
+{
+	unsigned int page = addr & PAGE_MASK;
+
+	/* the write may have gone to the last code of the page */
+	if (!e_querymprot(page))
+		return;
+	if (mprotect_mapping(MAPPING_CPUEMU, page, PAGE_SIZE,
+			PROT_READ|PROT_EXEC) < 0)
+		e_printf("MPWTHRU: %s\n",strerror(errno));
+}
+
 #ifdef HOST_ARCH_X86
 int e_handle_pagefault(dosaddr_t addr, unsigned err, sigcontext_t *scp)
 {
@@ -450,6 +498,7 @@ int e_handle_pagefault(dosaddr_t addr, unsigned err, sigcontext_t *scp)
 #endif
 	/* We HAVE to invalidate all the code in the page
 	 * if the page is going to be unprotected */
+	count_event(CNT_SMC_PAGE);
 	addr &= PAGE_MASK;
 	InvalidateNodeRange(addr, PAGE_SIZE, p);
 	/* now go back and perform the faulting op */
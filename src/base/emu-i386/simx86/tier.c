@@ -0,0 +1,167 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+/*
+ * Tiered execution, enabled with $_cpu_emu = "vm86tiered"/"fulltiered".
+ *
+ * The JIT back-end is set up as usual, but a code sequence is only
+ * translated once the interpreter has entered it TIER_HOT times.
+ * Until then it is run by the simulator, so code that runs once or a
+ * few times (startup code, installers, code that modifies itself)
+ * doesn't pay for the translation and doesn't get its pages write
+ * protected. Code that already has a node is always run by the JIT.
+ * When a node is invalidated, its sequence has to become hot again
+ * before it is translated again.
+ *
+ * The tier can only change between sequences, when no instruction is
+ * pending in InstrMeta. The two back-ends don't share all of their
+ * state, so tier_set() converts it:
+ *  - the simulator keeps lazy flags in RFL, the JIT keeps them in
+ *    EFLAGS
+ *  - the simulator addresses memory with dosaddr_t, the JIT adds
+ *    mem_base to the segment bases
+ * The FPU state stays with the JIT; instructions that use it are
+ * always run by the JIT. Outside of Interp86() the JIT tier is active,
+ * so the rest of dosemu sees a plain JIT CPU.
+ */
+
+#include "emu.h"
+#include "counters.h"
+#include "emu86.h"
+#include "codegen-arch.h"
+#include "tier.h"
+
+#define TIER_HASH_BITS	12
+#define TIER_HASH_SIZE	(1 << TIER_HASH_BITS)
+/* sequence entries before a sequence is translated */
+#define TIER_HOT	32
+
+struct tier_ent {
+  unsigned int pc;
+  unsigned int count;
+};
+
+struct tier_gen {
+  void (*gen)(int op, int mode, ...);
+  void (*addrgen)(int op, int mode, ...);
+  unsigned int (*close)(unsigned int PC, int mode, int ln);
+};
+
+int tier_enabled;
+int tier_sim;
+
+/* direct mapped, a colliding sequence starts counting again */
+static struct tier_ent tier_hash[TIER_HASH_SIZE];
+static struct tier_gen tier_gens[2];
+
+static inline struct tier_ent *tier_lookup(unsigned int pc)
+{
+  return &tier_hash[(pc ^ (pc >> TIER_HASH_BITS)) & (TIER_HASH_SIZE - 1)];
+}
+
+/* return 1 if the sequence at pc should be translated */
+int tier_hot(unsigned int pc)
+{
+  struct tier_ent *e = tier_lookup(pc);
+
+  if (e->pc != pc) {
+    e->pc = pc;
+    e->count = 0;
+  }
+  if (e->count >= TIER_HOT)
+    return 1;
+  if (++e->count == TIER_HOT) {
+    count_event(CNT_TIER_UP);
+    return 1;
+  }
+  count_event(CNT_TIER_SIM);
+  return 0;
+}
+
+/* translate the sequence at pc the next time it is entered */
+void tier_promote(unsigned int pc)
+{
+  struct tier_ent *e = tier_lookup(pc);
+
+  if (e->pc != pc || e->count < TIER_HOT)
+    count_event(CNT_TIER_UP);
+  e->pc = pc;
+  e->count = TIER_HOT;
+}
+
+/* count the entries of the sequence at pc again, after its node was
+ * invalidated */
+void tier_demote(unsigned int pc)
+{
+  struct tier_ent *e = tier_lookup(pc);
+
+  e->pc = pc;
+  e->count = 0;
+}
+
+static void tier_rebase(unsigned int delta)
+{
+  SDTR *segs[] = {
+    &TheCPU.cs_cache, &TheCPU.ds_cache, &TheCPU.es_cache,
+    &TheCPU.ss_cache, &TheCPU.fs_cache, &TheCPU.gs_cache,
+  };
+  int i;
+
+  for (i = 0; i < sizeof(segs) / sizeof(segs[0]); i++) {
+    segs[i]->BoundL += delta;
+    /* 0 is left for system segments, see SetSegProt() */
+    if (segs[i]->BoundH)
+      segs[i]->BoundH += delta;
+  }
+  TheCPU.mem_base += delta;
+}
+
+void tier_set(int sim)
+{
+  struct tier_gen *g;
+
+  if (sim == tier_sim)
+    return;
+  if (sim) {
+    tier_rebase(-TheCPU.mem_base);
+    RFL.valid = V_INVALID;
+  } else {
+    FlagSync_All();
+    tier_rebase((uintptr_t)mem_base);
+  }
+  g = &tier_gens[sim];
+  Gen = g->gen;
+  AddrGen = g->addrgen;
+  CloseAndExec = g->close;
+  tier_sim = sim;
+  if (debug_level('e')>1)
+    e_printf("TIER: %s\n", sim ? "simulator" : "JIT");
+}
+
+/* called after InitGen_x86() */
+void tier_init(void)
+{
+  struct tier_gen *g = &tier_gens[0];
+
+  tier_sim = 0;
+  tier_enabled = config.cputiered && !config.cpusim;
+  if (!tier_enabled)
+    return;
+  g->gen = Gen;
+  g->addrgen = AddrGen;
+  g->close = CloseAndExec;
+  /* only sets the pointers and resets the lazy flags */
+  InitGen_sim();
+  g = &tier_gens[1];
+  g->gen = Gen;
+  g->addrgen = AddrGen;
+  g->close = CloseAndExec;
+  g = &tier_gens[0];
+  Gen = g->gen;
+  AddrGen = g->addrgen;
+  CloseAndExec = g->close;
+  e_printf("TIER: sequences are translated after %d entries\n", TIER_HOT);
+}
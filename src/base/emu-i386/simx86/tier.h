@@ -0,0 +1,19 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+#ifndef _EMU86_TIER_H
+#define _EMU86_TIER_H
+
+extern int tier_enabled;
+extern int tier_sim;
+
+void tier_init(void);
+int tier_hot(unsigned int pc);
+void tier_promote(unsigned int pc);
+void tier_demote(unsigned int pc);
+void tier_set(int sim);
+
+#endif
@@ -49,6 +49,8 @@
 #include "emu86.h"
 #include "dlmalloc.h"
 #include "codegen-arch.h"
+#include "counters.h"
+#include "tier.h"
 
 IMeta	*InstrMeta;
 int	CurrIMeta = -1;
@@ -78,12 +80,22 @@ int TreeCleanups = 0;
 
 #ifdef HOST_ARCH_X86
 
-#define FINDTREE_CACHE_HASH_MASK 0xfff
-static TNode *findtree_cache[FINDTREE_CACHE_HASH_MASK+1];
-
 TNode *TNodePool;
 int NodeLimit = 10000;
 
+/* All nodes of the tree indexed by key, so that FindTree() doesn't
+ * have to walk the tree; the tree is only used for the ordered walks
+ * of InvalidateNodeRange() and TraverseAndClean(). Open addressing
+ * with linear probing, a slot holds the position+1 of the node in
+ * TNodePool or 0 if empty. With twice as many slots as there are
+ * nodes in the pool the probe sequences stay short. */
+#define NODE_INDEX_BITS		18
+#define NODE_INDEX_MASK		((1 << NODE_INDEX_BITS) - 1)
+#if (1 << NODE_INDEX_BITS) < 2 * NODES_IN_POOL
+#error node index too small for NODES_IN_POOL
+#endif
+static unsigned int *node_index;
+
 #define RANGE_IN_RANGE(al,ah,l,h)	({int _l2=(al);\
 	int _h2=(ah); ((_h2 >= (l)) && (_l2 < (h))); })
 #define ADDR_IN_RANGE(a,l,h)		({typeof(a) _a2=(a);	\
@@ -116,6 +128,47 @@ static inline void Tfree(TNode *G)
 
 /////////////////////////////////////////////////////////////////////////////
 
+static inline unsigned int node_hash(int key)
+{
+  return ((unsigned int)key * 0x9e3779b1u) >> (32 - NODE_INDEX_BITS);
+}
+
+/* the slot holding key, or the empty slot where it would go */
+static inline unsigned int *node_slot(int key)
+{
+  unsigned int i = node_hash(key);
+  unsigned int n;
+
+  while ((n = node_index[i]) != 0 && TNodePool[n-1].key != key)
+    i = (i + 1) & NODE_INDEX_MASK;
+  return &node_index[i];
+}
+
+static inline void node_index_set(TNode *G)
+{
+  *node_slot(G->key) = G - TNodePool + 1;
+}
+
+static void node_index_del(int key)
+{
+  unsigned int *s = node_slot(key);
+  unsigned int i, j;
+
+  if (*s == 0) return;
+  i = s - node_index;
+  /* move back the following entries of the cluster that would not
+   * be found anymore with slot i empty */
+  for (j = (i + 1) & NODE_INDEX_MASK; node_index[j];
+       j = (j + 1) & NODE_INDEX_MASK) {
+    unsigned int h = node_hash(TNodePool[node_index[j]-1].key);
+    if (((j - h) & NODE_INDEX_MASK) >= ((j - i) & NODE_INDEX_MASK)) {
+      node_index[i] = node_index[j];
+      i = j;
+    }
+  }
+  node_index[i] = 0;
+}
+
 static inline void datacopy(TNode *nd, TNode *ns)
 {
   char *s = (char *)&(ns->key);
@@ -323,6 +376,7 @@ void avltr_delete (const int key)
   if (debug_level('e')>2)
 	e_printf("Found node to delete at %p(%08x)\n",p,p->key);
 #endif
+  node_index_del(key);
   tree->count--;
   ninodes = tree->count;
 
@@ -383,6 +437,7 @@ void avltr_delete (const int key)
 /**/	    if (t->addr==NULL) leavedos_main(0x8130);
 	    /* keep the node reference to itself */
 	    t->mblock->bkptr = t;
+	    node_index_set(t);
 	    s->addr = NULL;
 	    s->mblock = NULL;
 	    memset(&s->clink, 0, sizeof(linkdesc));
@@ -549,6 +604,8 @@ static void avltr_init(void)
   }
   G->link[0] = TNodePool;
 
+  node_index = calloc(NODE_INDEX_MASK + 1, sizeof(*node_index));
+
   InstrMeta = malloc(sizeof(IMeta) * MAXINODES);
   memset(InstrMeta, 0, sizeof(IMeta));
  }
@@ -616,6 +673,8 @@ void avltr_destroy(void)
       }
   }
 quit:
+  free(node_index);
+  node_index = NULL;
   free(InstrMeta);
 #ifdef PROFILE
   if (debug_level('e')) {
@@ -644,11 +703,11 @@ unsigned int FindPC(unsigned char *addr)
       /* walk to next node */
       G = NEXTNODE(G);
       if (G == &CollectTree.root) break;
-      if (!G->addr || !G->pmeta || G->alive<=0) continue;
+      if (!G->addr || !G->mblock || G->alive<=0) continue;
       ahE = G->addr + G->len;
       if (!ADDR_IN_RANGE(addr,G->addr,ahE)) continue;
       e_printf("### FindPC: Found node %p->%p..%p", addr,G->addr,ahE);
-      AP = G->pmeta;
+      AP = G->mblock->meta;
       for (i=0; i<G->seqnum; i++) {
 	  e_printf("     %08x:%p",(G->key+AP->dnpc),G->addr+AP->daddr);
 	  if (addr < G->addr+AP->daddr) break;
@@ -837,10 +896,10 @@ void DumpTree (FILE *fd)
 	    B = B->next;
 	}
     }
-    if (G->addr && G->pmeta) {
+    if (G->addr && G->mblock) {
 	int i, j, k;
 	unsigned char *p = G->addr;
-	Addr2Pc *AP = G->pmeta;
+	Addr2Pc *AP = G->mblock->meta;
 	for (i=0; i<G->seqnum; i++) {
 	    fprintf(fd,"     %08x:%p",(G->key+AP->dnpc),G->addr+AP->daddr);
 	    k = 0;
@@ -957,6 +1016,7 @@ TNode *Move2Tree(IMeta *I0, CodeBuf *GenCodeBuf)
   }
 
   key = I0->npc;
+  count_event(CNT_JIT_XLATE);
 
   found = 0;
   nG = avltr_probe(key, &found);
@@ -995,7 +1055,7 @@ TNode *Move2Tree(IMeta *I0, CodeBuf *GenCodeBuf)
   nG->len = len = I0->totlen;
   nG->flags = I0->flags;
   nG->alive = NODELIFE(nG);
-  findtree_cache[key&FINDTREE_CACHE_HASH_MASK] = nG;
+  node_index_set(nG);
 
   /* allocate the extra memory used by the node. This includes the
    * translated code plus the table of correspondances between source
@@ -1013,8 +1073,6 @@ TNode *Move2Tree(IMeta *I0, CodeBuf *GenCodeBuf)
   nG->mblock->bkptr = nG;
   cp = &nG->mblock->selfptr;
   *cp = cp;
-  nG->pmeta = mallmb->meta;
-  if (nG->pmeta==NULL) leavedos_main(0x504d45);
   nG->addr = (unsigned char *)&mallmb->meta[nap];
 
   /* setup structures for inter-node linking */
@@ -1034,13 +1092,20 @@ TNode *Move2Tree(IMeta *I0, CodeBuf *GenCodeBuf)
   }
   else
     nG->clink.nt_link.abs = I0->clink.nt_link.abs;
+  if (I0->clink.t_type == JMP_INDIRECT && I0->clink.t_link.rel) {
+    /* inline cache of a near indirect jump: t_link is the compared
+     * target, nt_link the jmp to its node */
+    nG->clink.t_link.abs  = (unsigned int *)(nG->addr + I0->clink.t_link.rel);
+    nG->clink.nt_link.abs = (unsigned int *)(nG->addr + I0->clink.nt_link.rel);
+    nG->clink.unlinked_jmp_targets |= TARGET_IC;
+  }
   if ((debug_level('e')>3) && nG->clink.t_type)
 	dbug_printf("Link %d: %p:%08x\n",nG->clink.t_type,
 		nG->clink.nt_link.abs,
 		(nG->clink.t_type>JMP_LINK? *nG->clink.nt_link.abs:0));
 
   /* setup source/xlated instruction offsets */
-  ap = nG->pmeta;
+  ap = mallmb->meta;
   I = I0;
   for (i=0; i<nG->seqnum; i++) {
 	ap->daddr = I->daddr;
@@ -1069,70 +1134,38 @@ TNode *Move2Tree(IMeta *I0, CodeBuf *GenCodeBuf)
 TNode *FindTree(int key)
 {
   TNode *I;
+  unsigned int *slot;
   static int tccount=0;
-#ifdef PROFILE
-  hitimer_t t0 = 0;
-#endif
 
   if (TheCPU.sigprof_pending) {
 	CollectStat();
 	TheCPU.sigprof_pending = 0;
   }
 
-  /* fast path: using cache indexed by low 12 bits of PC:
-     ~99.99% success rate */
-  I = findtree_cache[key&FINDTREE_CACHE_HASH_MASK];
-  if (I && (I->alive>0) && (I->key==key)) {
-	if (debug_level('e')) {
-	    if (debug_level('e')>4)
-		e_printf("Found key %08x via cache\n", key);
+  slot = node_slot(key);
+  I = *slot ? &TNodePool[*slot-1] : NULL;
+  if (I && I->addr && (I->alive>0)) {
+	if (slot == &node_index[node_hash(key)]) {
+	    count_event(CNT_JIT_HIT_FAST);
 #ifdef PROFILE
-	    NodesFastFound++;
+	    if (debug_level('e')) NodesFastFound++;
 #endif
 	}
-	I->alive = NODELIFE(I);
-	return I;
-  }
-  if (!e_querymark(key, 1))
-	return NULL;
-
+	else {
+	    count_event(CNT_JIT_HIT);
 #ifdef PROFILE
-  if (debug_level('e')) t0 = GETTSC();
+	    if (debug_level('e')) NodesFound++;
 #endif
-  I = CollectTree.root.link[0];
-  if (I == NULL) return NULL;	/* always NULL the first time! */
-
-  for (;;) {
-      int diff = (key - I->key);
-
-      if (diff < 0) {
-	  I = I->link[0];
-	  if (I == NULL) goto endsrch;
-      }
-      else if (diff > 0) {
-	  if (I->rtag == MINUS) goto endsrch;
-	  I = I->link[1];
-      }
-      else break;
-  }
-
-  if (I && I->addr && (I->alive>0)) {
-	if (debug_level('e')>3) e_printf("Found key %08x\n",key);
-	I->alive = NODELIFE(I);
-	findtree_cache[key&FINDTREE_CACHE_HASH_MASK] = I;
-#ifdef PROFILE
-	if (debug_level('e')) {
-	    NodesFound++;
-	    SearchTime += (GETTSC() - t0);
 	}
-#endif
+	if (debug_level('e')>4)
+	    e_printf("Found key %08x\n", key);
+	I->alive = NODELIFE(I);
 	return I;
   }
+  count_event(CNT_JIT_MISS);
+  if (!e_querymark(key, 1))
+	return NULL;
 
-endsrch:
-#ifdef PROFILE
-  if (debug_level('e')) SearchTime += (GETTSC() - t0);
-#endif
   if ((ninodes>500) && (((++tccount) >= CleanFreq) || NodesCleaned)) {
 	while (NodesCleaned > 0) {
 	    (void)TraverseAndClean();
@@ -1168,7 +1201,7 @@ endsrch:
 
 static void BreakNode(TNode *G, unsigned char *eip)
 {
-  Addr2Pc *A = G->pmeta;
+  Addr2Pc *A = G->mblock->meta;
   int ebase;
   unsigned char *p;
   int i;
@@ -1260,6 +1293,10 @@ void InvalidateNodeRange(int al, int len, unsigned char *eip)
 	    e_unmarkpage(G->seqbase, G->seqlen);
 	    NodeUnlinker(G);
 	    NodesCleaned++;
+	    /* code that changes is simulated for a while before it is
+	       translated again */
+	    if (tier_enabled)
+		tier_demote(G->key);
 	    /* if the current eip is in *any* chunk of code that is deleted
 	        (not just the one written to)
 	       then we need to break the node immediately to go back to
@@ -1302,10 +1339,12 @@ void e_invalidate(unsigned data, int cnt)
 	/* for low mappings only invalidate if code, not if data */
 	if (LINEAR2UNIX(data) != MEM_BASE32(data)) {
 #ifdef HOST_ARCH_X86
-		if (!CONFIG_CPUSIM && e_querymark(data, cnt))
+		if (!CONFIG_CPUSIM && e_querymark(data, cnt)) {
 			// no need to invalidate the whole page here,
 			// as the page does not need to be unprotected
+			count_event(CNT_SMC_CODE);
 			InvalidateNodeRange(data, cnt, 0);
+		}
 #endif
 		return;
 	}
@@ -57,6 +57,7 @@ typedef struct _bkref {
 
 #define TARGET_T 1
 #define TARGET_NT 2
+#define TARGET_IC 4
 
 typedef struct _lnkdesc {
 	unsigned char t_type;
@@ -129,8 +130,7 @@ typedef struct avltr_node
 /* -------------------------------------------------------------- */
 	int alive;
 	CodeBuf *mblock;
-	unsigned char *addr;
-	Addr2Pc *pmeta;
+	unsigned char *addr;	/* code, behind the Addr2Pc table in mblock */
 	unsigned short len, flags, seqlen, seqnum __attribute__ ((packed));
 	int seqbase;
 	linkdesc clink;
@@ -170,7 +170,9 @@ void dump_config_status(void (*printfunc)(const char *, ...))
                  config.pci, config.rdtsc, config.mathco, config.smp);
     (*print)("cpuspeed %d\n", config.CPUSpeedInMhz);
 #ifdef X86_EMULATOR
-    (*print)("cpuemu %d\n", config.cpuemu);
+    (*print)("cpuemu %d\ncputiered %d\n", config.cpuemu, config.cputiered);
+    (*print)("jit_cache \"%s\"\n",
+        (config.jit_cache ? config.jit_cache : ""));
 #endif
 
     if (config_check_only) mapping_init();
@@ -252,12 +254,21 @@ void dump_config_status(void (*printfunc)(const char *, ...))
         config.tty_lockdir, config.tty_lockfile, config.tty_lockbinary);
     (*print)("num_ser %d\nnum_lpt %d\nfastfloppy %d\nfull_file_locks %d\n",
         config.num_ser, config.num_lpt, config.fastfloppy, config.full_file_locks);
+    (*print)("mangle_cache %d\nmangle_cache_file \"%s\"\n",
+        config.mangle_cache, config.mangle_cache_file ?: "");
     (*print)("emusys \"%s\"\n",
         (config.emusys ? config.emusys : ""));
     (*print)("vbios_post %d\ndetach %d\n",
         config.vbios_post, config.detach);
     (*print)("debugout \"%s\"\n",
         (config.debugout ? config.debugout : ""));
+    (*print)("evlog_file \"%s\"\n",
+        (config.evlog_file ? config.evlog_file : ""));
+    (*print)("log_ring %d\n", config.log_ring);
+    (*print)("guest_profile \"%s\"\n",
+        (config.guest_profile ? config.guest_profile : ""));
+    (*print)("counters_file \"%s\"\n",
+        (config.counters_file ? config.counters_file : ""));
     {
 	char buf[256];
 	GetDebugFlagsHelper(buf, 0);
@@ -309,6 +320,7 @@ void dump_config_status(void (*printfunc)(const char *, ...))
     (*print)("pcm_hpf %i\nmidi_file %s\nwav_file %s\n",
 	config.pcm_hpf, config.midi_file, config.wav_file);
     (*print)("\ncli_timeout %d\n", config.cli_timeout);
+    (*print)("snapshot \"%s\"\n", config.snapshot_file ?: "");
     (*print)("\nJOYSTICK:\njoy_device0 \"%s\"\njoy_device1 \"%s\"\njoy_dos_min %i\njoy_dos_max %i\njoy_granularity %i\njoy_latency %i\n",
         config.joy_device[0], config.joy_device[1], config.joy_dos_min, config.joy_dos_max, config.joy_granularity, config.joy_latency);
     (*print)("\nFS:\nset_int_hooks %i\nforce_int_revect %i\nforce_fs_redirect %i\n\n",
@@ -1035,7 +1047,7 @@ config_init(int argc, char **argv)
     int             nodosrc = 0;
     char           *basename;
     const char * const getopt_string =
-       "23456ABC::c::D:d:E:e:f:H:hI:K:k::L:M:mNno:P:qSsTt::VvwXx:Y"
+       "23456ABb:C::c::D:d:E:e:f:H:hI:J:K:k::L:M:mNno:P:qSsTt::VvwXx:Y"
        "gp"/*NOPs kept for compat (not documented in usage())*/;
 
     if (getenv("DOSEMU_INVOKED_NAME"))
@@ -1348,6 +1360,19 @@ config_init(int argc, char **argv)
 	    }
 	    break;
 	}
+	case 'J':
+	    free(config.evlog_file);
+	    config.evlog_file = strdup(optarg);
+	    break;
+	case 'b':
+	    g_printf("batch manifest set to %s\n", optarg);
+	    if (!exists_file(optarg)) {
+		error("Manifest %s does not exist\n", optarg);
+		config.exitearly = 1;
+		break;
+	    }
+	    config.batch_file = optarg;
+	    break;
 	case 'T':
 	    config.exit_on_cmd = 0;
 	    break;
@@ -1423,6 +1448,7 @@ usage(char *basename)
 	"    -2,3,4,5,6 choose 286, 386, 486 or 586 or 686 CPU\n"
 	"    -A boot from first defined floppy disk (A)\n"
 	"    -B boot from second defined floppy disk (B) (#)\n"
+	"    -b FILE run the DOS commands listed in FILE, results to FILE.results\n"
 	"    -C boot from first defined hard disk (C)\n"
 	"    -c use PC console video (!%%)\n"
 	"    -X run in X Window (#)\n"
@@ -1440,6 +1466,7 @@ usage(char *basename)
 	"    -n bypass the user configuration file (.dosemurc)\n"
 	"    -L load and execute DEXE File\n"
 	"    -I insert config statements (on commandline)\n"
+	"    -J FILE write structured events to FILE as JSON lines\n"
 	"    -i[bootdir] (re-)install a DOS from bootdir or interactively\n"
 	"    -h display this help\n"
 	"    -H wait for dosdebug terminal at startup and pass dflags\n"
@@ -39,6 +39,7 @@
 #include "kvm.h"
 #include "mapping.h"
 #include "vgaemu.h"
+#include "logring.h"
 
 #define GFX_CHARS       0xffa6e
 
@@ -71,6 +72,9 @@ void stdio_init(void)
   setbuf(stdout, NULL);
 
   if(dbg_fd) {
+    /* the config is parsed and the debug file opened by config_init() */
+    if (config.log_ring)
+      logring_init(config.log_ring);
     warn("DBG_FD already set\n");
     return;
   }
@@ -85,6 +89,8 @@ void stdio_init(void)
     }
     free(config.debugout);
     config.debugout = NULL;
+    if (config.log_ring)
+      logring_init(config.log_ring);
   }
   else
   {
@@ -203,6 +203,13 @@ int memcheck_is_reserved(dosaddr_t addr_start, uint32_t size,
   return TRUE;
 }
 
+unsigned char memcheck_get_type(dosaddr_t addr)
+{
+  if (addr >= MEM_SIZE)
+    return 0;
+  return mem_map[addr / GRAN_SIZE];
+}
+
 int memcheck_findhole(dosaddr_t *start_addr, uint32_t min_size,
     uint32_t max_size)
 {
@@ -139,6 +139,7 @@ static void start_disk(void);
 static void do_part(char *);
 static void start_floppy(void);
 static void stop_disk(int token);
+static void set_overlay(struct disk *dptr, char *name);
 static void start_vnet(char *);
 static FILE* open_file(const char* filename);
 static void close_file(FILE* file);
@@ -245,10 +246,12 @@ enum {
 %token L_FLOPPY EMUSYS L_X L_SDL
 %token DOSEMUMAP LOGBUFSIZE LOGFILESIZE MAPPINGDRIVER
 %token LFN_SUPPORT FFS_REDIR SET_INT_HOOKS FINT_REVECT
+%token MANGLE_CACHE MANGLE_CACHE_FILE
 	/* speaker */
 %token EMULATED NATIVE
 	/* cpuemu */
-%token CPUEMU CPU_VM CPU_VM_DPMI VM86 FULL VM86SIM FULLSIM KVM
+%token CPUEMU CPU_VM CPU_VM_DPMI VM86 FULL VM86SIM FULLSIM VM86TIERED FULLTIERED
+%token KVM JIT_CACHE
 	/* keyboard */
 %token RAWKEYBOARD
 %token PRESTROKE
@@ -292,6 +295,7 @@ enum {
 %token SECTORS CYLINDERS TRACKS HEADS OFFSET HDIMAGE HDTYPE1 HDTYPE2 HDTYPE9 DISKCYL4096
 	/* floppy */
 %token THREEINCH THREEINCH_720 THREEINCH_2880 FIVEINCH FIVEINCH_360 READONLY BOOT
+%token COW OVERLAY
 %token DEFAULT_DRIVES SKIP_DRIVES
 	/* ports/io */
 %token RDONLY WRONLY RDWR ORMASK ANDMASK RANGE FAST SLOW
@@ -312,7 +316,8 @@ enum {
 	/* joystick */
 %token JOYSTICK JOY_DEVICE JOY_DOS_MIN JOY_DOS_MAX JOY_GRANULARITY JOY_LATENCY
 	/* Hacks */
-%token CLI_TIMEOUT
+%token CLI_TIMEOUT SNAPSHOT
+%token LOG_RING GUEST_PROFILE COUNTERS_FILE
 %token TIMEMODE
 
 	/* we know we have 1 shift/reduce conflict :-( 
@@ -444,6 +449,17 @@ line:		CHARSET '{' charset_flags '}' {}
 		    {
 		    config.lfn = ($2!=0);
 		    }
+		| MANGLE_CACHE expression
+		    {
+		    config.mangle_cache = $2;
+		    }
+		| MANGLE_CACHE_FILE string_expr
+		    {
+		    free(config.mangle_cache_file);
+		    config.mangle_cache_file = $2[0] ? $2 : NULL;
+		    if (!config.mangle_cache_file)
+			free($2);
+		    }
 		| FINT_REVECT bool
 		    {
 		    config.force_revect = ($2 == -2 ? 1 : $2);
@@ -495,15 +511,28 @@ line:		CHARSET '{' charset_flags '}' {}
 			{
 #ifdef X86_EMULATOR
 			config.cpuemu = $2;
-			if (config.cpuemu > 4) {
+			if (config.cpuemu > 6) {
+				config.cpuemu -= 4;
+				config.cputiered = 1;
+			} else if (config.cpuemu > 4) {
 				config.cpuemu -= 2;
 				config.cpusim = 1;
 			}
 			c_printf("CONF: %s CPUEMU set to %d for %d86\n",
-				CONFIG_CPUSIM ? "simulated" : "JIT",
+				CONFIG_CPUSIM ? "simulated" :
+				config.cputiered ? "tiered" : "JIT",
 				config.cpuemu, (int)vm86s.cpu_type);
 #endif
 			}
+		| JIT_CACHE string_expr
+			{
+#ifdef X86_EMULATOR
+			free(config.jit_cache);
+			config.jit_cache = $2[0] ? $2 : NULL;
+			if (!config.jit_cache)
+#endif
+				free($2);
+			}
 		| CPUSPEED real_expression
 			{ 
 #if 0 /* no longer used, but left in for dosemu.conf compatibility */
@@ -717,6 +746,8 @@ line:		CHARSET '{' charset_flags '}' {}
 		| DEBUG
 		    { start_debug(); }
 		  '{' debug_flags '}'
+		| LOG_RING expression
+		    { config.log_ring = $2; }
 		| MOUSE
 		    { start_mouse(); }
 		  '{' mouse_flags '}'
@@ -815,6 +846,27 @@ line:		CHARSET '{' charset_flags '}' {}
 		    }
 		| CLI_TIMEOUT int_bool
 		    { config.cli_timeout = $2; }
+		| SNAPSHOT string_expr
+		    {
+		    free(config.snapshot_file);
+		    config.snapshot_file = $2[0] ? $2 : NULL;
+		    if (!config.snapshot_file)
+			free($2);
+		    }
+		| GUEST_PROFILE string_expr
+		    {
+		    free(config.guest_profile);
+		    config.guest_profile = $2[0] ? $2 : NULL;
+		    if (!config.guest_profile)
+			free($2);
+		    }
+		| COUNTERS_FILE string_expr
+		    {
+		    free(config.counters_file);
+		    config.counters_file = $2[0] ? $2 : NULL;
+		    if (!config.counters_file)
+			free($2);
+		    }
 		| TIMEMODE string_expr
 		    {
 		    config.timemode = parse_timemode($2);
@@ -1495,6 +1547,8 @@ floppy_flags	: floppy_flag
 		| floppy_flags floppy_flag
 		;
 floppy_flag	: READONLY              { dptr->wantrdonly = 1; }
+		| COW		{ set_overlay(dptr, strdup("")); }
+		| OVERLAY string_expr	{ set_overlay(dptr, $2); }
 		| THREEINCH	{ dptr->default_cmos = THREE_INCH_FLOPPY; }
 		| THREEINCH_2880	{ dptr->default_cmos = THREE_INCH_2880KFLOP; }
 		| THREEINCH_720	{ dptr->default_cmos = THREE_INCH_720KFLOP; }
@@ -1544,6 +1598,8 @@ disk_flags	: disk_flag
 		| disk_flags disk_flag
 		;
 disk_flag	: READONLY		{ dptr->wantrdonly = 1; }
+		| COW		{ set_overlay(dptr, strdup("")); }
+		| OVERLAY string_expr	{ set_overlay(dptr, $2); }
 		| DISKCYL4096	{ dptr->diskcyl4096 = 1; }
 		| HDTYPE1	{ dptr->hdtype = 1; }
 		| HDTYPE2	{ dptr->hdtype = 2; }
@@ -1835,6 +1891,8 @@ cpuemu		: L_OFF		{ $$ = 0; }
 		| FULL		{ $$ = 4; }
 		| VM86SIM	{ $$ = 5; }
 		| FULLSIM	{ $$ = 6; }
+		| VM86TIERED	{ $$ = 7; }
+		| FULLTIERED	{ $$ = 8; }
 		| STRING        { yyerror("got '%s', expected 'off', 'vm86' or 'full'", $1);
 				  free($1); }
 		| error         { yyerror("expected 'off', 'vm86' or 'full'"); }
@@ -2145,6 +2203,7 @@ static void start_floppy(void)
   dptr->timeout = 0;
   dptr->dev_name = NULL;              /* default-values */
   dptr->wantrdonly = 0;
+  dptr->overlay = NULL;
   dptr->header = 0;
 }
 
@@ -2159,6 +2218,7 @@ static void dp_init(struct disk *dptr)
   dptr->timeout = 0;
   dptr->dev_name = NULL;              /* default-values */
   dptr->wantrdonly = 0;
+  dptr->overlay = NULL;
   dptr->header = 0;
 }
 
@@ -2205,6 +2265,12 @@ static void start_vnet(char *mode)
   }
 }
 
+static void set_overlay(struct disk *dptr, char *name)
+{
+  free(dptr->overlay);
+  dptr->overlay = name;
+}
+
 static void do_part(char *dev)
 {
   if (dptr->dev_name != NULL)
@@ -0,0 +1,143 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+/*
+ * Counters for the hot paths of the emulator: JIT lookups,
+ * translations and invalidations, faults, KVM exits, port I/O,
+ * coopthread switches and int21/redirector calls by function.
+ *
+ * The counters are always kept. With $_counters_file they are moved
+ * into a shared mapping of that file, so that an outside tool such as
+ * test/counters.py can poll them while dosemu runs. The file starts
+ * with a header, followed by the names of the counters and then their
+ * 64bit values. The increments are not atomic: counters bumped from
+ * several threads at once may lose a count now and then.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+
+#include "emu.h"
+#include "counters.h"
+
+#define CNT_MAGIC	"DOSEMUCN"
+#define CNT_VERSION	1
+#define CNT_NAME_LEN	24
+
+struct cnt_header {
+  char magic[8];
+  uint32_t version;
+  uint32_t count;
+  uint32_t names_off;
+  uint32_t values_off;
+  uint32_t pid;
+  uint32_t running;
+};
+
+static uint64_t local_counters[CNT_MAX];
+uint64_t *counters = local_counters;
+
+static struct cnt_header *cnt_map;
+static size_t cnt_map_size;
+
+static void counter_name(int n, char *buf, int size)
+{
+  static const char *names[] = {
+    [CNT_JIT_XLATE] = "jit.xlate",
+    [CNT_JIT_HIT_FAST] = "jit.hit_fast",
+    [CNT_JIT_HIT] = "jit.hit",
+    [CNT_JIT_MISS] = "jit.miss",
+    [CNT_JIT_IC_LINK] = "jit.ic_link",
+    [CNT_JIT_CACHE_HIT] = "jit.cache_hit",
+    [CNT_JIT_CACHE_STALE] = "jit.cache_stale",
+    [CNT_TIER_SIM] = "tier.sim",
+    [CNT_TIER_UP] = "tier.up",
+    [CNT_SMC_CODE] = "smc.code",
+    [CNT_SMC_DATA] = "smc.data",
+    [CNT_SMC_PAGE] = "smc.page",
+    [CNT_SMC_WTHRU] = "smc.wthru",
+    [CNT_PORT_IN] = "port.in",
+    [CNT_PORT_OUT] = "port.out",
+    [CNT_COOPTH_SWITCH] = "coopth.switch",
+  };
+
+  if (n < CNT_FAULT)
+    snprintf(buf, size, "%s", names[n]);
+  else if (n < CNT_KVM_EXIT)
+    snprintf(buf, size, "fault.%02x", n - CNT_FAULT);
+  else if (n < CNT_INT21)
+    snprintf(buf, size, "kvm_exit.%d", n - CNT_KVM_EXIT);
+  else if (n < CNT_MFS)
+    snprintf(buf, size, "int21.%02x", n - CNT_INT21);
+  else
+    snprintf(buf, size, "mfs.%02x", n - CNT_MFS);
+}
+
+static void counters_done(void)
+{
+  if (!cnt_map)
+    return;
+  /* keep the final values in the file */
+  cnt_map->running = 0;
+  msync(cnt_map, cnt_map_size, MS_ASYNC);
+}
+
+void counters_init(void)
+{
+  struct cnt_header *h;
+  char *names;
+  uint32_t names_off, values_off;
+  int fd, i;
+
+  if (!config.counters_file)
+    return;
+  names_off = sizeof(*h);
+  values_off = (names_off + CNT_MAX * CNT_NAME_LEN + 63) & ~63;
+  cnt_map_size = values_off + sizeof(local_counters);
+
+  fd = open(config.counters_file, O_RDWR | O_CREAT | O_TRUNC | O_CLOEXEC,
+      0644);
+  if (fd == -1) {
+    error("can't open counters file %s: %s\n", config.counters_file,
+        strerror(errno));
+    return;
+  }
+  if (ftruncate(fd, cnt_map_size) == -1) {
+    error("can't size counters file %s: %s\n", config.counters_file,
+        strerror(errno));
+    close(fd);
+    return;
+  }
+  h = mmap(NULL, cnt_map_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+  close(fd);
+  if (h == MAP_FAILED) {
+    error("can't map counters file %s: %s\n", config.counters_file,
+        strerror(errno));
+    return;
+  }
+
+  names = (char *)h + names_off;
+  for (i = 0; i < CNT_MAX; i++)
+    counter_name(i, names + i * CNT_NAME_LEN, CNT_NAME_LEN);
+  memcpy((char *)h + values_off, local_counters, sizeof(local_counters));
+  h->version = CNT_VERSION;
+  h->count = CNT_MAX;
+  h->names_off = names_off;
+  h->values_off = values_off;
+  h->pid = getpid();
+  h->running = 1;
+  __sync_synchronize();
+  memcpy(h->magic, CNT_MAGIC, sizeof(h->magic));
+
+  counters = (uint64_t *)((char *)h + values_off);
+  cnt_map = h;
+  register_exit_handler(counters_done);
+}
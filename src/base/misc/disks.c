@@ -35,6 +35,7 @@
 #include "dos2linux.h"
 #include "redirect.h"
 #include "cpu-emu.h"
+#include "evlog.h"
 
 static int disks_initiated = 0;
 struct disk disktab[MAX_FDISKS];
@@ -208,6 +209,246 @@ static off_t calc_pos(const struct disk *dp, int64_t sector)
     return pos;
 }
 
+/*
+ * Copy-on-write overlay for image files ("cow" or overlay "file").
+ *
+ * The image is only opened for reading, so that many instances can boot
+ * from one golden image and share its page cache. What the guest writes
+ * goes to a delta file instead, in chunks of COW_CHUNK bytes of the image
+ * file: the first write to a chunk copies it from the image, later reads
+ * of it are served from the delta. The delta file is laid out as
+ *
+ *   struct cow_header, padded to a sector
+ *   bitmap of the chunks present, padded to a chunk
+ *   chunk n at data_offset + n * COW_CHUNK
+ *
+ * so it only takes as much space as was written. With "cow" (overlay "")
+ * the delta is an unlinked temporary file that goes away with dosemu.
+ */
+#define COW_MAGIC "DOSEMU COW\n"
+#define COW_CHUNK 4096
+
+struct cow_header {
+  char magic[16];
+  uint64_t base_size;		/* size of the image file */
+  uint32_t chunk_size;
+  uint32_t data_offset;
+} __attribute__((packed));
+
+struct disk_cow {
+  int base_fd;
+  int delta_fd;
+  uint64_t base_size;
+  uint32_t nchunks;
+  off_t data_offset;
+  unsigned char *bitmap;
+};
+
+static void cow_close(struct disk_cow *cow)
+{
+  close(cow->base_fd);
+  close(cow->delta_fd);
+  free(cow->bitmap);
+  free(cow);
+}
+
+static struct disk_cow *cow_open(const char *image, const char *overlay)
+{
+  struct disk_cow *cow;
+  struct cow_header hdr;
+  struct stat st;
+  size_t bmsize;
+  int new_delta;
+
+  cow = calloc(1, sizeof(*cow));
+  cow->delta_fd = -1;
+  cow->base_fd = open(image, O_RDONLY | O_CLOEXEC);
+  if (cow->base_fd == -1 || fstat(cow->base_fd, &st) == -1) {
+    error("can't open %s: %s\n", image, strerror(errno));
+    goto err;
+  }
+  cow->base_size = st.st_size;
+  cow->nchunks = (cow->base_size + COW_CHUNK - 1) / COW_CHUNK;
+  bmsize = (cow->nchunks + 7) / 8;
+  cow->data_offset = SECTOR_SIZE +
+      (bmsize + COW_CHUNK - 1) / COW_CHUNK * COW_CHUNK;
+
+  if (!overlay[0]) {
+    const char *tmpdir = getenv("TMPDIR");
+
+    if (!tmpdir)
+      tmpdir = "/tmp";
+    cow->delta_fd = open(tmpdir, O_TMPFILE | O_RDWR | O_CLOEXEC,
+			 S_IRUSR | S_IWUSR);
+    if (cow->delta_fd == -1 && (errno == EOPNOTSUPP || errno == EISDIR)) {
+      /* no O_TMPFILE support in this fs or kernel */
+      char *tmpl;
+
+      if (asprintf(&tmpl, "%s/dosemu-cow-XXXXXX", tmpdir) != -1) {
+        cow->delta_fd = mkstemp(tmpl);
+        if (cow->delta_fd != -1) {
+          unlink(tmpl);
+          fcntl(cow->delta_fd, F_SETFD, FD_CLOEXEC);
+        }
+        free(tmpl);
+      }
+    }
+    overlay = tmpdir;
+  } else {
+    cow->delta_fd = open(overlay, O_RDWR | O_CREAT | O_CLOEXEC, 0644);
+  }
+  if (cow->delta_fd == -1 || fstat(cow->delta_fd, &st) == -1) {
+    error("can't create overlay in %s: %s\n", overlay, strerror(errno));
+    goto err;
+  }
+
+  new_delta = (st.st_size == 0);
+  if (new_delta) {
+    memset(&hdr, 0, sizeof(hdr));
+    strcpy(hdr.magic, COW_MAGIC);
+    hdr.base_size = cow->base_size;
+    hdr.chunk_size = COW_CHUNK;
+    hdr.data_offset = cow->data_offset;
+    if (pwrite(cow->delta_fd, &hdr, sizeof(hdr), 0) != sizeof(hdr) ||
+        ftruncate(cow->delta_fd, cow->data_offset) == -1) {
+      error("can't write overlay %s: %s\n", overlay, strerror(errno));
+      goto err;
+    }
+  } else if (pread(cow->delta_fd, &hdr, sizeof(hdr), 0) != sizeof(hdr) ||
+	     strcmp(hdr.magic, COW_MAGIC) != 0 ||
+	     hdr.chunk_size != COW_CHUNK ||
+	     hdr.data_offset != cow->data_offset) {
+    error("%s is not an overlay of %s\n", overlay, image);
+    goto err;
+  } else if (hdr.base_size != cow->base_size) {
+    error("overlay %s was made for a %"PRIu64" byte image, %s has %"PRIu64"\n",
+	  overlay, hdr.base_size, image, cow->base_size);
+    goto err;
+  }
+
+  cow->bitmap = calloc(1, bmsize);
+  if (!new_delta && pread(cow->delta_fd, cow->bitmap, bmsize, SECTOR_SIZE) < 0) {
+    error("can't read overlay %s: %s\n", overlay, strerror(errno));
+    goto err;
+  }
+  d_printf("DISK: %s: overlay %s, %u chunks\n", image, overlay, cow->nchunks);
+  return cow;
+
+err:
+  if (cow->base_fd != -1)
+    close(cow->base_fd);
+  if (cow->delta_fd != -1)
+    close(cow->delta_fd);
+  free(cow->bitmap);
+  free(cow);
+  return NULL;
+}
+
+static int cow_present(const struct disk_cow *cow, uint32_t chunk)
+{
+  return cow->bitmap[chunk / 8] & (1 << (chunk % 8));
+}
+
+/* reads from the image itself, zero-filling past its end */
+static int cow_read_base(const struct disk_cow *cow, void *buf, size_t len,
+			 off_t pos)
+{
+  ssize_t rd = RPT_SYSCALL(pread(cow->base_fd, buf, len, pos));
+
+  if (rd < 0)
+    return -1;
+  memset((char *)buf + rd, 0, len - rd);
+  return 0;
+}
+
+static int cow_pread(const struct disk_cow *cow, void *buf, size_t len,
+		     off_t pos)
+{
+  char *p = buf;
+
+  if (pos < 0 || pos + len > (uint64_t)cow->nchunks * COW_CHUNK)
+    return -1;
+  while (len) {
+    uint32_t chunk = pos / COW_CHUNK;
+    size_t n = COW_CHUNK - pos % COW_CHUNK;
+
+    if (n > len)
+      n = len;
+    if (cow_present(cow, chunk)) {
+      if (RPT_SYSCALL(pread(cow->delta_fd, p, n,
+			    cow->data_offset + pos)) != n)
+	return -1;
+    } else if (cow_read_base(cow, p, n, pos) == -1) {
+      return -1;
+    }
+    p += n;
+    pos += n;
+    len -= n;
+  }
+  return 0;
+}
+
+static int cow_pwrite(struct disk_cow *cow, const void *buf, size_t len,
+		      off_t pos)
+{
+  const char *p = buf;
+
+  if (pos < 0 || pos + len > (uint64_t)cow->nchunks * COW_CHUNK)
+    return -1;
+  while (len) {
+    uint32_t chunk = pos / COW_CHUNK;
+    off_t cpos = (off_t)chunk * COW_CHUNK;
+    size_t n = COW_CHUNK - (pos - cpos);
+
+    if (n > len)
+      n = len;
+    if (!cow_present(cow, chunk)) {
+      char tmp[COW_CHUNK];
+      unsigned char *bm = &cow->bitmap[chunk / 8];
+
+      /* the chunk goes to the delta whole, then its bit gets set */
+      if (n < COW_CHUNK && cow_read_base(cow, tmp, COW_CHUNK, cpos) == -1)
+	return -1;
+      memcpy(tmp + (pos - cpos), p, n);
+      if (RPT_SYSCALL(pwrite(cow->delta_fd, tmp, COW_CHUNK,
+			     cow->data_offset + cpos)) != COW_CHUNK)
+	return -1;
+      *bm |= 1 << (chunk % 8);
+      if (RPT_SYSCALL(pwrite(cow->delta_fd, bm, 1,
+			     SECTOR_SIZE + chunk / 8)) != 1)
+	return -1;
+    } else if (RPT_SYSCALL(pwrite(cow->delta_fd, p, n,
+				  cow->data_offset + pos)) != n) {
+      return -1;
+    }
+    p += n;
+    pos += n;
+    len -= n;
+  }
+  return 0;
+}
+
+static void cow_setup(struct disk *dp)
+{
+  if (!dp->overlay || dp->cow)
+    return;
+  if (dp->type != IMAGE) {
+    warn("DISK: %s is not an image, overlay ignored\n", dp->dev_name);
+    return;
+  }
+  dp->cow = cow_open(dp->dev_name, dp->overlay);
+  if (!dp->cow)
+    config.exitearly = 1;
+}
+
+/* reads len bytes at pos of the image file, through the overlay if any */
+static int disk_pread(const struct disk *dp, void *buf, size_t len, off_t pos)
+{
+  if (dp->cow)
+    return cow_pread(dp->cow, buf, len, pos) == 0 ? len : -1;
+  return RPT_SYSCALL(pread(dp->fdesc, buf, len, pos));
+}
+
 int
 read_sectors(const struct disk *dp, unsigned buffer, uint64_t sector,
 	     long count)
@@ -290,6 +531,22 @@ read_sectors(const struct disk *dp, unsigned buffer, uint64_t sector,
     if(tmpread == -2) return -DERR_ECCERR;
     tmpread *= SECTOR_SIZE;
   }
+  else if (dp->cow) {
+    int len = count * SECTOR_SIZE - already;
+    char *buf = malloc(len);
+
+    if (!buf) {
+      error("out of memory reading overlay of %s\n", dp->dev_name);
+      return -DERR_NOTFOUND;
+    }
+    tmpread = -1;
+    if (cow_pread(dp->cow, buf, len, pos) == 0) {
+      e_invalidate(buffer, len);
+      memcpy_2dos(buffer, buf, len);
+      tmpread = len;
+    }
+    free(buf);
+  }
   else {
     if(pos != lseek(dp->fdesc, pos, SEEK_SET)) {
       error("Sector not found in read_sector, error = %s!\n", strerror(errno));
@@ -375,6 +632,25 @@ write_sectors(struct disk *dp, unsigned buffer, uint64_t sector,
     if(tmpwrite == -1) return -DERR_WRITEFLT;
     tmpwrite *= SECTOR_SIZE;
   }
+  else if (dp->cow) {
+    int len = count * SECTOR_SIZE - already;
+    char *buf = malloc(len);
+    int ret;
+
+    if (!buf) {
+      error("out of memory writing overlay of %s\n", dp->dev_name);
+      return -DERR_WRITEFLT;
+    }
+    memcpy_2unix(buf, buffer, len);
+    ret = cow_pwrite(dp->cow, buf, len, pos);
+    free(buf);
+    if (ret == -1) {
+      error("write to overlay of %s failed: %s\n", dp->dev_name,
+	    strerror(errno));
+      return -DERR_WRITEFLT;
+    }
+    tmpwrite = len;
+  }
   else {
     if(pos != lseek(dp->fdesc, pos, SEEK_SET)) {
       error("Sector not found in write_sector!\n");
@@ -484,7 +760,8 @@ static void image_auto(struct disk *dp)
   if (dp->fdesc == -1) {
     warn("WARNING: image filedesc not open\n");
     dp->rdonly = dp->wantrdonly;
-    dp->fdesc = open(dp->dev_name, dp->wantrdonly ? O_RDONLY : O_RDWR);
+    dp->fdesc = open(dp->dev_name,
+                     (dp->wantrdonly || dp->cow) ? O_RDONLY : O_RDWR);
     if (dp->fdesc == -1) {
       /* We should check whether errno is EROFS, but if not the next open will
          fail again and the following lseek will throw us out of dos. So we win
@@ -526,13 +803,11 @@ static void image_auto(struct disk *dp)
 
   // Hard disk image
 
-  lseek(dp->fdesc, 0, SEEK_SET);
-  if (RPT_SYSCALL(read(dp->fdesc, &header, sizeof(header))) != sizeof(header)) {
+  if (disk_pread(dp, &header, sizeof(header), 0) != sizeof(header)) {
     error("could not read full header in image_init\n");
     leavedos(19);
   }
-  lseek(dp->fdesc, 0, SEEK_SET);
-  if (RPT_SYSCALL(read(dp->fdesc, sect, sizeof(sect))) != sizeof(sect)) {
+  if (disk_pread(dp, sect, sizeof(sect), 0) != sizeof(sect)) {
     error("could not read full header in image_init\n");
     leavedos(19);
   }
@@ -825,7 +1100,6 @@ static void dir_setup(struct disk *dp)
 static void image_setup(struct disk *dp)
 {
   ssize_t rd;
-  int ret;
 
   if (dp->floppy) {
     return;
@@ -835,13 +1109,7 @@ static void image_setup(struct disk *dp)
   dp->part_info.mbr_size = SECTOR_SIZE;
   dp->part_info.mbr = malloc(dp->part_info.mbr_size);
 
-  ret = lseek(dp->fdesc, dp->header, SEEK_SET);
-  if (ret == -1) {
-    error("image_setup: Can't seek '%s'\n", dp->dev_name);
-    leavedos(35);
-  }
-
-  rd = read(dp->fdesc, dp->part_info.mbr, dp->part_info.mbr_size);
+  rd = disk_pread(dp, dp->part_info.mbr, dp->part_info.mbr_size, dp->header);
   if (rd != dp->part_info.mbr_size) {
     error("image_setup: Can't read MBR from '%s'\n", dp->dev_name);
     leavedos(35);
@@ -1042,7 +1310,7 @@ disk_open(struct disk *dp)
   if (dp == NULL || dp->fdesc >= 0)
     return;
 
-  dp->fdesc = SILENT_DOS_SYSCALL(open(dp->type == DIR_TYPE ? "/dev/null" : dp->dev_name, dp->wantrdonly ? O_RDONLY : O_RDWR));
+  dp->fdesc = SILENT_DOS_SYSCALL(open(dp->type == DIR_TYPE ? "/dev/null" : dp->dev_name, (dp->wantrdonly || dp->cow) ? O_RDONLY : O_RDWR));
   if (dp->type == IMAGE || dp->type == DIR_TYPE)
     return;
 
@@ -1122,6 +1390,10 @@ disk_close_all(void)
       (void) close(dp->fdesc);
       dp->fdesc = -1;
     }
+    if (dp->cow) {
+      cow_close(dp->cow);
+      dp->cow = NULL;
+    }
   }
   FOR_EACH_HDISK(i, {
     if(hdisktab[i].type == DIR_TYPE) fatfs_done(&hdisktab[i]);
@@ -1130,6 +1402,10 @@ disk_close_all(void)
       (void) close(hdisktab[i].fdesc);
       hdisktab[i].fdesc = -1;
     }
+    if (hdisktab[i].cow) {
+      cow_close(hdisktab[i].cow);
+      hdisktab[i].cow = NULL;
+    }
   });
   disks_initiated = 0;
 }
@@ -1201,6 +1477,22 @@ disk_init(void)
   }
 }
 
+static void evlog_disk(const struct disk *dp)
+{
+  struct evlog_rec r;
+
+  if (!evlog_enabled)
+    return;
+  evlog_begin(&r, 'd', "disk");
+  evlog_hex(&r, "drive", dp->drive_num);
+  evlog_str(&r, "type", disk_t_str(dp->type));
+  evlog_str(&r, "path", dp->dev_name);
+  evlog_int(&r, "secs", dp->num_secs);
+  evlog_int(&r, "rdonly", dp->rdonly);
+  evlog_int(&r, "cow", !!dp->cow);
+  evlog_end(&r);
+}
+
 static void disk_reset2(void)
 {
 #ifdef SILLY_GET_GEOMETRY
@@ -1226,6 +1518,7 @@ static void disk_reset2(void)
     if (S_ISREG(stbuf.st_mode)) {
       d_printf("dev %s is an image\n", dp->dev_name);
       dp->type = IMAGE;
+      cow_setup(dp);
     } else if (S_ISBLK(stbuf.st_mode)) {
       d_printf("dev %s: %#x\n", dp->dev_name, (unsigned) stbuf.st_rdev);
       dp->type = FLOPPY;
@@ -1249,6 +1542,7 @@ static void disk_reset2(void)
 
     disk_fptrs[dp->type].autosense(dp);
     disk_fptrs[dp->type].setup(dp);
+    evlog_disk(dp);
   }
 
   /*
@@ -1258,7 +1552,8 @@ static void disk_reset2(void)
     dp = &hdisktab[i];
     if (dp->fdesc != -1)
       close(dp->fdesc);
-    dp->fdesc = open(dp->type == DIR_TYPE ? "/dev/null" : dp->dev_name, dp->rdonly ? O_RDONLY : O_RDWR);
+    cow_setup(dp);
+    dp->fdesc = open(dp->type == DIR_TYPE ? "/dev/null" : dp->dev_name, (dp->rdonly || dp->cow) ? O_RDONLY : O_RDWR);
     if (dp->fdesc < 0) {
       if (errno == EROFS || errno == EACCES) {
         dp->fdesc = open(dp->dev_name, O_RDONLY);
@@ -1286,6 +1581,7 @@ static void disk_reset2(void)
      * (mostly for the partition type)
      */
     disk_fptrs[dp->type].setup(dp);
+    evlog_disk(dp);
 
     /* this really doesn't make sense...where the disk geometry
      * is in reality given for the actual disk (i.e. /dev/hda)
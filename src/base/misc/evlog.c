@@ -0,0 +1,237 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+/*
+ * Structured event log given with -J.
+ *
+ * Records are formatted into a caller-provided buffer and appended to
+ * the active half of a double buffer. A writer thread swaps the halves
+ * and writes the full one out, every EVLOG_FLUSH_MS or as soon as the
+ * active half is half full, so the emulator thread never waits for the
+ * file unless the writer falls a whole buffer behind.
+ *
+ * Records must not be emitted from signal handlers.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <inttypes.h>
+#include <pthread.h>
+#include <time.h>
+#include <unistd.h>
+#include <fcntl.h>
+
+#include "emu.h"
+#include "evlog.h"
+
+#define EVLOG_BUF_SIZE (256 * 1024)
+#define EVLOG_FLUSH_MS 200
+
+int evlog_enabled;
+
+static int evlog_fd = -1;
+static struct timespec evlog_start;
+static char *bufs[2];
+static int buf_len[2];
+static int active;
+static int writing;
+static int stopping;
+static pthread_t writer_thr;
+static pthread_mutex_t evlog_mtx = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t writer_cnd = PTHREAD_COND_INITIALIZER;
+static pthread_cond_t space_cnd = PTHREAD_COND_INITIALIZER;
+
+static void write_all(const char *p, int len)
+{
+  while (len > 0) {
+    ssize_t n = write(evlog_fd, p, len);
+    if (n < 0) {
+      if (errno == EINTR)
+        continue;
+      break;
+    }
+    p += n;
+    len -= n;
+  }
+}
+
+static void *evlog_writer(void *arg)
+{
+  struct timespec ts;
+  int idx;
+
+  pthread_mutex_lock(&evlog_mtx);
+  while (1) {
+    if (!buf_len[active]) {
+      if (stopping)
+        break;
+      clock_gettime(CLOCK_REALTIME, &ts);
+      ts.tv_nsec += EVLOG_FLUSH_MS * 1000000L;
+      if (ts.tv_nsec >= 1000000000L) {
+        ts.tv_sec++;
+        ts.tv_nsec -= 1000000000L;
+      }
+      pthread_cond_timedwait(&writer_cnd, &evlog_mtx, &ts);
+      continue;
+    }
+    idx = active;
+    active ^= 1;
+    writing = 1;
+    pthread_cond_broadcast(&space_cnd);
+    pthread_mutex_unlock(&evlog_mtx);
+
+    write_all(bufs[idx], buf_len[idx]);
+
+    pthread_mutex_lock(&evlog_mtx);
+    buf_len[idx] = 0;
+    writing = 0;
+    pthread_cond_broadcast(&space_cnd);
+  }
+  pthread_mutex_unlock(&evlog_mtx);
+  return NULL;
+}
+
+void evlog_init(void)
+{
+  if (!config.evlog_file)
+    return;
+  evlog_fd = open(config.evlog_file, O_WRONLY | O_CREAT | O_TRUNC |
+      O_CLOEXEC, 0644);
+  if (evlog_fd == -1) {
+    error("can't open \"%s\" for writing events: %s\n",
+        config.evlog_file, strerror(errno));
+    return;
+  }
+  bufs[0] = malloc(EVLOG_BUF_SIZE);
+  bufs[1] = malloc(EVLOG_BUF_SIZE);
+  clock_gettime(CLOCK_MONOTONIC, &evlog_start);
+  pthread_create(&writer_thr, NULL, evlog_writer, NULL);
+  pthread_setname_np(writer_thr, "dosemu: evlog");
+  evlog_enabled = 1;
+}
+
+void evlog_done(void)
+{
+  if (!evlog_enabled)
+    return;
+  evlog_enabled = 0;
+  pthread_mutex_lock(&evlog_mtx);
+  stopping = 1;
+  pthread_cond_signal(&writer_cnd);
+  pthread_mutex_unlock(&evlog_mtx);
+  pthread_join(writer_thr, NULL);
+  close(evlog_fd);
+  evlog_fd = -1;
+  free(bufs[0]);
+  free(bufs[1]);
+}
+
+static int rec_printf(struct evlog_rec *r, const char *fmt, ...)
+  FORMAT(printf, 2, 3);
+
+/* appends all or nothing, so a record never ends in the middle of a token */
+static int rec_printf(struct evlog_rec *r, const char *fmt, ...)
+{
+  va_list args;
+  int n, left = EVLOG_REC_MAX - 2 - r->len;	/* room for "}\n" */
+
+  if (left <= 0)
+    return -1;
+  va_start(args, fmt);
+  n = vsnprintf(r->buf + r->len, left, fmt, args);
+  va_end(args);
+  if (n < 0 || n >= left) {
+    r->buf[r->len] = '\0';
+    return -1;
+  }
+  r->len += n;
+  return 0;
+}
+
+/* key and value go in together or the whole field is dropped */
+#define REC_FIELD(r, key, fmt, ...) do { \
+  int _len = (r)->len; \
+  if (rec_printf(r, ", \"%s\": " fmt, key, ##__VA_ARGS__) == -1) \
+    (r)->len = _len; \
+} while (0)
+
+void evlog_begin(struct evlog_rec *r, char subsys, const char *event)
+{
+  struct timespec now;
+  time_t sec;
+  long nsec;
+
+  clock_gettime(CLOCK_MONOTONIC, &now);
+  sec = now.tv_sec - evlog_start.tv_sec;
+  nsec = now.tv_nsec - evlog_start.tv_nsec;
+  if (nsec < 0) {
+    sec--;
+    nsec += 1000000000L;
+  }
+  r->len = 0;
+  rec_printf(r, "{\"t\": %ld.%09ld, \"sub\": \"%c\", \"ev\": \"%s\"",
+      (long)sec, nsec, subsys, event);
+}
+
+void evlog_str(struct evlog_rec *r, const char *key, const char *val)
+{
+  char esc[EVLOG_REC_MAX];
+  /* whatever the key and the quotes leave: the value is cut to fit */
+  int room = EVLOG_REC_MAX - 2 - r->len - (int)strlen(key) - 9;
+  int i = 0;
+
+  if (room <= 0)
+    return;
+  for (; *val; val++) {
+    unsigned char c = *val;
+    if (c == '"' || c == '\\') {
+      if (i + 2 > room)
+        break;
+      esc[i++] = '\\';
+      esc[i++] = c;
+    } else if (c < 0x20 || c >= 0x7f) {
+      if (i + 6 > room)
+        break;
+      i += sprintf(esc + i, "\\u%04x", c);
+    } else {
+      if (i + 1 > room)
+        break;
+      esc[i++] = c;
+    }
+  }
+  esc[i] = '\0';
+  REC_FIELD(r, key, "\"%s\"", esc);
+}
+
+void evlog_int(struct evlog_rec *r, const char *key, int64_t val)
+{
+  REC_FIELD(r, key, "%" PRId64, val);
+}
+
+void evlog_hex(struct evlog_rec *r, const char *key, uint64_t val)
+{
+  REC_FIELD(r, key, "\"0x%" PRIx64 "\"", val);
+}
+
+void evlog_end(struct evlog_rec *r)
+{
+  r->buf[r->len++] = '}';
+  r->buf[r->len++] = '\n';
+
+  pthread_mutex_lock(&evlog_mtx);
+  while (buf_len[active] + r->len > EVLOG_BUF_SIZE) {
+    /* both halves are busy, wait for the writer */
+    pthread_cond_signal(&writer_cnd);
+    pthread_cond_wait(&space_cnd, &evlog_mtx);
+  }
+  memcpy(bufs[active] + buf_len[active], r->buf, r->len);
+  buf_len[active] += r->len;
+  if (!writing && buf_len[active] > EVLOG_BUF_SIZE / 2)
+    pthread_cond_signal(&writer_cnd);
+  pthread_mutex_unlock(&evlog_mtx);
+}
@@ -69,6 +69,7 @@
 #include "cpu-emu.h"
 #include "dos2linux.h"
 #include "utilities.h"
+#include "evlog.h"
 #include "fatfs.h"
 #include "fatfs_priv.h"
 
@@ -327,6 +328,7 @@ void fatfs_done(struct disk *dp)
   if(f->ffn) free(f->ffn);
   if(f->boot_sec) free(f->boot_sec);
   if(f->obj) free(f->obj);
+  free(f->clu_obj);
 
   free(dp->fatfs); dp->fatfs = NULL;
 }
@@ -637,7 +639,7 @@ void make_label(fatfs_t *f)
 unsigned new_obj(fatfs_t *f)
 {
   void *p;
-  unsigned new_objs = 2;
+  unsigned new_objs = f->alloc_objs ? f->alloc_objs : 16;
 
   if(f->objs >= f->alloc_objs) {
     p = realloc(f->obj, (f->alloc_objs + new_objs) * sizeof *f->obj);
@@ -891,10 +893,53 @@ static void set_vol_and_len(fatfs_t *f, unsigned oi)
   }
 
   o = f->obj + oi;
+  /* a placed directory keeps the clusters reserved for it */
+  if(o->start) return;
   u = f->cluster_secs << 9;
   o->len = (o->size + u - 1) / u;
 }
 
+/*
+ * Upper bound of the number of clusters of a directory, from its entry
+ * count, so that it can be placed before it is read.
+ */
+static unsigned dir_len(fatfs_t *f, unsigned oi)
+{
+  DIR *d;
+  struct dirent *de;
+  unsigned u, n = 3;	/* ".", ".." and a substituted config.sys */
+
+  if((d = opendir(f->obj[oi].full_name))) {
+    while((de = readdir(d))) {
+      if(strcmp(de->d_name, ".") && strcmp(de->d_name, ".."))
+        n++;
+    }
+    closedir(d);
+  }
+  u = f->cluster_secs << 9;
+  return (n * 0x20 + u - 1) / u;
+}
+
+/*
+ * Reads the first directory that was placed but not read yet.
+ * Returns 0 if there is none.
+ */
+static int scan_next_dir(fatfs_t *f)
+{
+  unsigned u;
+
+  for(u = max(f->next_scan, 1); u < f->objs; u++) {
+    obj_t *o = f->obj + u;
+    if(o->is.dir && !o->is.not_real && !o->is.scanned && o->start) {
+      f->next_scan = u + 1;
+      scan_dir(f, u);
+      return 1;
+    }
+  }
+  f->next_scan = u;
+  return 0;
+}
+
 /*
  * Reads the directory entries and assigns the object ids.
  */
@@ -1069,6 +1114,14 @@ void scan_dir(fatfs_t *f, unsigned oi)
       f->sys_type = sys_type;
       fatfs_msg("system type is \"%s\" (0x%"PRIx64")\n",
                 system_type(f->sys_type), f->sys_type);
+      if (evlog_enabled) {
+        struct evlog_rec r;
+        evlog_begin(&r, 'd', "systype");
+        evlog_str(&r, "dir", f->dir);
+        evlog_str(&r, "name", system_type(f->sys_type));
+        evlog_hex(&r, "id", f->sys_type);
+        evlog_end(&r);
+      }
     }
 
     /* load boot block from "boot.blk" file or generate Dosemu's own */
@@ -1213,6 +1266,17 @@ static void _add_object(fatfs_t *f, unsigned parent, char *s, const char *name)
     }
     goto err;
   }
+  if (f->got_all_objs && !tmp_o.is.not_real) {
+    /* read after the file system got full, there is no room for it */
+    fatfs_deb("fatfs: no clusters left for %s\n", s);
+    goto err;
+  }
+  if (parent && f->obj[parent].start &&
+      f->obj[parent].size + u > f->obj[parent].len * (f->cluster_secs << 9)) {
+    /* the directory got more entries since it was placed */
+    error("fatfs: directory overflow on %s\n", f->obj[parent].full_name);
+    goto err;
+  }
 
   if(!(u = new_obj(f)))
     goto err;
@@ -1369,21 +1433,34 @@ unsigned make_dos_entry(fatfs_t *f, const obj_t *o, unsigned char **e)
 
 unsigned find_obj(fatfs_t *f, unsigned clu)
 {
-  unsigned u;
+  unsigned lo = 0, hi = f->clu_objs, mid;
+  obj_t *o;
 
   if(clu >= f->first_free_cluster) return 0;
 
-  for(u = 0; u < f->objs; u++) {
-    if(
-      !f->obj[u].is.not_real &&
-      clu >= f->obj[u].start &&
-      clu < f->obj[u].start + f->obj[u].len
-    ) break;
+  /* objects are placed in increasing cluster order */
+  while(hi - lo > 1) {
+    mid = (lo + hi) / 2;
+    if(f->obj[f->clu_obj[mid]].start <= clu)
+      lo = mid;
+    else
+      hi = mid;
   }
+  if(lo == hi) return 0;
+
+  o = f->obj + f->clu_obj[lo];
+  if(clu < o->start || clu >= o->start + o->len) return 0;
 
-  if(u == f->objs) return 0;
+  return f->clu_obj[lo];
+}
 
-  return u;
+static void add_clu_obj(fatfs_t *f, unsigned oi)
+{
+  if(f->clu_objs == f->alloc_clu_objs) {
+    f->alloc_clu_objs = f->alloc_clu_objs ? f->alloc_clu_objs * 2 : 64;
+    f->clu_obj = realloc(f->clu_obj, f->alloc_clu_objs * sizeof *f->clu_obj);
+  }
+  f->clu_obj[f->clu_objs++] = oi;
 }
 
 
@@ -1395,12 +1472,21 @@ void assign_clusters(fatfs_t *f, unsigned max_clu, unsigned max_obj)
 
   if(max_clu == 0 && max_obj == 0) return;
 
-  for(u = 1; u < f->objs; u++) {
+  for(u = 1;; u++) {
     if(f->got_all_objs) break;
     if(f->first_free_cluster > max_clu && u > max_obj) break;
+    /* subdirectories are read when DOS reads them, or here once
+       there is nothing else left to place */
+    while(u == f->objs && scan_next_dir(f));
+    if(u == f->objs) {
+      fatfs_deb("assign_clusters: got everything\n");
+      f->got_all_objs = 1;
+      break;
+    }
     if(f->obj[u].is.not_real) continue;
     if(f->obj[u].start) continue;
-    if(f->obj[u].is.dir && !f->obj[u].is.scanned) scan_dir(f, u);
+    if(f->obj[u].is.dir && !f->obj[u].is.scanned)
+      f->obj[u].len = dir_len(f, u);
     f->obj[u].start = f->first_free_cluster;
     f->first_free_cluster += f->obj[u].len;
     if(f->first_free_cluster > f->last_cluster) {
@@ -1418,15 +1504,12 @@ void assign_clusters(fatfs_t *f, unsigned max_clu, unsigned max_obj)
           free(f->obj[k].full_name);
       }
       f->objs = u;
+      break;
     }
+    add_clu_obj(f, u);
     fatfs_deb("assign_clusters: obj %u, start %u, len %u (%s)\n",
 	u, f->obj[u].start, f->obj[u].len, f->obj[u].name);
   }
-
-  if(u == f->objs) {
-    fatfs_deb("assign_clusters: got everything\n");
-    f->got_all_objs = 1;
-  }
 }
 
 
@@ -1514,6 +1597,10 @@ int read_dir(fatfs_t *f, unsigned oi, unsigned clu, unsigned pos,
 
   fatfs_deb2("read_dir: obj %u, cluster %u, sec %u\n", oi, clu, pos);
 
+  if(!o->is.scanned) {
+    scan_dir(f, oi);
+    o = f->obj + oi;
+  }
   if(clu && o->start == 0) return -1;
   if(clu < o->start) return -1;
   clu -= o->start;
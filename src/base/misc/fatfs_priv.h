@@ -58,6 +58,9 @@ struct fatfs_s {
   unsigned objs, alloc_objs;
   unsigned sys_objs;
   obj_t *obj;
+  unsigned *clu_obj;			/* placed objects, by start cluster */
+  unsigned clu_objs, alloc_clu_objs;
+  unsigned next_scan;			/* no unread directory below it */
 
   char *ffn, *ffn_ptr;			/* buffer for file names */
   unsigned ffn_obj;
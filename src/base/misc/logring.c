@@ -0,0 +1,444 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+/*
+ * In-memory ring of debug messages, enabled with $_log_ring.
+ *
+ * Instead of formatting every message, log_printf() stores the format
+ * pointer and a copy of the arguments into the next slot of the ring.
+ * Slots are reserved with an atomic increment, so storing takes no
+ * lock. The messages are only formatted and written to the debug log
+ * when the log is flushed: at exit, on a crash or on request from
+ * dosdebug. If more messages come in between than the ring holds,
+ * the oldest ones are lost.
+ *
+ * Formats are assumed to be string literals, which holds for the
+ * *_printf() macros; error() formats its messages before storing them.
+ * Strings are copied at store time, up to their precision if one is
+ * given, as %.*s is used on buffers that are not NUL-terminated. Messages whose
+ * arguments don't fit into a slot, or that use conversions this file
+ * doesn't know, are formatted right away instead.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <stddef.h>
+#include <stdatomic.h>
+#include <errno.h>
+#include <unistd.h>
+
+#include "emu.h"
+#include "logring.h"
+
+#define SLOT_DATA	240
+#define LINE_MAX_SIZE	1024
+#define OUT_BUF_SIZE	(64 * 1024)
+
+struct lr_slot {
+  _Atomic uint64_t seq;		/* message number + 1, 0 while written */
+  const char *fmt;		/* NULL if data is the formatted text */
+  int err;			/* errno for %m */
+  unsigned short len;
+  unsigned char data[SLOT_DATA];
+};
+
+enum { A_NONE, A_INT, A_DBL, A_LDBL, A_STR, A_PTR, A_ERRNO };
+
+struct spec {
+  int stars;
+  int prec;		/* -1 if none, -2 if given by the last star */
+  int lmod;		/* 'H' is hh, 'q' is ll */
+  int type;
+};
+
+int logring_size;
+static struct lr_slot *ring;
+static _Atomic uint64_t lr_head;
+static uint64_t lr_flushed;
+
+void logring_init(int nrec)
+{
+  int size = 1;
+
+  if (nrec <= 0)
+    return;
+  while (size < nrec)
+    size <<= 1;
+  ring = calloc(size, sizeof(*ring));
+  if (!ring) {
+    error("log ring: can't allocate %i messages\n", size);
+    return;
+  }
+  logring_size = size;
+}
+
+/* p points past the '%', returns NULL for what we can't store */
+static const char *parse_spec(const char *p, struct spec *sp)
+{
+  sp->stars = 0;
+  sp->prec = -1;
+  sp->lmod = 0;
+  sp->type = A_NONE;
+  if (*p == '%')
+    return p + 1;
+  while (*p && strchr("-+ #0'", *p))
+    p++;
+  if (*p == '*') {
+    sp->stars++;
+    p++;
+  } else {
+    while (*p >= '0' && *p <= '9')
+      p++;
+    if (*p == '$')		/* positional arguments */
+      return NULL;
+  }
+  if (*p == '.') {
+    p++;
+    if (*p == '*') {
+      sp->stars++;
+      sp->prec = -2;
+      p++;
+    } else {
+      sp->prec = 0;
+      while (*p >= '0' && *p <= '9')
+        sp->prec = sp->prec * 10 + *p++ - '0';
+    }
+  }
+  switch (*p) {
+  case 'h':
+    p++;
+    sp->lmod = 'h';
+    if (*p == 'h') {
+      sp->lmod = 'H';
+      p++;
+    }
+    break;
+  case 'l':
+    p++;
+    sp->lmod = 'l';
+    if (*p == 'l') {
+      sp->lmod = 'q';
+      p++;
+    }
+    break;
+  case 'q':
+  case 'j':
+  case 'z':
+  case 't':
+  case 'L':
+    sp->lmod = *p++;
+    break;
+  }
+  switch (*p) {
+  case 'c':
+    if (sp->lmod == 'l')
+      return NULL;
+    /* fall through */
+  case 'd':
+  case 'i':
+  case 'u':
+  case 'o':
+  case 'x':
+  case 'X':
+    sp->type = A_INT;
+    break;
+  case 'e':
+  case 'E':
+  case 'f':
+  case 'F':
+  case 'g':
+  case 'G':
+  case 'a':
+  case 'A':
+    sp->type = (sp->lmod == 'L' ? A_LDBL : A_DBL);
+    break;
+  case 's':
+    if (sp->lmod == 'l')
+      return NULL;
+    sp->type = A_STR;
+    break;
+  case 'p':
+    sp->type = A_PTR;
+    break;
+  case 'm':
+    sp->type = A_ERRNO;
+    break;
+  default:
+    return NULL;
+  }
+  return p + 1;
+}
+
+#define PUT(v) do { \
+  if (len + sizeof(v) > size) \
+    return -1; \
+  memcpy(buf + len, &(v), sizeof(v)); \
+  len += sizeof(v); \
+} while (0)
+
+/* copy the arguments of fmt into buf, -1 if they don't fit */
+static int pack_args(const char *fmt, va_list args, unsigned char *buf,
+    size_t size)
+{
+  struct spec sp;
+  size_t len = 0;
+  int i, star = -1;
+
+  while ((fmt = strchr(fmt, '%'))) {
+    fmt = parse_spec(fmt + 1, &sp);
+    if (!fmt)
+      return -1;
+    for (i = 0; i < sp.stars; i++) {
+      star = va_arg(args, int);
+      PUT(star);
+    }
+    /* a negative precision is taken as if there was none */
+    if (sp.prec == -2)
+      sp.prec = (star < 0 ? -1 : star);
+    switch (sp.type) {
+    case A_INT: {
+      unsigned long long v;
+      switch (sp.lmod) {
+      case 'l':
+        v = va_arg(args, long);
+        break;
+      case 'q':
+      case 'L':
+        v = va_arg(args, long long);
+        break;
+      case 'j':
+        v = va_arg(args, intmax_t);
+        break;
+      case 'z':
+        v = va_arg(args, size_t);
+        break;
+      case 't':
+        v = va_arg(args, ptrdiff_t);
+        break;
+      default:
+        v = va_arg(args, int);
+        break;
+      }
+      PUT(v);
+      break;
+    }
+    case A_DBL: {
+      double v = va_arg(args, double);
+      PUT(v);
+      break;
+    }
+    case A_LDBL: {
+      long double v = va_arg(args, long double);
+      PUT(v);
+      break;
+    }
+    case A_STR: {
+      const char *s = va_arg(args, const char *);
+      size_t l;
+      if (!s)
+        s = "(null)";
+      /* the string may end at the precision, without a NUL */
+      l = (sp.prec >= 0 ? strnlen(s, sp.prec) : strlen(s));
+      if (len + l + 1 > size)
+        return -1;
+      memcpy(buf + len, s, l);
+      buf[len + l] = '\0';
+      len += l + 1;
+      break;
+    }
+    case A_PTR: {
+      void *v = va_arg(args, void *);
+      PUT(v);
+      break;
+    }
+    }
+  }
+  return len;
+}
+
+#define GET(v) do { \
+  memcpy(&(v), data, sizeof(v)); \
+  data += sizeof(v); \
+} while (0)
+
+#define EMIT(...) do { \
+  switch (sp.stars) { \
+  case 0: \
+    n = snprintf(o, left, spec, __VA_ARGS__); \
+    break; \
+  case 1: \
+    n = snprintf(o, left, spec, star[0], __VA_ARGS__); \
+    break; \
+  default: \
+    n = snprintf(o, left, spec, star[0], star[1], __VA_ARGS__); \
+    break; \
+  } \
+} while (0)
+
+/* format a stored message into out, returns its length */
+static int unpack(const struct lr_slot *s, char *out, int size)
+{
+  const char *fmt = s->fmt, *p;
+  const unsigned char *data = s->data;
+  char *o = out, spec[32];
+  int left = size, n, i, star[2];
+  struct spec sp;
+
+  while (*fmt && left > 1) {
+    if (*fmt != '%') {
+      *o++ = *fmt++;
+      left--;
+      continue;
+    }
+    p = parse_spec(fmt + 1, &sp);
+    if (!p || p - fmt >= (int)sizeof(spec))
+      break;
+    memcpy(spec, fmt, p - fmt);
+    spec[p - fmt] = '\0';
+    fmt = p;
+    for (i = 0; i < sp.stars; i++)
+      GET(star[i]);
+    n = 0;
+    switch (sp.type) {
+    case A_NONE:
+      n = snprintf(o, left, "%%");
+      break;
+    case A_INT: {
+      unsigned long long v;
+      GET(v);
+      switch (sp.lmod) {
+      case 'l':
+        EMIT((long)v);
+        break;
+      case 'q':
+      case 'L':
+        EMIT((long long)v);
+        break;
+      case 'j':
+        EMIT((intmax_t)v);
+        break;
+      case 'z':
+        EMIT((size_t)v);
+        break;
+      case 't':
+        EMIT((ptrdiff_t)v);
+        break;
+      default:
+        EMIT((int)v);
+        break;
+      }
+      break;
+    }
+    case A_DBL: {
+      double v;
+      GET(v);
+      EMIT(v);
+      break;
+    }
+    case A_LDBL: {
+      long double v;
+      GET(v);
+      EMIT(v);
+      break;
+    }
+    case A_STR:
+      EMIT((const char *)data);
+      data += strlen((const char *)data) + 1;
+      break;
+    case A_PTR: {
+      void *v;
+      GET(v);
+      EMIT(v);
+      break;
+    }
+    case A_ERRNO:
+      n = snprintf(o, left, "%s", strerror(s->err));
+      break;
+    }
+    if (n < 0)
+      break;
+    if (n >= left)
+      n = left - 1;
+    o += n;
+    left -= n;
+  }
+  *o = '\0';
+  return o - out;
+}
+
+int logring_store(const char *fmt, va_list args)
+{
+  uint64_t num = atomic_fetch_add_explicit(&lr_head, 1, memory_order_relaxed);
+  struct lr_slot *s = &ring[num & (logring_size - 1)];
+  va_list args2;
+  int len;
+
+  atomic_store_explicit(&s->seq, 0, memory_order_relaxed);
+  atomic_thread_fence(memory_order_release);
+  s->err = errno;
+  va_copy(args2, args);
+  len = pack_args(fmt, args2, s->data, sizeof(s->data));
+  va_end(args2);
+  if (len < 0) {
+    len = vsnprintf((char *)s->data, sizeof(s->data), fmt, args);
+    if (len >= (int)sizeof(s->data))
+      len = sizeof(s->data) - 1;
+    s->fmt = NULL;
+  } else {
+    s->fmt = fmt;
+  }
+  s->len = len;
+  atomic_store_explicit(&s->seq, num + 1, memory_order_release);
+  return len;
+}
+
+/* Format and write out the messages stored since the last flush.
+ * Called with the log mutex held. */
+void logring_flush(int fd)
+{
+  static char out[OUT_BUF_SIZE];
+  static struct lr_slot s;
+  uint64_t head, num;
+  int len = 0;
+
+  if (!logring_size)
+    return;
+  head = atomic_load_explicit(&lr_head, memory_order_acquire);
+  num = lr_flushed;
+  if (head - num > (uint64_t)logring_size) {
+    num = head - logring_size;
+    len += snprintf(out, sizeof(out), "*** %llu log messages lost ***\n",
+        (unsigned long long)(num - lr_flushed));
+  }
+  for (; num < head; num++) {
+    struct lr_slot *r = &ring[num & (logring_size - 1)];
+
+    if (atomic_load_explicit(&r->seq, memory_order_acquire) != num + 1)
+      continue;
+    memcpy(&s, r, sizeof(s));
+    atomic_thread_fence(memory_order_acquire);
+    /* overwritten while we copied it */
+    if (atomic_load_explicit(&r->seq, memory_order_relaxed) != num + 1)
+      continue;
+
+    if (OUT_BUF_SIZE - len < LINE_MAX_SIZE) {
+      if (write(fd, out, len) < 0)
+        break;
+      len = 0;
+    }
+    if (s.fmt) {
+      len += unpack(&s, out + len, LINE_MAX_SIZE);
+    } else {
+      memcpy(out + len, s.data, s.len);
+      len += s.len;
+    }
+  }
+  if (len)
+    write(fd, out, len);
+  lr_flushed = head;
+}
@@ -0,0 +1,198 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+/*
+ * Sampling profiler for guest code, enabled with $_guest_profile.
+ *
+ * The code paths that matter mark themselves with prof_enter() and
+ * prof_leave(): guest execution, idle sleeps, the redirector and the
+ * interrupt handlers. On every SIGALRM the signal handler notes the
+ * current zone, and the alarm handler then adds a sample for it at
+ * the guest CS:EIP, which by then is the place the guest was stopped
+ * at. For time spent in an interrupt handler that is the instruction
+ * after the INT.
+ *
+ * A cooperative thread that sleeps inside a handler doesn't restore
+ * its zone when it is resumed, so some of its time is counted as emu.
+ *
+ * At exit the samples are written in the folded stack format used by
+ * flame graph tools, one line per location:
+ *
+ *   mode;CS:EIP;zone count
+ *
+ * for example "dpmi-native;00a7:0000312c;int21 57". mode is vm86 or
+ * dpmi plus the CPU backend. test/profreport.py renders reports.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <stdint.h>
+#include <string.h>
+#include <errno.h>
+
+#include "emu.h"
+#include "cpu.h"
+#include "dpmi.h"
+#include "sig.h"
+#include "prof.h"
+
+#define PROF_HASH_BITS	16
+#define PROF_HASH_SIZE	(1 << PROF_HASH_BITS)
+
+struct prof_ent {
+  uint32_t eip;
+  uint16_t cs;
+  uint16_t zone;
+  uint8_t mode;
+  uint32_t count;
+};
+
+enum { M_VM86, M_KVM, M_JIT, M_SIM, M_NATIVE };
+
+static const char *mode_names[2][5] = {
+  { "vm86-vm86", "vm86-kvm", "vm86-jit", "vm86-sim", "vm86-native" },
+  { "dpmi-vm86", "dpmi-kvm", "dpmi-jit", "dpmi-sim", "dpmi-native" },
+};
+
+volatile int prof_zone;
+static volatile int sig_zone = -1;
+static struct prof_ent *prof_tab;
+static unsigned prof_used;
+static unsigned long prof_samples, prof_dropped;
+
+static int cur_mode(int dpmi)
+{
+  switch (dpmi ? config.cpu_vm_dpmi : config.cpu_vm) {
+  case CPUVM_KVM:
+    return M_KVM;
+  case CPUVM_EMU:
+    return config.cpusim ? M_SIM : M_JIT;
+  case CPUVM_NATIVE:
+    return M_NATIVE;
+  }
+  return M_VM86;
+}
+
+static void add_sample(int zone)
+{
+  struct prof_ent *e;
+  unsigned h, cs, eip;
+  int dpmi = in_dpmi_pm(), mode = cur_mode(dpmi);
+
+  if (dpmi) {
+    sigcontext_t *scp = dpmi_get_scp();
+    cs = _cs;
+    eip = _eip;
+  } else {
+    cs = _CS;
+    eip = _EIP;
+  }
+  mode |= dpmi << 3;
+
+  h = ((cs << 16) ^ eip ^ (zone << 7) ^ mode) * 2654435761u;
+  h >>= 32 - PROF_HASH_BITS;
+  for (;; h = (h + 1) & (PROF_HASH_SIZE - 1)) {
+    e = &prof_tab[h];
+    if (!e->count) {
+      /* keep some room so that probing stays short */
+      if (prof_used >= PROF_HASH_SIZE * 3 / 4) {
+        prof_dropped++;
+        return;
+      }
+      e->cs = cs;
+      e->eip = eip;
+      e->zone = zone;
+      e->mode = mode;
+      prof_used++;
+      break;
+    }
+    if (e->cs == cs && e->eip == eip && e->zone == zone && e->mode == mode)
+      break;
+  }
+  e->count++;
+  prof_samples++;
+}
+
+/* called from the SIGALRM signal handler */
+void prof_signal(void)
+{
+  if (prof_tab)
+    sig_zone = prof_zone;
+}
+
+static void prof_alrm(void)
+{
+  int zone = sig_zone;
+
+  if (zone == -1)
+    return;
+  sig_zone = -1;
+  add_sample(zone);
+}
+
+static void zone_name(int zone, char *buf, int size)
+{
+  switch (zone) {
+  case PROF_EMU:
+    snprintf(buf, size, "emu");
+    break;
+  case PROF_GUEST:
+    snprintf(buf, size, "guest");
+    break;
+  case PROF_IDLE:
+    snprintf(buf, size, "idle");
+    break;
+  case PROF_MFS:
+    snprintf(buf, size, "mfs");
+    break;
+  default:
+    snprintf(buf, size, "int%02x", zone - PROF_INT);
+    break;
+  }
+}
+
+static void prof_done(void)
+{
+  FILE *f;
+  char zname[16];
+  int i;
+
+  if (!prof_tab)
+    return;
+  f = fopen(config.guest_profile, "w");
+  if (!f) {
+    error("can't write guest profile %s: %s\n", config.guest_profile,
+        strerror(errno));
+    return;
+  }
+  for (i = 0; i < PROF_HASH_SIZE; i++) {
+    struct prof_ent *e = &prof_tab[i];
+    if (!e->count)
+      continue;
+    zone_name(e->zone, zname, sizeof(zname));
+    fprintf(f, "%s;%04x:%08x;%s %u\n", mode_names[e->mode >> 3][e->mode & 7],
+        e->cs, e->eip, zname, e->count);
+  }
+  fclose(f);
+  g_printf("PROF: %lu samples, %lu dropped, written to %s\n",
+      prof_samples, prof_dropped, config.guest_profile);
+  free(prof_tab);
+  prof_tab = NULL;
+}
+
+void prof_init(void)
+{
+  if (!config.guest_profile)
+    return;
+  prof_tab = calloc(PROF_HASH_SIZE, sizeof(*prof_tab));
+  if (!prof_tab) {
+    error("can't allocate the guest profile\n");
+    return;
+  }
+  prof_zone = PROF_EMU;
+  sigalrm_register_handler(prof_alrm);
+  register_exit_handler(prof_done);
+}
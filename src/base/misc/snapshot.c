@@ -0,0 +1,546 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+/*
+ * Machine snapshot: save the state of a booted DOS session to a file
+ * and restore it on the next start instead of booting DOS again.
+ *
+ * Only the guest visible state is captured: CPU and FPU registers,
+ * base and upper memory, the HMA, the PIC and the PIT. Host-side state
+ * (XMS/EMS allocations, redirector tables, the FDPP kernel, video) is
+ * not, so a snapshot can only be taken while none of it is in use and
+ * no DPMI client is running. It is then only valid for the same config
+ * and the same disk contents. The header records both, so that a stale
+ * snapshot is ignored rather than leaving DOS with buffers of a disk
+ * that has changed.
+ *
+ * Both save and restore are only requested from the DOS side. They are
+ * performed from the main loop once no cooperative thread is active,
+ * so that no thread gets resumed with a stale register set.
+ */
+
+#include <stdio.h>
+#include <stddef.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <unistd.h>
+#include <dirent.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <sys/stat.h>
+
+#include "emu.h"
+#include "memory.h"
+#include "hma.h"
+#include "bios.h"
+#include "pic.h"
+#include "timers.h"
+#include "iodev.h"
+#include "coopth.h"
+#include "dpmi.h"
+#include "cpu-emu.h"
+#include "utilities.h"
+#include "dos2linux.h"
+#include "disks.h"
+#include "fatfs.h"
+#include "xms.h"
+#include "emm.h"
+#include "redirect.h"
+#include "snapshot.h"
+#include "version.h"
+
+#define SNAP_MAGIC "DOSEMUSNAP"
+#define SNAP_VERSION 2
+
+struct snap_header {
+  char magic[12];
+  uint32_t version;
+  char verstr[16];
+  int32_t mem_size, ext_mem, xms_size, ems_size;
+  int32_t umb_a0, umb_b0, umb_f0;
+  int32_t cpu_vm, cpu_vm_dpmi;
+  uint32_t disks;
+};
+
+enum { SNAP_END, SNAP_CPU, SNAP_FPU, SNAP_MEM, SNAP_HMA, SNAP_PIC, SNAP_PIT };
+
+struct snap_section {
+  uint32_t type;
+  uint32_t addr;
+  uint32_t len;
+};
+
+struct snap_cpu {
+  struct vm86_regs regs;
+  uint32_t a20;
+};
+
+static enum { SNAP_IDLE, SNAP_SAVE, SNAP_RESTORE } pending;
+static unsigned char *restore_buf;
+static size_t restore_len;
+
+static uint32_t fnv(uint32_t h, const void *data, size_t len)
+{
+  const unsigned char *p = data;
+
+  while (len--)
+    h = (h ^ *p++) * 16777619u;
+  return h;
+}
+
+static uint32_t stat_hash(const char *name, const struct stat *st)
+{
+  uint32_t h = fnv(2166136261u, name, strlen(name));
+
+  h = fnv(h, &st->st_mode, sizeof(st->st_mode));
+  h = fnv(h, &st->st_size, sizeof(st->st_size));
+  h = fnv(h, &st->st_mtim, sizeof(st->st_mtim));
+  return h;
+}
+
+/* what DOS would read from a directory drive: the name relative to the
+ * drive, the type and the contents, but no times, so that a file that
+ * is rewritten with the same contents doesn't count as a change */
+static uint32_t entry_hash(const char *path, const char *name,
+	const struct stat *st)
+{
+  static unsigned char buf[65536];
+  mode_t type = st->st_mode & S_IFMT;
+  uint32_t h = fnv(2166136261u, name, strlen(name));
+  ssize_t n;
+  int fd;
+
+  h = fnv(h, &type, sizeof(type));
+  if (S_ISLNK(st->st_mode)) {
+    n = readlink(path, (char *)buf, sizeof(buf));
+    if (n > 0)
+      h = fnv(h, buf, n);
+  } else if (S_ISREG(st->st_mode)) {
+    h = fnv(h, &st->st_size, sizeof(st->st_size));
+    fd = open(path, O_RDONLY | O_CLOEXEC);
+    if (fd == -1)
+      return h;
+    while ((n = read(fd, buf, sizeof(buf))) > 0)
+      h = fnv(h, buf, n);
+    close(fd);
+  }
+  return h;
+}
+
+/* the names and contents of everything below path, in any order;
+ * names are hashed from root on */
+static uint32_t dir_hash(char *path, size_t len, size_t root)
+{
+  struct dirent *de;
+  struct stat st;
+  uint32_t h = 0;
+  DIR *d;
+
+  d = opendir(path);
+  if (!d)
+    return 0;
+  while ((de = readdir(d))) {
+    size_t n = strlen(de->d_name);
+
+    if (strcmp(de->d_name, ".") == 0 || strcmp(de->d_name, "..") == 0)
+      continue;
+    if (len + n + 2 > PATH_MAX)
+      continue;
+    path[len] = '/';
+    memcpy(path + len + 1, de->d_name, n + 1);
+    if (lstat(path, &st) == 0) {
+      h += entry_hash(path, path + root, &st);
+      if (S_ISDIR(st.st_mode))
+	h += dir_hash(path, len + n + 1, root);
+    }
+  }
+  closedir(d);
+  path[len] = '\0';
+  return h;
+}
+
+static uint32_t disk_hash(const struct disk *dp)
+{
+  char path[PATH_MAX];
+  struct stat st;
+  uint32_t h;
+
+  if (!dp->dev_name || stat(dp->dev_name, &st) != 0)
+    return 0;
+  if (dp->type != DIR_TYPE)
+    return stat_hash(dp->dev_name, &st) + dp->drive_num;
+  /* the same tree found elsewhere, as in another test directory, is
+   * the same disk */
+  h = dp->drive_num;
+  if (strlen(dp->dev_name) < sizeof(path)) {
+    strcpy(path, dp->dev_name);
+    h += dir_hash(path, strlen(path), strlen(path));
+  }
+  return h;
+}
+
+/* changes whenever any disk image or directory drive has changed */
+static uint32_t disks_hash(void)
+{
+  uint32_t h = 2166136261u, d;
+  int i;
+
+  for (i = 0; i < config.fdisks; i++) {
+    d = disk_hash(&disktab[i]);
+    h = fnv(h, &d, sizeof(d));
+  }
+  FOR_EACH_HDISK(i, {
+    d = disk_hash(&hdisktab[i]);
+    h = fnv(h, &d, sizeof(d));
+  });
+  return h;
+}
+
+static void fill_header(struct snap_header *h)
+{
+  memset(h, 0, sizeof(*h));
+  strncpy(h->magic, SNAP_MAGIC, sizeof(h->magic));
+  h->version = SNAP_VERSION;
+  strncpy(h->verstr, VERSTR, sizeof(h->verstr) - 1);
+  h->mem_size = config.mem_size;
+  h->ext_mem = config.ext_mem;
+  h->xms_size = config.xms_size;
+  h->ems_size = config.ems_size;
+  h->umb_a0 = config.umb_a0;
+  h->umb_b0 = config.umb_b0;
+  h->umb_f0 = config.umb_f0;
+  h->cpu_vm = config.cpu_vm;
+  h->cpu_vm_dpmi = config.cpu_vm_dpmi;
+  h->disks = disks_hash();
+}
+
+static int write_section(FILE *f, uint32_t type, uint32_t addr,
+	const void *data, uint32_t len)
+{
+  struct snap_section s = { .type = type, .addr = addr, .len = len };
+
+  if (fwrite(&s, sizeof(s), 1, f) != 1)
+    return -1;
+  if (len && fwrite(data, len, 1, f) != 1)
+    return -1;
+  return 0;
+}
+
+/* base DOS memory and UMBs are saved, anything else is either ROM,
+ * video memory or mapped from host-side state */
+static int mem_saved(dosaddr_t addr)
+{
+  unsigned char type = memcheck_get_type(addr);
+  return type == 'd' || type == 'U';
+}
+
+static int save_mem(FILE *f)
+{
+  const unsigned gran = 1024;
+  dosaddr_t addr, start;
+
+  for (addr = 0; addr < LOWMEM_SIZE; addr += gran) {
+    if (!mem_saved(addr))
+      continue;
+    start = addr;
+    while (addr < LOWMEM_SIZE && mem_saved(addr))
+      addr += gran;
+    if (write_section(f, SNAP_MEM, start, LINEAR2UNIX(start),
+		      addr - start) == -1)
+      return -1;
+  }
+  return 0;
+}
+
+static int save_hma(FILE *f)
+{
+  int old_a20 = a20;
+  int ret;
+
+  if (!config.ext_mem)
+    return 0;
+  if (!old_a20)
+    set_a20(1);
+  ret = write_section(f, SNAP_HMA, LOWMEM_SIZE, LINEAR2UNIX(LOWMEM_SIZE),
+		      HMASIZE);
+  if (!old_a20)
+    set_a20(0);
+  return ret;
+}
+
+/* the reason a snapshot would not come back as it was, NULL if none */
+static const char *save_blocker(void)
+{
+  if (config.boot_dos == FATFS_FDP_D)
+    return "the FDPP kernel is not part of a snapshot";
+  if (in_dpmi_pm() || dpmi_active())
+    return "a DPMI client is running";
+  if (xms_in_use())
+    return "the HMA, an XMS block or a UMB is allocated";
+  if (emm_in_use())
+    return "EMS memory is allocated";
+  if (mfs_in_use())
+    return "the redirector is in use";
+  return NULL;
+}
+
+static void do_save(void)
+{
+  struct snap_header h;
+  struct snap_cpu cpu;
+  struct pic_snapshot pics;
+  struct pit_snapshot pits;
+  const char *why;
+  char *tmpname;
+  FILE *f;
+  int fd, ret;
+
+  why = save_blocker();
+  if (why) {
+    error("snapshot: can't save, %s\n", why);
+    return;
+  }
+  /* other sessions may save the same snapshot at the same time */
+  if (asprintf(&tmpname, "%s.XXXXXX", config.snapshot_file) == -1)
+    return;
+  fd = mkstemp(tmpname);
+  f = (fd == -1 ? NULL : fdopen(fd, "w"));
+  if (!f) {
+    error("snapshot: can't create %s: %s\n", tmpname, strerror(errno));
+    if (fd != -1) {
+      close(fd);
+      unlink(tmpname);
+    }
+    free(tmpname);
+    return;
+  }
+
+  fill_header(&h);
+  memset(&cpu, 0, sizeof(cpu));
+  cpu.regs = REGS;
+  cpu.a20 = a20;
+  pic_snapshot_save(&pics);
+  pit_snapshot_save(&pits);
+
+  ret = fwrite(&h, sizeof(h), 1, f) == 1 ? 0 : -1;
+  if (ret == 0)
+    ret = write_section(f, SNAP_CPU, 0, &cpu, sizeof(cpu));
+  if (ret == 0)
+    ret = write_section(f, SNAP_FPU, 0, vm86_fpu_state,
+			sizeof(*vm86_fpu_state));
+  if (ret == 0)
+    ret = save_mem(f);
+  if (ret == 0)
+    ret = save_hma(f);
+  if (ret == 0)
+    ret = write_section(f, SNAP_PIC, 0, &pics, sizeof(pics));
+  if (ret == 0)
+    ret = write_section(f, SNAP_PIT, 0, &pits, sizeof(pits));
+  if (ret == 0)
+    ret = write_section(f, SNAP_END, 0, NULL, 0);
+  if (fclose(f) != 0)
+    ret = -1;
+
+  if (ret == 0 && rename(tmpname, config.snapshot_file) == 0) {
+    c_printf("snapshot: saved to %s\n", config.snapshot_file);
+  } else {
+    error("snapshot: failed to write %s: %s\n", config.snapshot_file,
+	  strerror(errno));
+    unlink(tmpname);
+  }
+  free(tmpname);
+}
+
+/* check that every section fits in the buffer and targets memory
+ * this session has too; nothing is applied until the whole file
+ * passed */
+static int check_sections(const unsigned char *p, size_t len)
+{
+  const unsigned char *end = p + len;
+  struct snap_section s;
+  int have_cpu = 0;
+
+  while (p + sizeof(s) <= end) {
+    memcpy(&s, p, sizeof(s));
+    p += sizeof(s);
+    if (s.len > end - p)
+      return -1;
+    switch (s.type) {
+    case SNAP_END:
+      return have_cpu ? 0 : -1;
+    case SNAP_CPU:
+      if (s.len != sizeof(struct snap_cpu))
+	return -1;
+      have_cpu = 1;
+      break;
+    case SNAP_FPU:
+      if (s.len != sizeof(*vm86_fpu_state))
+	return -1;
+      break;
+    case SNAP_MEM: {
+      dosaddr_t a;
+      if (s.addr >= LOWMEM_SIZE || s.len > LOWMEM_SIZE - s.addr)
+	return -1;
+      for (a = s.addr; a < s.addr + s.len; a += 1024)
+	if (!mem_saved(a))
+	  return -1;
+      break;
+    }
+    case SNAP_HMA:
+      if (!config.ext_mem || s.addr != LOWMEM_SIZE || s.len != HMASIZE)
+	return -1;
+      break;
+    case SNAP_PIC:
+      if (s.len != sizeof(struct pic_snapshot))
+	return -1;
+      break;
+    case SNAP_PIT:
+      if (s.len != sizeof(struct pit_snapshot))
+	return -1;
+      break;
+    default:
+      return -1;
+    }
+    p += s.len;
+  }
+  return -1;
+}
+
+static void do_restore(void)
+{
+  const unsigned char *p = restore_buf + sizeof(struct snap_header);
+  struct snap_section s;
+  struct snap_cpu cpu;
+  Bit32u ticks = READ_DWORD(BIOS_TICK_ADDR);
+  Bit8u overflow = READ_BYTE(TICK_OVERFLOW_ADDR);
+
+  for (;;) {
+    memcpy(&s, p, sizeof(s));
+    p += sizeof(s);
+    switch (s.type) {
+    case SNAP_CPU:
+      memcpy(&cpu, p, sizeof(cpu));
+      break;
+    case SNAP_FPU:
+      memcpy(vm86_fpu_state, p, s.len);
+      break;
+    case SNAP_MEM:
+      e_invalidate_full(s.addr, s.len);
+      MEMCPY_2DOS(s.addr, p, s.len);
+      break;
+    case SNAP_HMA:
+      if (!a20)
+	set_a20(1);
+      e_invalidate_full(s.addr, s.len);
+      MEMCPY_2DOS(s.addr, p, s.len);
+      break;
+    case SNAP_PIC:
+      pic_snapshot_restore((const struct pic_snapshot *)p);
+      break;
+    case SNAP_PIT:
+      pit_snapshot_restore((const struct pit_snapshot *)p);
+      break;
+    }
+    if (s.type == SNAP_END)
+      break;
+    p += s.len;
+  }
+
+  if (a20 != cpu.a20)
+    set_a20(cpu.a20);
+  REGS = cpu.regs;
+  /* keep the time of day running from the real boot */
+  WRITE_DWORD(BIOS_TICK_ADDR, ticks);
+  WRITE_BYTE(TICK_OVERFLOW_ADDR, overflow);
+
+  c_printf("snapshot: restored from %s\n", config.snapshot_file);
+  /* there is no boot output, say why */
+  p_dos_str("\r\nRestored from snapshot\r\n");
+}
+
+/*
+ * Called from the EMUSNAP builtin. The state is written out once the
+ * builtin has returned to DOS. Returns -1 without a snapshot file, -2
+ * with the reason in *why if the state can't be saved.
+ */
+int snapshot_request_save(const char **why)
+{
+  if (!config.snapshot_file)
+    return -1;
+  *why = save_blocker();
+  if (*why)
+    return -2;
+  pending = SNAP_SAVE;
+  return 0;
+}
+
+/*
+ * Called in place of the boot sector load. Returns 1 if a valid
+ * snapshot was found, it is then restored from the main loop.
+ */
+int snapshot_want_restore(void)
+{
+  struct snap_header h, want;
+  struct stat st;
+  FILE *f;
+
+  if (!config.snapshot_file || stat(config.snapshot_file, &st) != 0)
+    return 0;
+  if (st.st_size < sizeof(h))
+    goto bad;
+  f = fopen(config.snapshot_file, "r");
+  if (!f)
+    goto bad;
+  restore_len = st.st_size;
+  restore_buf = malloc(restore_len);
+  if (!restore_buf || fread(restore_buf, restore_len, 1, f) != 1) {
+    fclose(f);
+    goto bad;
+  }
+  fclose(f);
+
+  fill_header(&want);
+  memcpy(&h, restore_buf, sizeof(h));
+  if (h.disks != want.disks && memcmp(&h, &want, offsetof(struct snap_header,
+	disks)) == 0) {
+    error("snapshot: the disks changed since %s was saved, booting\n",
+	  config.snapshot_file);
+    goto out;
+  }
+  if (memcmp(&h, &want, sizeof(h)) != 0) {
+    error("snapshot: %s was saved with a different setup, booting\n",
+	  config.snapshot_file);
+    goto out;
+  }
+  if (check_sections(restore_buf + sizeof(h), restore_len - sizeof(h))) {
+    error("snapshot: %s is corrupt, booting\n", config.snapshot_file);
+    goto out;
+  }
+  pending = SNAP_RESTORE;
+  return 1;
+
+bad:
+  error("snapshot: can't read %s, booting\n", config.snapshot_file);
+out:
+  free(restore_buf);
+  restore_buf = NULL;
+  return 0;
+}
+
+void snapshot_run(void)
+{
+  if (pending == SNAP_IDLE || coopth_get_active_count())
+    return;
+  if (pending == SNAP_SAVE) {
+    do_save();
+  } else {
+    do_restore();
+    free(restore_buf);
+    restore_buf = NULL;
+  }
+  pending = SNAP_IDLE;
+}
@@ -30,6 +30,7 @@
 #include "dos2linux.h"
 #include "dosemu_config.h"
 #include "mhpdbg.h"
+#include "logring.h"
 
 /*
  * NOTE: SHOW_TIME _only_ should be enabled for
@@ -164,6 +165,13 @@ int vlog_printf(int flg, const char *fmt, va_list args)
 #endif
      ) return 0;
 
+  if (logring_size) {
+    if (flg != -1)
+      return logring_store(fmt, args);
+    /* keep the order: stored messages go before this one */
+    logring_flush(fileno(dbg_fd));
+  }
+
 #ifdef CIRCULAR_LOGBUFFER
   logptr = loglines[loglineidx++];
 #endif
@@ -263,8 +271,14 @@ int log_printf(int flg, const char *fmt, ...)
 	{
 		if (!flg || !dbg_fd ) return 0;
 	}
-	in_log_printf = 1;
 	va_start(args, fmt);
+	if (logring_size && flg != -1) {
+		/* storing into the ring needs no lock */
+		ret = vlog_printf(flg, fmt, args);
+		va_end(args);
+		return ret;
+	}
+	in_log_printf = 1;
 	pthread_mutex_lock(&log_mtx);
 	ret = vlog_printf(flg, fmt, args);
 	pthread_mutex_unlock(&log_mtx);
@@ -291,7 +305,16 @@ void verror(const char *fmt, va_list args)
     vfprintf(stderr, fmt, orig_args);
     va_end(orig_args);
   }
-  vlog_printf(10, fmt, args);
+  if (logring_size && fmt == fmtbuf) {
+    /* the ring keeps the format pointer, which must not be our stack;
+     * log_printf() takes no lock when storing into the ring */
+    char msg[1024];
+
+    vsnprintf(msg, sizeof(msg), fmt, args);
+    log_printf(10, "%s", msg);
+  } else {
+    vlog_printf(10, fmt, args);
+  }
   pthread_mutex_unlock(&log_mtx);
 }
 
@@ -1,5 +1,6 @@
 @echo off
 system %1 %2 %3
+if "%DOSEMU_BATCH%" == "1" goto batch
 if "%DOSEMU_SYS_CMD%" == "" goto done
 if not "%DOSEMU_SYS_DRV%" == "" %DOSEMU_SYS_DRV%:
 if ERRORLEVEL 1 exitemu 1
@@ -8,4 +9,13 @@ if ERRORLEVEL 1 exitemu 1
 %COMSPEC% /E:1024 /C %DOSEMU_SYS_CMD%
 if "%DOSEMU_EXIT%" == "1" exitemu %ERRORLEVEL%
 C:
+goto done
+:batch
+system -b %ERRORLEVEL%
+if "%DOSEMU_SYS_CMD%" == "" exitemu %DOSEMU_BATCH_RC%
+%DOSEMU_SYS_DRV%:
+cd %DOSEMU_SYS_DIR%
+if ERRORLEVEL 1 goto batch
+%COMSPEC% /E:1024 /C %DOSEMU_SYS_CMD% > %DOSEMU_BATCH_OUT%
+goto batch
 :done
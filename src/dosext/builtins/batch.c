@@ -0,0 +1,386 @@
+/*
+ *  This program is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+ *
+ *  You should have received a copy of the GNU General Public License
+ *  along with this program; if not, write to the Free Software
+ *  Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+ */
+
+/*
+ * Purpose: batch mode, run all commands of a manifest given with -b
+ * one after another in a single DOS session.
+ *
+ * The manifest has one command per line, fields separated by tabs:
+ *
+ *   unix_path[:dos_path]	timeout	command line
+ *
+ * unix_path is mounted as a drive like with -K and dos_path is the
+ * current directory on it. timeout is in seconds, 0 means no limit.
+ * Empty lines and lines starting with '#' are skipped.
+ *
+ * exechlp.bat loops over "system -b", which records the result of the
+ * previous command and hands out the next one in the same environment
+ * variables that "system -e" uses. For each command one JSON line is
+ * appended to MANIFEST.results:
+ *
+ *   {"index": 0, "dir": "...", "command": "...", "exit": 0,
+ *    "elapsed": 1.234, "output": "..."}
+ *
+ * The output is what the command wrote to stdout, redirected to a file
+ * on a private temporary drive. A command that runs past its timeout
+ * can't be killed alone, so its record gets "timeout": true and the
+ * session ends; the commands after it get no record.
+ */
+
+#include "emu.h"
+#include <errno.h>
+#include <limits.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include <dirent.h>
+
+#include "init.h"
+#include "int.h"
+#include "sig.h"
+#include "builtins.h"
+#include "utilities.h"
+#include "dosemu_config.h"
+#include "msetenv.h"
+#include "batch.h"
+
+#define BATCH_OUT "BATCH.OUT"
+
+struct batch_cmd {
+  char *dir;
+  char *dos_path;
+  int *drv_num_p;
+  int timeout;
+  char *cmd;
+};
+
+static struct batch_cmd *cmds;
+static int num_cmds;
+static int next_cmd;
+static int cur_cmd = -1;
+static struct timespec cur_start;
+static int failed;
+
+static char *out_dir;
+static int *out_drv_num_p;
+static FILE *results;
+
+static double elapsed(void)
+{
+  struct timespec now;
+
+  clock_gettime(CLOCK_MONOTONIC, &now);
+  return (now.tv_sec - cur_start.tv_sec) +
+      (now.tv_nsec - cur_start.tv_nsec) / 1e9;
+}
+
+static void json_str(FILE *f, const char *s, size_t len)
+{
+  size_t i;
+
+  fputc('"', f);
+  for (i = 0; i < len; i++) {
+    unsigned char c = s[i];
+    switch (c) {
+    case '"':
+    case '\\':
+      fprintf(f, "\\%c", c);
+      break;
+    case '\n':
+      fputs("\\n", f);
+      break;
+    case '\r':
+      fputs("\\r", f);
+      break;
+    case '\t':
+      fputs("\\t", f);
+      break;
+    default:
+      if (c < 0x20 || c >= 0x7f)
+        fprintf(f, "\\u%04x", c);
+      else
+        fputc(c, f);
+      break;
+    }
+  }
+  fputc('"', f);
+}
+
+/* DOS may have created the capture file in either case */
+static char *out_file_path(void)
+{
+  DIR *d;
+  struct dirent *de;
+  char *ret = NULL;
+
+  d = opendir(out_dir);
+  if (!d)
+    return NULL;
+  while ((de = readdir(d))) {
+    if (strcasecmp(de->d_name, BATCH_OUT) == 0) {
+      ret = assemble_path(out_dir, de->d_name);
+      break;
+    }
+  }
+  closedir(d);
+  return ret;
+}
+
+static void record_result(int rc, int timed_out)
+{
+  struct batch_cmd *c = &cmds[cur_cmd];
+  char *path, *out = NULL;
+  size_t len = 0;
+
+  path = out_file_path();
+  if (path) {
+    FILE *f = fopen(path, "r");
+    if (f) {
+      fseek(f, 0, SEEK_END);
+      len = ftell(f);
+      rewind(f);
+      out = malloc(len + 1);
+      len = fread(out, 1, len, f);
+      fclose(f);
+    }
+    unlink(path);
+    free(path);
+  }
+
+  fprintf(results, "{\"index\": %i, \"dir\": ", cur_cmd);
+  json_str(results, c->dir, strlen(c->dir));
+  fputs(", \"command\": ", results);
+  json_str(results, c->cmd, strlen(c->cmd));
+  fprintf(results, ", \"exit\": %i, \"elapsed\": %.3f, \"output\": ",
+      rc, elapsed());
+  json_str(results, out ? out : "", len);
+  if (timed_out)
+    fputs(", \"timeout\": true", results);
+  fputs("}\n", results);
+  fflush(results);
+  free(out);
+
+  if (rc != 0)
+    failed = 1;
+  cur_cmd = -1;
+}
+
+static void batch_tick(void)
+{
+  struct batch_cmd *c;
+
+  if (cur_cmd == -1)
+    return;
+  c = &cmds[cur_cmd];
+  if (!c->timeout || elapsed() < c->timeout)
+    return;
+  error("batch: command %i timed out after %is: %s\n",
+      cur_cmd, c->timeout, c->cmd);
+  record_result(-1, 1);
+  leavedos(124);
+}
+
+int batch_active(void)
+{
+  return !!cmds;
+}
+
+/* system -b [ERRORLEVEL] */
+int batch_next(const char *errorlevel)
+{
+  struct batch_cmd *c;
+  char drv[2], out[16];
+
+  if (!cmds)
+    return 1;
+  if (cur_cmd != -1)
+    record_result(errorlevel ? atoi(errorlevel) : 0, 0);
+  if (next_cmd >= num_cmds) {
+    msetenv("DOSEMU_SYS_CMD", "");
+    msetenv("DOSEMU_BATCH_RC", failed ? "1" : "0");
+    return 0;
+  }
+
+  c = &cmds[next_cmd];
+  if (*c->drv_num_p < 0 || *out_drv_num_p < 0) {
+    com_fprintf(com_stderr, "ERROR: Cannot find a drive\n");
+    return 1;
+  }
+  drv[0] = *c->drv_num_p + 'A';
+  drv[1] = '\0';
+  msetenv("DOSEMU_SYS_DRV", drv);
+  msetenv("DOSEMU_SYS_DIR", c->dos_path ?: "\\");
+  snprintf(out, sizeof(out), "%c:\\" BATCH_OUT, *out_drv_num_p + 'A');
+  msetenv("DOSEMU_BATCH_OUT", out);
+  msetenv("DOSEMU_SYS_CMD", c->cmd);
+
+  cur_cmd = next_cmd++;
+  clock_gettime(CLOCK_MONOTONIC, &cur_start);
+  return 0;
+}
+
+static int parse_line(char *line, struct batch_cmd *c)
+{
+  char *p, *t, *path;
+  const char *dir;
+  int i;
+
+  p = strchr(line, '\t');
+  if (!p)
+    return -1;
+  *p++ = '\0';
+  t = p;
+  p = strchr(t, '\t');
+  if (!p)
+    return -1;
+  *p++ = '\0';
+  if (!*p)
+    return -1;
+
+  c->dir = strdup(line);
+  c->cmd = strdup(p);
+  c->timeout = atoi(t);
+  c->dos_path = NULL;
+  p = strchr(c->dir, ':');
+  if (p) {
+    *p = '\0';
+    c->dos_path = strdup(p + 1);
+  }
+
+  dir = c->dir[0] ? c->dir : ".";
+  path = malloc(PATH_MAX);
+  if (!realpath(dir, path) || !exists_dir(path)) {
+    error("batch: directory %s does not exist\n", dir);
+    free(path);
+    return -1;
+  }
+  /* commands running in the same directory share a drive */
+  for (i = 0; i < num_cmds; i++) {
+    if (strcmp(cmds[i].dir, c->dir) == 0) {
+      c->drv_num_p = cmds[i].drv_num_p;
+      free(path);
+      return 0;
+    }
+  }
+  c->drv_num_p = add_extra_drive(path, 0, 0);
+  if (!c->drv_num_p)
+    return -1;
+  return 0;
+}
+
+static int load_manifest(const char *name)
+{
+  FILE *f;
+  char *line = NULL;
+  size_t size = 0;
+  ssize_t len;
+  int lnum = 0, ret = 0;
+
+  f = fopen(name, "r");
+  if (!f) {
+    error("batch: cannot open %s: %s\n", name, strerror(errno));
+    return -1;
+  }
+  while ((len = getline(&line, &size, f)) != -1) {
+    lnum++;
+    while (len && (line[len - 1] == '\n' || line[len - 1] == '\r'))
+      line[--len] = '\0';
+    if (!len || line[0] == '#')
+      continue;
+    cmds = realloc(cmds, sizeof(*cmds) * (num_cmds + 1));
+    if (parse_line(line, &cmds[num_cmds]) == -1) {
+      error("batch: %s:%i: bad line\n", name, lnum);
+      ret = -1;
+      break;
+    }
+    num_cmds++;
+  }
+  free(line);
+  fclose(f);
+  if (!ret && !num_cmds) {
+    error("batch: %s has no commands\n", name);
+    ret = -1;
+  }
+  return ret;
+}
+
+static void batch_scrub(void)
+{
+  char *tmpl, *rname;
+  const char *tmpdir;
+
+  if (!config.batch_file)
+    return;
+  if (load_manifest(config.batch_file) == -1)
+    goto err;
+
+  tmpdir = getenv("TMPDIR") ?: "/tmp";
+  tmpl = assemble_path(tmpdir, "dosemu-batch-XXXXXX");
+  out_dir = mkdtemp(tmpl);
+  if (!out_dir) {
+    error("batch: cannot create %s: %s\n", tmpl, strerror(errno));
+    free(tmpl);
+    goto err;
+  }
+  out_drv_num_p = add_extra_drive(strdup(out_dir), 0, 0);
+  if (!out_drv_num_p)
+    goto err;
+
+  rname = malloc(strlen(config.batch_file) + sizeof(".results"));
+  sprintf(rname, "%s.results", config.batch_file);
+  results = fopen(rname, "w");
+  if (!results) {
+    error("batch: cannot create %s: %s\n", rname, strerror(errno));
+    free(rname);
+    goto err;
+  }
+  free(rname);
+
+  sigalrm_register_handler(batch_tick);
+  register_exit_handler(batch_done);
+  return;
+
+err:
+  config.exitearly = 1;
+}
+
+void batch_done(void)
+{
+  char *path;
+
+  if (results) {
+    /* a command still running did not return to exechlp.bat */
+    if (cur_cmd != -1)
+      record_result(-1, 0);
+    fclose(results);
+    results = NULL;
+  }
+  if (out_dir) {
+    path = out_file_path();
+    if (path) {
+      unlink(path);
+      free(path);
+    }
+    rmdir(out_dir);
+  }
+}
+
+CONSTRUCTOR(static void init(void))
+{
+  register_config_scrub(batch_scrub);
+}
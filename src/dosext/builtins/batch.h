@@ -0,0 +1,10 @@
+/*
+ * All modifications in this file to the original code are
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+int batch_active(void);
+int batch_next(const char *errorlevel);
+void batch_done(void);
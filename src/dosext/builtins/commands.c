@@ -32,6 +32,7 @@
 #include "doshelpers.h"
 #include "dos2linux.h"
 #include "builtins.h"
+#include "snapshot.h"
 
 #include "commands.h"
 #include "lredir.h"
@@ -201,6 +202,28 @@ static int speed_main(int argc, char **argv)
 	return 0;
 }
 
+static int emusnap_main(int argc, char **argv)
+{
+	const char *why;
+
+	if (argc > 1) {
+		com_printf("USAGE: emusnap\n"
+			"Save the state of this session to the snapshot file,\n"
+			"to be restored instead of booting DOS next time.\n");
+		return 1;
+	}
+	switch (snapshot_request_save(&why)) {
+	case -1:
+		com_printf("emusnap: no snapshot file configured ($_snapshot)\n");
+		return 1;
+	case -2:
+		com_printf("emusnap: can't save a snapshot now, %s\n", why);
+		return 1;
+	}
+	com_printf("emusnap: saving snapshot to %s\n", config.snapshot_file);
+	return 0;
+}
+
 static int emufs_main(int argc, char **argv)
 {
 	int ret = EXIT_FAILURE;
@@ -250,4 +273,5 @@ CONSTRUCTOR(static void commands_plugin_init(void))
 	register_com_program("SYSTEM", system_main);
 	register_com_program("EMUFS", emufs_main);
 	register_com_program("EMUSOUND", emusound_main);
+	register_com_program("EMUSNAP", emusnap_main);
 }
@@ -44,6 +44,7 @@
 #include "redirect.h"
 #include "msetenv.h"
 #include "system.h"
+#include "batch.h"
 
 static int usage (void);
 static int do_execute_dos(int argc, char **argv);
@@ -59,7 +60,7 @@ int system_main(int argc, char **argv)
 {
   char c;
   int is_e = 0, is_p = 0;
-  const char *getopt_string = "ercsp";
+  const char *getopt_string = "ercspb";
 
   if (argc == 1 ||
       (argc == 2 && !strcmp (argv[1], "/?"))) {
@@ -86,6 +87,10 @@ int system_main(int argc, char **argv)
       is_p = 1;
       break;
 
+    case 'b':
+      /* Record the result of the last batch command and set up the next */
+      return batch_next(argc > 2 ? argv[2] : NULL);
+
     default:
       break;
     }
@@ -113,6 +118,8 @@ static int usage (void)
   com_printf ("  Execute the DOS command given in dosemu command line with -E or -K.\n\n");
   com_printf ("SYSTEM -s ENVVAR [DOSVAR]\n");
   com_printf ("  Set the DOS environment to the Linux environment variable \"ENVVAR\".\n\n");
+  com_printf ("SYSTEM -b [ERRORLEVEL]\n");
+  com_printf ("  Record the result of the last command of the -b manifest and set up the next.\n\n");
   com_printf ("SYSTEM -p\n");
   com_printf ("  Set DOS environment variables passed via dosemu command line\n\n");
   com_printf ("SYSTEM\n");
@@ -274,7 +281,9 @@ static int do_execute_cmdline(int parent)
       vars_parsed = 1;
     }
   }
-  if (config.dos_cmd)
+  if (batch_active())
+    msetenv("DOSEMU_BATCH", "1");
+  else if (config.dos_cmd)
     ret = do_system(config.dos_cmd, config.exit_on_cmd);
   return ret;
 }
@@ -62,6 +62,8 @@ extern long int __sysconf (int); /* for Debian eglibc 2.13-3 */
 #include "cpu-emu.h"
 #include "emu-ldt.h"
 #include "kvm.h"
+#include "prof.h"
+#include "evlog.h"
 
 /*
  * DPMI 1.0 specs erroneously claims that the exceptions 1..5 and 7
@@ -509,7 +511,7 @@ static int do_dpmi_exit(sigcontext_t *scp)
 
 static int _dpmi_control(void)
 {
-    int ret;
+    int ret, pz;
     sigcontext_t *scp = &DPMI_CLIENT.stack_frame;
 
     do {
@@ -522,6 +524,7 @@ static int _dpmi_control(void)
           D_printf("DPMI: Return to client at %04x:%08x, Stack 0x%x:0x%08x, flags=%#x\n",
                    _cs, _eip, _ss, _esp, eflags_VIF(_eflags));
       }
+      pz = prof_enter(PROF_GUEST);
       if (config.cpu_vm_dpmi == CPUVM_KVM)
         ret = kvm_dpmi(scp);
 #ifdef X86_EMULATOR
@@ -530,6 +533,7 @@ static int _dpmi_control(void)
 #endif
       else
         ret = do_dpmi_control(scp);
+      prof_leave(pz);
       if (debug_level('M') > 5)
         D_printf("DPMI: switch to dosemu\n");
       if (ret == DPMI_RET_FAULT)
@@ -3548,6 +3552,16 @@ void dpmi_init(void)
       dpmi_tid = co_create(co_handle, dpmi_thr, NULL, NULL, SIGSTACK_SIZE);
   }
 
+  if (evlog_enabled) {
+    struct evlog_rec r;
+
+    evlog_begin(&r, 'M', "client");
+    evlog_int(&r, "client", in_dpmi);
+    evlog_int(&r, "bits", DPMI_CLIENT.is_32 ? 32 : 16);
+    evlog_hex(&r, "psp", psp);
+    evlog_end(&r);
+  }
+
   dpmi_set_pm(1);
 
   for (i = 0; i < RSP_num; i++) {
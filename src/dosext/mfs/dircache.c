@@ -0,0 +1,303 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+/*
+ * Directory index for the redirector.
+ *
+ * FindFirst with wildcards and the case/mangled name resolution in
+ * scan_dir() used to read the whole host directory and convert every
+ * name to DOS on each call, which is O(N) per lookup and O(N^2) for
+ * DOS programs that open every file of a large directory in turn.
+ *
+ * Here the converted names of a directory are kept together with two
+ * hash tables, on the 8.3 name and on the long name. An entry is
+ * dropped as soon as inotify reports a change to the directory, and
+ * is also checked against the directory's mtime so that changes on
+ * filesystems without inotify support (NFS etc) get noticed too.
+ * Directories on VFAT, which are read through the VFAT ioctls, are
+ * not cached, nor is anything if inotify is not available.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <limits.h>
+#include <unistd.h>
+#include <errno.h>
+#include <sys/stat.h>
+#include <sys/inotify.h>
+
+#include "emu.h"
+#include "mangle.h"
+#include "mfs.h"
+#include "dos2linux.h"
+#include "dircache.h"
+
+#define DC_MAX_DIRS 32
+#define DC_WATCH_MASK (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | \
+	IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+struct dc_dir {
+  struct dircache dc;
+  char *path;
+  int wd;
+  dev_t dev;
+  ino_t ino;
+  struct timespec mtim;
+  unsigned hmask;
+  int *h83;		/* indexes into dc.ents, -1 if empty */
+  int *hlfn;
+  unsigned long last_use;
+};
+
+static struct dc_dir *dc_dirs[DC_MAX_DIRS];
+static unsigned long dc_clock;
+static int dc_ifd = -1;
+static int dc_inited;
+
+static unsigned dc_hash(const char *s)
+{
+  unsigned h = 2166136261u;
+
+  while (*s) {
+    h ^= (unsigned char)*s++;
+    h *= 16777619u;
+  }
+  return h;
+}
+
+/* linear probing keeps entries with the same key in readdir order */
+static void dc_insert(int *tbl, unsigned mask, const char *key, int idx)
+{
+  unsigned i = dc_hash(key) & mask;
+
+  while (tbl[i] != -1)
+    i = (i + 1) & mask;
+  tbl[i] = idx;
+}
+
+static void dc_free(int slot, int rm_watch)
+{
+  struct dc_dir *d = dc_dirs[slot];
+  int i;
+
+  dc_dirs[slot] = NULL;
+  if (rm_watch) {
+    for (i = 0; i < DC_MAX_DIRS; i++)
+      if (dc_dirs[i] && dc_dirs[i]->wd == d->wd)
+	break;
+    /* the same directory under another path shares the watch */
+    if (i == DC_MAX_DIRS)
+      inotify_rm_watch(dc_ifd, d->wd);
+  }
+  for (i = 0; i < d->dc.nr; i++) {
+    free(d->dc.ents[i].d_name);
+    free(d->dc.ents[i].lname);
+  }
+  free(d->dc.ents);
+  free(d->h83);
+  free(d->hlfn);
+  free(d->path);
+  free(d);
+}
+
+static void dc_invalidate_wd(int wd, int rm_watch)
+{
+  int i;
+
+  for (i = 0; i < DC_MAX_DIRS; i++) {
+    if (dc_dirs[i] && (wd == -1 || dc_dirs[i]->wd == wd)) {
+      Debug0((dbg_fd, "dircache: dropping %s\n", dc_dirs[i]->path));
+      dc_free(i, rm_watch);
+    }
+  }
+}
+
+static void dc_drain_events(void)
+{
+  char buf[4096] __attribute__((aligned(__alignof__(struct inotify_event))));
+  const struct inotify_event *ev;
+  ssize_t len;
+  char *p;
+
+  while ((len = read(dc_ifd, buf, sizeof(buf))) > 0) {
+    for (p = buf; p < buf + len; p += sizeof(*ev) + ev->len) {
+      ev = (const struct inotify_event *)p;
+      if (ev->mask & IN_Q_OVERFLOW)
+	dc_invalidate_wd(-1, 1);
+      else
+	dc_invalidate_wd(ev->wd, !(ev->mask & IN_IGNORED));
+    }
+  }
+}
+
+static int dc_init(void)
+{
+  if (!dc_inited) {
+    dc_inited = 1;
+    dc_ifd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC);
+    if (dc_ifd == -1)
+      Debug0((dbg_fd, "dircache: inotify not available: %s\n",
+	      strerror(errno)));
+  }
+  return dc_ifd != -1;
+}
+
+static void dc_fill_ent(struct dircache_ent *e, const struct mfs_dirent *de)
+{
+  char tmpname[NAME_MAX + 1];
+
+  e->d_name = strdup(de->d_name);
+  e->lname = NULL;
+  e->flags = 0;
+
+  if (name_ufs_to_dos(tmpname, de->d_long_name)) {
+    strupperDOS(tmpname);
+    e->lname = strdup(tmpname);
+  }
+
+  /* the same conversion convert_compare() and scan_dir() do */
+  name_ufs_to_dos(tmpname, de->d_name);
+  if (name_convert(tmpname, 0))
+    e->flags |= DCE_8_3;
+  else
+    name_convert(tmpname, MANGLE);
+  strupperDOS(tmpname);
+  strncpy(e->name83, tmpname, sizeof(e->name83) - 1);
+  e->name83[sizeof(e->name83) - 1] = '\0';
+  extract_filename(e->name83, e->fname, e->fext);
+}
+
+static struct dc_dir *dc_read(const char *path, struct mfs_dir *dir,
+	const struct stat *st, int wd)
+{
+  struct dc_dir *d;
+  struct mfs_dirent *de;
+  int alloc = 64;
+  unsigned size;
+  int i;
+
+  d = calloc(1, sizeof(*d));
+  d->path = strdup(path);
+  d->wd = wd;
+  d->dev = st->st_dev;
+  d->ino = st->st_ino;
+  d->mtim = st->st_mtim;
+  d->dc.ents = malloc(alloc * sizeof(*d->dc.ents));
+
+  while ((de = dos_readdir(dir))) {
+    if (d->dc.nr == alloc) {
+      alloc *= 2;
+      d->dc.ents = realloc(d->dc.ents, alloc * sizeof(*d->dc.ents));
+    }
+    dc_fill_ent(&d->dc.ents[d->dc.nr++], de);
+  }
+
+  for (size = 16; size < 2 * d->dc.nr; size *= 2);
+  d->hmask = size - 1;
+  d->h83 = malloc(size * sizeof(int));
+  d->hlfn = malloc(size * sizeof(int));
+  memset(d->h83, 0xff, size * sizeof(int));
+  memset(d->hlfn, 0xff, size * sizeof(int));
+  for (i = 0; i < d->dc.nr; i++) {
+    dc_insert(d->h83, d->hmask, d->dc.ents[i].name83, i);
+    if (d->dc.ents[i].lname)
+      dc_insert(d->hlfn, d->hmask, d->dc.ents[i].lname, i);
+  }
+  return d;
+}
+
+/*
+ * Returns the index of the directory at path, reading it through dir
+ * (just opened with dos_opendir()) if it is not cached or out of date.
+ * Returns NULL if the directory can't be cached, dir is then untouched.
+ * The result stays valid until the next call.
+ */
+struct dircache *dircache_get(const char *path, struct mfs_dir *dir)
+{
+  struct stat st;
+  int i, slot = -1;
+  int wd;
+
+  if (!dir->dir || !dc_init())
+    return NULL;
+  dc_drain_events();
+  if (stat(path, &st) != 0)
+    return NULL;
+
+  for (i = 0; i < DC_MAX_DIRS; i++) {
+    struct dc_dir *d = dc_dirs[i];
+    if (!d) {
+      if (slot == -1 || dc_dirs[slot])
+	slot = i;
+      continue;
+    }
+    if (strcmp(d->path, path) != 0) {
+      if (slot == -1 || (dc_dirs[slot] && d->last_use < dc_dirs[slot]->last_use))
+	slot = i;
+      continue;
+    }
+    if (d->dev == st.st_dev && d->ino == st.st_ino &&
+	d->mtim.tv_sec == st.st_mtim.tv_sec &&
+	d->mtim.tv_nsec == st.st_mtim.tv_nsec) {
+      d->last_use = ++dc_clock;
+      return &d->dc;
+    }
+    dc_free(i, 1);
+    slot = i;
+    break;
+  }
+
+  if (dc_dirs[slot])
+    dc_free(slot, 1);
+  /* add the watch first so that no change during the read gets lost */
+  wd = inotify_add_watch(dc_ifd, path, DC_WATCH_MASK);
+  if (wd == -1) {
+    Debug0((dbg_fd, "dircache: can't watch %s: %s\n", path, strerror(errno)));
+    return NULL;
+  }
+  dc_dirs[slot] = dc_read(path, dir, &st, wd);
+  dc_dirs[slot]->last_use = ++dc_clock;
+  Debug0((dbg_fd, "dircache: read %s, %d entries\n", path,
+	  dc_dirs[slot]->dc.nr));
+  return &dc_dirs[slot]->dc;
+}
+
+/*
+ * Looks up an uppercased 8.3 name. Names that are not 8.3 are only
+ * matched by their mangled name if maybe_mangled is set.
+ */
+struct dircache_ent *dircache_find_83(struct dircache *dc,
+	const char *dosname, int maybe_mangled)
+{
+  struct dc_dir *d = (struct dc_dir *)dc;
+  unsigned i;
+
+  for (i = dc_hash(dosname) & d->hmask; d->h83[i] != -1;
+       i = (i + 1) & d->hmask) {
+    struct dircache_ent *e = &dc->ents[d->h83[i]];
+    if ((maybe_mangled || (e->flags & DCE_8_3)) &&
+	strcmp(e->name83, dosname) == 0)
+      return e;
+  }
+  return NULL;
+}
+
+/* looks up an uppercased long name */
+struct dircache_ent *dircache_find_lfn(struct dircache *dc,
+	const char *dosname)
+{
+  struct dc_dir *d = (struct dc_dir *)dc;
+  unsigned i;
+
+  for (i = dc_hash(dosname) & d->hmask; d->hlfn[i] != -1;
+       i = (i + 1) & d->hmask) {
+    struct dircache_ent *e = &dc->ents[d->hlfn[i]];
+    if (strcmp(e->lname, dosname) == 0)
+      return e;
+  }
+  return NULL;
+}
@@ -0,0 +1,34 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+#ifndef MFS_DIRCACHE_H
+#define MFS_DIRCACHE_H
+
+#define DCE_8_3 1	/* the name is 8.3 as is, name83 is not mangled */
+
+struct dircache_ent {
+  char *d_name;		/* the UNIX name */
+  char *lname;		/* uppercased DOS name, NULL if not representable */
+  char name83[13];	/* uppercased 8.3 name, mangled if not DCE_8_3 */
+  char fname[8];	/* name83 split as in extract_filename() */
+  char fext[3];
+  unsigned char flags;
+};
+
+struct dircache {
+  int nr;
+  struct dircache_ent *ents;	/* in readdir order, "." and ".." first */
+};
+
+struct mfs_dir;
+
+struct dircache *dircache_get(const char *path, struct mfs_dir *dir);
+struct dircache_ent *dircache_find_83(struct dircache *dc,
+	const char *dosname, int maybe_mangled);
+struct dircache_ent *dircache_find_lfn(struct dircache *dc,
+	const char *dosname);
+
+#endif
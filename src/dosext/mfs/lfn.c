@@ -29,6 +29,8 @@
 #include "bios.h"
 #include "int.h"
 #include "lfn.h"
+#include "namecache.h"
+#include "prof.h"
 
 #define EOS '\0'
 #define BACKSLASH '\\'
@@ -143,11 +145,17 @@ static int make_unmake_dos_mangled_path(char *dest, const char *fpath,
 		d_printf("LFN: src=%s len=%zd\n", src, strlen(src));
 		if (!strcmp(src, "..") || !strcmp(src, ".")) {
 			strcpy(dest, src);
-		} else if (!vfat_search(dest, src, fpath2, alias)) {
-			if (!name_ufs_to_dos(dest, src) || alias) {
-				name_convert(dest, MANGLE);
-				strupperDOS(dest);
+		} else if (alias && namecache_find_sfn(fpath2, src, dest)) {
+			d_printf("LFN: cached short name %s\n", dest);
+		} else {
+			if (!vfat_search(dest, src, fpath2, alias)) {
+				if (!name_ufs_to_dos(dest, src) || alias) {
+					name_convert(dest, MANGLE);
+					strupperDOS(dest);
+				}
 			}
+			if (alias)
+				namecache_add(fpath2, src, dest);
 		}
 		dest += strlen(dest);
 		*dest = '\\';
@@ -1136,7 +1144,7 @@ static int mfs_lfn_(void)
 
 int mfs_lfn(void)
 {
-	int carry, ret;
+	int carry, ret, pz;
 
 	if (!mfs_enabled) {
 		CARRY;
@@ -1144,7 +1152,9 @@ int mfs_lfn(void)
 	}
 
 	carry = isset_CF();
+	pz = prof_enter(PROF_MFS);
 	ret = mfs_lfn_();
+	prof_leave(pz);
 	/* preserve carry if we forward the LFN request */
 	if (ret == 0 && carry)
 		CARRY;
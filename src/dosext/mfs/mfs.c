@@ -195,9 +195,14 @@ TODO:
 #include "lowmem.h"
 #include "redirect.h"
 #include "mangle.h"
+#include "dircache.h"
+#include "namecache.h"
 #include "utilities.h"
 #include "coopth.h"
 #include "lpt.h"
+#include "prof.h"
+#include "counters.h"
+#include "evlog.h"
 #endif
 
 #ifdef __linux__
@@ -929,6 +934,12 @@ void mfs_reset(void)
   umask(process_mask);
 }
 
+/* the redirector was set up, so there is host state DOS relies on */
+int mfs_in_use(void)
+{
+  return mfs_enabled;
+}
+
 int mfs_define_drive(const char *path)
 {
   int len;
@@ -1055,6 +1066,16 @@ static void init_drive(int dd, char *path, uint16_t user, uint16_t options)
 	  read_only(drives[dd]) ? "READ_ONLY" : "READ_WRITE"));
   if (cdrom(drives[dd]) && cdrom(drives[dd]) <= 4)
     register_cdrom(dd, cdrom(drives[dd]));
+  if (evlog_enabled) {
+    struct evlog_rec r;
+    char drv[2] = { 'A' + dd, '\0' };
+
+    evlog_begin(&r, 'd', "redirect");
+    evlog_str(&r, "drive", drv);
+    evlog_str(&r, "path", drives[dd].root);
+    evlog_int(&r, "rdonly", read_only(drives[dd]) ? 1 : 0);
+    evlog_end(&r);
+  }
 }
 
 /***************************
@@ -1067,12 +1088,15 @@ static void init_drive(int dd, char *path, uint16_t user, uint16_t options)
 int
 mfs_redirector(void)
 {
-  int ret;
+  int ret, pz;
 
 #ifdef __linux__
   vfat_ioctl = VFAT_IOCTL_READDIR_SHORT;
 #endif
+  count_event(CNT_MFS + LO(ax));
+  pz = prof_enter(PROF_MFS);
   ret = dos_fs_redirect(&REGS);
+  prof_leave(pz);
 #ifdef __linux__
   vfat_ioctl = VFAT_IOCTL_READDIR_BOTH;
 #endif
@@ -1249,31 +1273,44 @@ static void fill_entry(struct dir_ent *entry, const char *name, int drive)
   }
 }
 
+/* only "." and ".." may start with a dot, and not in the root */
+static int dot_name_ok(const char *name, int in_root)
+{
+  size_t namlen;
+
+  if (name[0] != '.')
+    return TRUE;
+  namlen = strlen(name);
+  if (namlen > 2)
+    return FALSE;
+  if (in_root)
+    return FALSE;
+  if ((namlen == 2) &&
+      (name[1] != '.'))
+    return FALSE;
+  return TRUE;
+}
+
 /* converts d_name to DOS 8:3 and compares with the wildcard */
-static int convert_compare(const char *d_name, char *fname, char *fext,
-				 char *mname, char *mext, int in_root)
+static int convert_compare(const char *dir, const char *d_name, char *fname,
+			   char *fext, char *mname, char *mext, int in_root)
 {
   char tmpname[NAME_MAX + 1];
-  size_t namlen;
   int maybe_mangled;
 
   maybe_mangled = (mname[5] == '~' || mname[5] == '?');
 
   name_ufs_to_dos(tmpname, d_name);
-  if (!name_convert(tmpname, maybe_mangled))
-    return FALSE;
-
-  namlen = strlen(tmpname);
-
-  if (tmpname[0] == '.') {
-    if (namlen > 2)
-      return FALSE;
-    if (in_root)
-      return FALSE;
-    if ((namlen == 2) &&
-	(tmpname[1] != '.'))
+  if (!name_convert(tmpname, 0)) {
+    if (!maybe_mangled)
       return FALSE;
+    /* a short name that was handed out before wins */
+    if (!namecache_find_sfn(dir, d_name, tmpname))
+      name_convert(tmpname, MANGLE);
   }
+
+  if (!dot_name_ok(tmpname, in_root))
+    return FALSE;
   strupperDOS(tmpname);
   extract_filename(tmpname, fname, fext);
   return compare(fname, fext, mname, mext);
@@ -1352,9 +1389,40 @@ static struct dir_list *get_dir_ff(char *name, char *mname, char *mext,
   }
   else {
     int is_root = (strlen(name) == drives[drive].root_len);
-    while ((cur_ent = dos_readdir(cur_dir))) {
+    struct dircache *dc = dircache_get(name, cur_dir);
+
+    if (dc) {
+      int maybe_mangled = (mname[5] == '~' || mname[5] == '?');
+      char sfn[13];
+      int i;
+
+      for (i = 0; i < dc->nr; i++) {
+	struct dircache_ent *de = &dc->ents[i];
+
+	if (!maybe_mangled && !(de->flags & DCE_8_3))
+	  continue;
+	if (!dot_name_ok(de->name83, is_root))
+	  continue;
+	if (de->flags & DCE_8_3 || !namecache_find_sfn(name, de->d_name, sfn)) {
+	  memcpy(fname, de->fname, 8);
+	  memcpy(fext, de->fext, 3);
+	} else {
+	  extract_filename(sfn, fname, fext);
+	}
+	if (!compare(fname, fext, mname, mext))
+	  continue;
+	if (dir_list == NULL)
+	  dir_list = make_dir_list(20);
+	entry = make_entry(dir_list);
+	strcpy(entry->d_name, de->d_name);
+	memcpy(entry->name, fname, 8);
+	memcpy(entry->ext, fext, 3);
+      }
+    }
+    else while ((cur_ent = dos_readdir(cur_dir))) {
       Debug0((dbg_fd, "get_dir(): `%s' \n", cur_ent->d_name));
-      if (!convert_compare(cur_ent->d_name, fname, fext, mname, mext, is_root))
+      if (!convert_compare(name, cur_ent->d_name, fname, fext, mname, mext,
+			   is_root))
 	continue;
       if (dir_list == NULL)
 	dir_list = make_dir_list(20);
@@ -1929,6 +1997,7 @@ scan_dir(const char *path, char *name, int root_len)
 {
   struct mfs_dir *cur_dir;
   struct mfs_dirent *cur_ent;
+  struct dircache *dc;
   int maybe_mangled, is_8_3;
   char dosname[strlen(name)+1];
 
@@ -1955,13 +2024,41 @@ scan_dir(const char *path, char *name, int root_len)
       (dosname[1] == '\0' || strcmp(dosname, "..") == 0))
     return (FALSE);
 
+  strupperDOS(dosname);
+
+  if (maybe_mangled) {
+    const char *cached = namecache_find_name(path, dosname);
+    if (cached) {
+      Debug0((dbg_fd, "scan_dir found %s in the name cache\n", cached));
+      strcpy(name, cached);
+      return (TRUE);
+    }
+  }
+
   /* open the directory */
   if ((cur_dir = dos_opendir(path)) == NULL) {
     Debug0((dbg_fd, "scan_dir(): failed to open dir: %s\n", path));
     return (FALSE);
   }
 
-  strupperDOS(dosname);
+  dc = dircache_get(path, cur_dir);
+  if (dc) {
+    struct dircache_ent *de;
+
+    dos_closedir(cur_dir);
+    if (is_8_3)
+      de = dircache_find_83(dc, dosname, maybe_mangled);
+    else
+      de = dircache_find_lfn(dc, dosname);
+    if (de) {
+      Debug0((dbg_fd, "scan_dir found %s\n", de->d_name));
+      if (maybe_mangled)
+	namecache_add(path, de->d_name, dosname);
+      strcpy(name, de->d_name);
+      return (TRUE);
+    }
+    goto not_found;
+  }
 
   /* now scan for matching names */
   while ((cur_ent = dos_readdir(cur_dir))) {
@@ -1992,6 +2089,8 @@ scan_dir(const char *path, char *name, int root_len)
     Debug0((dbg_fd, "scan_dir found %s\n",cur_ent->d_name));
 
     /* we've found the file, change it's name and return */
+    if (maybe_mangled)
+      namecache_add(path, cur_ent->d_name, dosname);
     strcpy(name, cur_ent->d_name);
     dos_closedir(cur_dir);
     return (TRUE);
@@ -1999,6 +2098,7 @@ scan_dir(const char *path, char *name, int root_len)
 
   dos_closedir(cur_dir);
 
+not_found:
   if (MANGLE && is_mangled(name))
     check_mangled_stack(name,NULL);
 
@@ -0,0 +1,331 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+/*
+ * Short name map for the redirector.
+ *
+ * Resolving a mangled name like PROGR~-I back to the host name needs
+ * a scan of its directory, and building the short form of a host path
+ * converts (and on VFAT looks up) every component again. The results
+ * are kept here per directory, most recently used first, bounded by
+ * $_mangle_cache entries.
+ *
+ * With $_mangle_cache_file the map is also appended to that file and
+ * read back at the next start, so that a short name that was handed
+ * out keeps resolving to the same file even if another name in the
+ * directory mangles to it as well. A hit is only used if the host file
+ * still exists, and FindFirst lists the same short names. Entries of
+ * files that are gone are dropped at the next start, and the file is
+ * rewritten from the map once it holds twice as many lines as the map.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <limits.h>
+#include <errno.h>
+#include <unistd.h>
+#include <sys/stat.h>
+
+#include "emu.h"
+#include "mfs.h"
+#include "namecache.h"
+
+struct nc_ent {
+  char *dir;
+  char *name;
+  char sfn[13];
+  struct nc_ent *lru_prev, *lru_next;
+  struct nc_ent *fwd_next, *rev_next;
+};
+
+static struct nc_ent **nc_fwd, **nc_rev;
+static unsigned nc_mask;
+static struct nc_ent *nc_head, *nc_tail;	/* most, least recently used */
+static int nc_count;
+static int nc_inited;
+static FILE *nc_file;
+static int nc_lines;		/* written to nc_file */
+
+static unsigned nc_hash(const char *dir, const char *name)
+{
+  unsigned h = 2166136261u;
+
+  while (*dir) {
+    h ^= (unsigned char)*dir++;
+    h *= 16777619u;
+  }
+  h ^= '/';
+  h *= 16777619u;
+  while (*name) {
+    h ^= (unsigned char)*name++;
+    h *= 16777619u;
+  }
+  return h;
+}
+
+static void nc_lru_unlink(struct nc_ent *e)
+{
+  if (e->lru_prev)
+    e->lru_prev->lru_next = e->lru_next;
+  else
+    nc_head = e->lru_next;
+  if (e->lru_next)
+    e->lru_next->lru_prev = e->lru_prev;
+  else
+    nc_tail = e->lru_prev;
+}
+
+static void nc_lru_push(struct nc_ent *e)
+{
+  e->lru_prev = NULL;
+  e->lru_next = nc_head;
+  if (nc_head)
+    nc_head->lru_prev = e;
+  else
+    nc_tail = e;
+  nc_head = e;
+}
+
+static void nc_touch(struct nc_ent *e)
+{
+  if (e != nc_head) {
+    nc_lru_unlink(e);
+    nc_lru_push(e);
+  }
+}
+
+static void nc_remove(struct nc_ent *e)
+{
+  struct nc_ent **p;
+
+  for (p = &nc_fwd[nc_hash(e->dir, e->name) & nc_mask]; *p != e;
+       p = &(*p)->fwd_next);
+  *p = e->fwd_next;
+  for (p = &nc_rev[nc_hash(e->dir, e->sfn) & nc_mask]; *p != e;
+       p = &(*p)->rev_next);
+  *p = e->rev_next;
+  nc_lru_unlink(e);
+  nc_count--;
+  free(e->dir);
+  free(e->name);
+  free(e);
+}
+
+static struct nc_ent *nc_lookup_fwd(const char *dir, const char *name)
+{
+  struct nc_ent *e;
+
+  for (e = nc_fwd[nc_hash(dir, name) & nc_mask]; e; e = e->fwd_next)
+    if (strcmp(e->name, name) == 0 && strcmp(e->dir, dir) == 0)
+      return e;
+  return NULL;
+}
+
+static struct nc_ent *nc_lookup_rev(const char *dir, const char *sfn)
+{
+  struct nc_ent *e;
+
+  for (e = nc_rev[nc_hash(dir, sfn) & nc_mask]; e; e = e->rev_next)
+    if (strcmp(e->sfn, sfn) == 0 && strcmp(e->dir, dir) == 0)
+      return e;
+  return NULL;
+}
+
+static int nc_storable(const char *s)
+{
+  return !strpbrk(s, "\t\n");
+}
+
+static void nc_write(const struct nc_ent *e)
+{
+  if (nc_storable(e->dir) && nc_storable(e->name)) {
+    fprintf(nc_file, "%s\t%s\t%s\n", e->dir, e->sfn, e->name);
+    nc_lines++;
+  }
+}
+
+/* replace the file contents with the map, oldest first */
+static void nc_rewrite(void)
+{
+  struct nc_ent *e;
+
+  fflush(nc_file);
+  rewind(nc_file);
+  if (ftruncate(fileno(nc_file), 0) == -1) {
+    error("MFS: can't truncate mangle cache: %s\n", strerror(errno));
+    fclose(nc_file);
+    nc_file = NULL;
+    return;
+  }
+  nc_lines = 0;
+  for (e = nc_tail; e; e = e->lru_prev)
+    nc_write(e);
+  fflush(nc_file);
+}
+
+static int nc_exists(const char *dir, const char *name)
+{
+  char path[PATH_MAX];
+  struct stat st;
+
+  return snprintf(path, sizeof(path), "%s/%s", dir, name) < sizeof(path) &&
+      lstat(path, &st) == 0;
+}
+
+/* returns the new entry, NULL if the mapping was known already */
+static struct nc_ent *nc_insert(const char *dir, const char *name,
+	const char *sfn)
+{
+  struct nc_ent *e;
+  unsigned h;
+
+  if (strlen(sfn) >= sizeof(e->sfn))
+    return NULL;
+  e = nc_lookup_fwd(dir, name);
+  if (e) {
+    if (strcmp(e->sfn, sfn) == 0) {
+      nc_touch(e);
+      return NULL;
+    }
+    nc_remove(e);
+  }
+  e = nc_lookup_rev(dir, sfn);
+  if (e)
+    nc_remove(e);
+  if (nc_count >= config.mangle_cache)
+    nc_remove(nc_tail);
+
+  e = malloc(sizeof(*e));
+  e->dir = strdup(dir);
+  e->name = strdup(name);
+  strcpy(e->sfn, sfn);
+  h = nc_hash(dir, name) & nc_mask;
+  e->fwd_next = nc_fwd[h];
+  nc_fwd[h] = e;
+  h = nc_hash(dir, sfn) & nc_mask;
+  e->rev_next = nc_rev[h];
+  nc_rev[h] = e;
+  nc_lru_push(e);
+  nc_count++;
+  return e;
+}
+
+/* read the map back, then rewrite the file without the entries that
+ * were replaced or dropped, or whose files are gone */
+static void nc_load(const char *fname)
+{
+  char *line = NULL;
+  size_t len = 0;
+  FILE *f;
+
+  f = fopen(fname, "r");
+  if (f) {
+    while (getline(&line, &len, f) != -1) {
+      char *sfn, *name;
+
+      line[strcspn(line, "\n")] = '\0';
+      sfn = strchr(line, '\t');
+      if (!sfn)
+	continue;
+      *sfn++ = '\0';
+      name = strchr(sfn, '\t');
+      if (!name)
+	continue;
+      *name++ = '\0';
+      if (nc_exists(line, name))
+	nc_insert(line, name, sfn);
+    }
+    free(line);
+    fclose(f);
+  }
+
+  nc_file = fopen(fname, "w");
+  if (!nc_file) {
+    error("MFS: can't write mangle cache %s: %s\n", fname, strerror(errno));
+    return;
+  }
+  nc_rewrite();
+}
+
+static int nc_init(void)
+{
+  if (!nc_inited) {
+    nc_inited = 1;
+    if (config.mangle_cache > 0) {
+      unsigned size;
+
+      for (size = 64; size < config.mangle_cache; size *= 2);
+      nc_mask = size - 1;
+      nc_fwd = calloc(size, sizeof(*nc_fwd));
+      nc_rev = calloc(size, sizeof(*nc_rev));
+      if (config.mangle_cache_file)
+	nc_load(config.mangle_cache_file);
+    }
+  }
+  return nc_fwd != NULL;
+}
+
+/* drops e if its host file no longer exists */
+static int nc_gone(struct nc_ent *e)
+{
+  if (nc_exists(e->dir, e->name))
+    return 0;
+  Debug0((dbg_fd, "namecache: %s/%s is gone\n", e->dir, e->name));
+  nc_remove(e);
+  return 1;
+}
+
+/* looks up the short name of the host file name in dir */
+int namecache_find_sfn(const char *dir, const char *name, char *sfn)
+{
+  struct nc_ent *e;
+
+  if (!nc_init())
+    return 0;
+  e = nc_lookup_fwd(dir, name);
+  if (!e || nc_gone(e))
+    return 0;
+  nc_touch(e);
+  strcpy(sfn, e->sfn);
+  return 1;
+}
+
+/*
+ * Looks up the host name for an uppercased short name in dir.
+ * The result is valid until the next call.
+ */
+const char *namecache_find_name(const char *dir, const char *sfn)
+{
+  struct nc_ent *e;
+
+  if (!nc_init())
+    return NULL;
+  e = nc_lookup_rev(dir, sfn);
+  if (!e || nc_gone(e))
+    return NULL;
+  nc_touch(e);
+  return e->name;
+}
+
+/* records that name in dir has the (uppercased) short name sfn */
+void namecache_add(const char *dir, const char *name, const char *sfn)
+{
+  struct nc_ent *e;
+
+  if (!nc_init())
+    return;
+  e = nc_insert(dir, name, sfn);
+  if (e && nc_file) {
+    /* evicted and replaced entries stay in the file until rewritten */
+    if (nc_lines >= 2 * config.mangle_cache) {
+      nc_rewrite();
+    } else {
+      nc_write(e);
+      fflush(nc_file);
+    }
+  }
+}
@@ -0,0 +1,14 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+#ifndef MFS_NAMECACHE_H
+#define MFS_NAMECACHE_H
+
+int namecache_find_sfn(const char *dir, const char *name, char *sfn);
+const char *namecache_find_name(const char *dir, const char *sfn);
+void namecache_add(const char *dir, const char *name, const char *sfn);
+
+#endif
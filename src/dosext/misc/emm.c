@@ -2345,3 +2345,9 @@ int emm_is_pframe_addr(dosaddr_t addr, uint32_t *size)
 
   return 0;
 }
+
+/* any handle other than the OS one, or the OS handle handed out */
+int emm_in_use(void)
+{
+  return handle_total > 1 || os_inuse;
+}
@@ -247,6 +247,19 @@ static void xx_printf(int prio, const char *fmt, ...)
   va_end(args);
 }
 
+/* the HMA, an EMB or a UMB is allocated */
+int xms_in_use(void)
+{
+  int i;
+
+  if (intdrv && (!freeHMA || handle_count))
+    return 1;
+  for (i = 0; i < umbs_used; i++)
+    if (smget_free_space(&umbs[i]) != umbs[i].size)
+      return 1;
+  return 0;
+}
+
 int xms_intdrv(void)
 {
   return intdrv;
@@ -0,0 +1,46 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+#ifndef COUNTERS_H
+#define COUNTERS_H
+
+#include <stdint.h>
+
+/* hot path counters, see counters.c */
+enum {
+  CNT_JIT_XLATE,		/* blocks translated */
+  CNT_JIT_HIT_FAST,		/* block found at its home slot of the index */
+  CNT_JIT_HIT,			/* block found after probing the index */
+  CNT_JIT_MISS,			/* block not found */
+  CNT_JIT_IC_LINK,		/* indirect jumps linked to a block */
+  CNT_JIT_CACHE_HIT,		/* sequence replayed from $_jit_cache */
+  CNT_JIT_CACHE_STALE,		/* cached sequence whose code changed */
+  CNT_TIER_SIM,			/* cold sequences run by the simulator */
+  CNT_TIER_UP,			/* sequences handed over to the JIT */
+  CNT_SMC_CODE,			/* writes to translated code */
+  CNT_SMC_DATA,			/* data writes to a protected code page */
+  CNT_SMC_PAGE,			/* whole code pages invalidated for a write */
+  CNT_SMC_WTHRU,		/* stores let through, two mprotect() each */
+  CNT_PORT_IN,			/* port reads dispatched to a handler */
+  CNT_PORT_OUT,			/* port writes dispatched to a handler */
+  CNT_COOPTH_SWITCH,		/* switches into a cooperative thread */
+  CNT_FAULT,			/* + trap number: faults handled */
+  CNT_KVM_EXIT = CNT_FAULT + 32,	/* + exit reason */
+  CNT_INT21 = CNT_KVM_EXIT + 64,	/* + AH */
+  CNT_MFS = CNT_INT21 + 256,	/* + redirector function (int2f AX=11xx) */
+  CNT_MAX = CNT_MFS + 256,
+};
+
+extern uint64_t *counters;
+
+static inline void count_event(int n)
+{
+  counters[n]++;
+}
+
+void counters_init(void);
+
+#endif
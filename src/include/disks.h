@@ -102,6 +102,8 @@ struct disk {
   char *dev_name;		/* disk file */
   int diskcyl4096;		/* INT13 support for 4096 cylinders */
   int wantrdonly;		/* user wants the disk to be read only */
+  char *overlay;		/* copy-on-write delta file, "" for a temporary one */
+  struct disk_cow *cow;		/* the open overlay */
   int rdonly;			/* The way we opened the disk (only filled in if the disk is open) */
   int boot;			/* This is a boot disk */
   int sectors, heads, tracks;	/* geometry */
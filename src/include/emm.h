@@ -29,6 +29,7 @@ void ems_init(void);
 void ems_reset(void);
 
 int emm_is_pframe_addr(dosaddr_t addr, uint32_t *size);
+int emm_in_use(void);
 #endif
 
 #endif
@@ -156,6 +156,8 @@ typedef struct config_info {
 #ifdef X86_EMULATOR
        int cpuemu;
        boolean cpusim;
+       boolean cputiered;	/* simulate cold code, JIT hot code */
+       char *jit_cache;		/* translations kept across runs */
 #endif
        int cpu_vm;
        int cpu_vm_dpmi;
@@ -282,6 +284,8 @@ typedef struct config_info {
 
        /* LFN support */
        boolean lfn;
+       int mangle_cache;	/* short name map entries, 0 = off */
+       char *mangle_cache_file;	/* file to keep the short name map in */
        int int_hooks;
        int force_revect;
        boolean force_redir;
@@ -340,10 +344,16 @@ typedef struct config_info {
        int mmio_tracing;
 
        int cli_timeout;		/* cli timeout hack */
+       char *snapshot_file;	/* machine snapshot to save to/boot from */
+       char *evlog_file;	/* structured event log, -J */
+       int log_ring;		/* debug messages kept in memory, 0 = off */
+       char *guest_profile;	/* guest profiler output file */
+       char *counters_file;	/* shared hot path counters */
 
         char *dos_cmd;
         char *unix_path;
         char *dos_path;
+        char *batch_file;
 
         char *unix_exec;
         char *lredir_paths;
@@ -0,0 +1,42 @@
+/*
+ * Structured event log: one JSON object per line, written by a
+ * separate thread so that callers only pay for formatting into memory.
+ *
+ * Usage:
+ *   if (evlog_enabled) {
+ *     struct evlog_rec r;
+ *     evlog_begin(&r, 'd', "systype");
+ *     evlog_str(&r, "name", name);
+ *     evlog_int(&r, "id", id);
+ *     evlog_end(&r);
+ *   }
+ *
+ * produces
+ *   {"t": 0.123456789, "sub": "d", "ev": "systype", "name": "...", "id": 1}
+ *
+ * "t" is CLOCK_MONOTONIC seconds since evlog_init(), "sub" is the debug
+ * class letter of the emitting subsystem.
+ */
+#ifndef EVLOG_H
+#define EVLOG_H
+
+#include <stdint.h>
+
+#define EVLOG_REC_MAX 1024
+
+struct evlog_rec {
+  char buf[EVLOG_REC_MAX];
+  int len;
+};
+
+extern int evlog_enabled;
+
+void evlog_init(void);
+void evlog_done(void);
+void evlog_begin(struct evlog_rec *r, char subsys, const char *event);
+void evlog_str(struct evlog_rec *r, const char *key, const char *val);
+void evlog_int(struct evlog_rec *r, const char *key, int64_t val);
+void evlog_hex(struct evlog_rec *r, const char *key, uint64_t val);
+void evlog_end(struct evlog_rec *r);
+
+#endif
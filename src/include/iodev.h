@@ -38,6 +38,15 @@ extern pit_latch_struct pit[PIT_TIMERS];
 extern void  pit_init(void);
 extern void  pit_reset(void);
 
+/* guest visible PIT state, for the machine snapshot.
+ * The counter start times are stored relative to "now". */
+struct pit_snapshot {
+  pit_latch_struct pit[PIT_TIMERS];
+  Bit8u port61;
+};
+extern void  pit_snapshot_save(struct pit_snapshot *s);
+extern void  pit_snapshot_restore(const struct pit_snapshot *s);
+
 /*******************************************************************
  * Real Time Clock (RTC) chip                                      *
  *******************************************************************/
@@ -0,0 +1,18 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+#ifndef LOGRING_H
+#define LOGRING_H
+
+#include <stdarg.h>
+
+extern int logring_size;
+
+void logring_init(int nrec);
+int logring_store(const char *fmt, va_list args);
+void logring_flush(int fd);
+
+#endif
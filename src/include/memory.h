@@ -169,6 +169,7 @@ void memcheck_e820_reserve(dosaddr_t addr_start, uint32_t size, int reserved);
 void memcheck_map_free(unsigned char map_char);
 void memcheck_init(void);
 int  memcheck_isfree(dosaddr_t addr_start, uint32_t size);
+unsigned char memcheck_get_type(dosaddr_t addr);
 int  memcheck_findhole(dosaddr_t *start_addr, uint32_t min_size,
     uint32_t max_size);
 int memcheck_is_reserved(dosaddr_t addr_start, uint32_t size,
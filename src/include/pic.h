@@ -106,4 +106,15 @@ int CAN_SLEEP(void);
 extern void pic_reset(void);
 extern void pic_init(void);
 
+/* guest visible PIC state, for the machine snapshot */
+struct pic_snapshot {
+  uint32_t irr, isr, pirr, pic1_isr;
+  uint32_t pic0_imr, pic1_imr, smm, iflag;
+  uint32_t irq2_ivec;
+  uint32_t ivec[16];
+  uint8_t isr_requested[2], icw_state[2], cmd[2];
+};
+void pic_snapshot_save(struct pic_snapshot *s);
+void pic_snapshot_restore(const struct pic_snapshot *s);
+
 #endif	/* PIC_H */
@@ -0,0 +1,36 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+#ifndef PROF_H
+#define PROF_H
+
+/* where the host time goes, see prof.c */
+enum {
+  PROF_EMU,		/* emulator main loop */
+  PROF_GUEST,		/* running guest code */
+  PROF_IDLE,		/* sleeping */
+  PROF_MFS,		/* redirector */
+  PROF_INT = 0x100,	/* PROF_INT + n: handler of int n */
+};
+
+extern volatile int prof_zone;
+
+static inline int prof_enter(int zone)
+{
+  int old = prof_zone;
+  prof_zone = zone;
+  return old;
+}
+
+static inline void prof_leave(int old)
+{
+  prof_zone = old;
+}
+
+void prof_init(void);
+void prof_signal(void);
+
+#endif
@@ -47,6 +47,7 @@ uint16_t RedirectDevice(char *dStr, char *sStr,
 int ResetRedirection(int);
 extern void mfs_set_stk_offs(int);
 extern int mfs_define_drive(const char *path);
+extern int mfs_in_use(void);
 /* temporary solution til QUALIFY_FILENAME works */
 int build_posix_path(char *dest, const char *src, int allowwildcards);
 #endif
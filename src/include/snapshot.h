@@ -0,0 +1,14 @@
+/*
+ * (C) Copyright 1992, ..., 2014 the "DOSEMU-Development-Team".
+ *
+ * for details see file COPYING in the DOSEMU distribution
+ */
+
+#ifndef SNAPSHOT_H
+#define SNAPSHOT_H
+
+int snapshot_request_save(const char **why);
+int snapshot_want_restore(void);
+void snapshot_run(void);
+
+#endif
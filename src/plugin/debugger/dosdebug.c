@@ -215,6 +215,8 @@ static COMMAND cmds[] = {
    "[sel]             dump ldt page or specific entry for selector 'sel'\n"},
   {"log", NULL,
    "[on | off | info | FLAGS ] get/set debug-log flags (e.g 'log +M-k')\n"},
+  {"log", NULL,
+   "flush             write out the debug messages kept by $_log_ring\n"},
   {"mcbs", NULL,
    "                  display MCBs by walking the chain\n"},
   {"devs", NULL,
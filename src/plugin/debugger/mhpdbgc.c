@@ -2526,6 +2526,12 @@ static void mhp_debuglog(int argc, char *argv[])
       return;
     }
 
+    if (!strcmp(argv[1], "flush")) {
+      flush_log();
+      mhp_printf("%s\n", "log flushed");
+      return;
+    }
+
     if (!strcmp(argv[1], "info")) {
       if (GetDebugInfoHelper(buf, sizeof(buf)))
         mhp_printf("%s", buf);
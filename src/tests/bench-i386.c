@@ -0,0 +1,209 @@
+/*
+ *  x86 CPU benchmark
+ *
+ *  This program is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This program is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+ *
+ *  Timed workloads for comparing the CPU backends, run by the test
+ *  suite under the same $_cpu_vm/$_cpu_vm_dpmi/$_cpu_emu matrix as
+ *  test-i386.exe. Each workload is repeated with a doubling count until
+ *  it runs for at least MIN_USECS, then one line is printed:
+ *
+ *    bench <name> <operations> <microseconds>
+ *
+ *  For the instruction loops an operation is one guest instruction
+ *  (one element for rep string ops), for the others one call. The
+ *  call and indirect loops measure how fast the CPU gets from one
+ *  block of code to the next through a near ret or jmp.
+ *  Under Linux only the instruction loops are run.
+ */
+#include <stdio.h>
+#include <string.h>
+#include <time.h>
+#ifdef __DJGPP__
+#include <dpmi.h>
+#include <go32.h>
+#include <sys/movedata.h>
+#endif
+
+#define MIN_USECS 250000
+
+static unsigned long long now_usecs(void)
+{
+#ifdef __DJGPP__
+    return (unsigned long long)uclock() * 1000000 / UCLOCKS_PER_SEC;
+#else
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (unsigned long long)ts.tv_sec * 1000000 + ts.tv_nsec / 1000;
+#endif
+}
+
+/* 4 instructions per iteration */
+static unsigned bench_int(unsigned n)
+{
+    unsigned a = 0, d = 0;
+    asm volatile("1:\n"
+                 "addl %%ecx, %%eax\n"
+                 "xorl %%ecx, %%edx\n"
+                 "subl $1, %%ecx\n"
+                 "jnz 1b\n"
+                 : "+c"(n), "+a"(a), "+d"(d) : : "cc");
+    return 4;
+}
+
+/* call, ret, subl, jnz - 4 instructions per iteration */
+static unsigned bench_call(unsigned n)
+{
+    asm volatile("jmp 2f\n"
+                 "1:\n"
+                 "ret\n"
+                 "2:\n"
+                 "call 1b\n"
+                 "subl $1, %%ecx\n"
+                 "jnz 2b\n"
+                 : "+c"(n) : : "cc", "memory");
+    return 4;
+}
+
+/* movl, jmp *, subl, jnz - 4 instructions per iteration */
+static unsigned bench_indirect(unsigned n)
+{
+    unsigned t;
+    asm volatile("1:\n"
+                 "movl $2f, %1\n"
+                 "jmp *%1\n"
+                 "2:\n"
+                 "subl $1, %0\n"
+                 "jnz 1b\n"
+                 : "+c"(n), "=&r"(t) : : "cc");
+    return 4;
+}
+
+static char strbuf[2][4096];
+
+/* one element per rep iteration, movs and stos each move 1024 dwords */
+static unsigned bench_string(unsigned n)
+{
+    unsigned i;
+    for (i = 0; i < n; i++) {
+        int c;
+        void *s, *d;
+        asm volatile("cld\n"
+                     "rep movsl\n"
+                     : "=c"(c), "=S"(s), "=D"(d)
+                     : "0"(1024), "1"(strbuf[0]), "2"(strbuf[1])
+                     : "memory");
+        asm volatile("rep stosl\n"
+                     : "=c"(c), "=D"(d)
+                     : "0"(1024), "1"(strbuf[0]), "a"(i)
+                     : "memory");
+    }
+    return 2048;
+}
+
+/* 5 instructions per iteration */
+static unsigned bench_fpu(unsigned n)
+{
+    asm volatile("fld1\n"
+                 "fldz\n"
+                 "1:\n"
+                 "fadd %%st(1), %%st\n"
+                 "fsqrt\n"
+                 "fmul %%st(1), %%st\n"
+                 "subl $1, %%ecx\n"
+                 "jnz 1b\n"
+                 "fstp %%st(0)\n"
+                 "fstp %%st(0)\n"
+                 : "+c"(n) : : "cc", "st", "st(1)");
+    return 5;
+}
+
+#ifdef __DJGPP__
+/* a real mode int 21h call: two mode switches plus the DOS call */
+static unsigned bench_modeswitch(unsigned n)
+{
+    __dpmi_regs r;
+    unsigned i;
+    for (i = 0; i < n; i++) {
+        memset(&r, 0, sizeof(r));
+        r.h.ah = 0x30;  /* get DOS version */
+        __dpmi_int(0x21, &r);
+    }
+    return 1;
+}
+
+static unsigned bench_dpmi(unsigned n)
+{
+    unsigned long base;
+    unsigned i;
+    for (i = 0; i < n; i++)
+        __dpmi_get_segment_base_address(_my_ds(), &base);
+    return 1;
+}
+
+static int rm_seg;
+
+/* add eax, ecx; dec ecx; jnz; retf - 3 instructions per iteration */
+static const unsigned char rm_loop[] = {
+    0x66, 0x01, 0xc8, 0x66, 0x49, 0x75, 0xf9, 0xcb
+};
+
+static unsigned bench_vm86(unsigned n)
+{
+    __dpmi_regs r;
+    memset(&r, 0, sizeof(r));
+    r.d.ecx = n;
+    r.x.cs = rm_seg;
+    r.x.ip = 0;
+    __dpmi_simulate_real_mode_procedure_retf(&r);
+    return 3;
+}
+#endif
+
+static void run(const char *name, unsigned (*fn)(unsigned), unsigned n)
+{
+    unsigned long long start, usecs;
+    unsigned per;
+
+    for (;;) {
+        start = now_usecs();
+        per = fn(n);
+        usecs = now_usecs() - start;
+        if (usecs >= MIN_USECS || n >= 0x40000000)
+            break;
+        n *= 2;
+    }
+    printf("bench %s %llu %llu\n", name, (unsigned long long)n * per, usecs);
+    fflush(stdout);
+}
+
+int main(int argc, char **argv)
+{
+    run("int", bench_int, 1024);
+    run("call", bench_call, 1024);
+    run("indirect", bench_indirect, 1024);
+    run("string", bench_string, 4);
+    run("fpu", bench_fpu, 1024);
+#ifdef __DJGPP__
+    {
+        int sel;
+        rm_seg = __dpmi_allocate_dos_memory(1, &sel);
+        if (rm_seg != -1) {
+            dosmemput(rm_loop, sizeof(rm_loop), rm_seg * 16);
+            run("vm86", bench_vm86, 1024);
+            __dpmi_free_dos_memory(sel);
+        }
+    }
+    run("modeswitch", bench_modeswitch, 16);
+    run("dpmi", bench_dpmi, 16);
+#endif
+    return 0;
+}
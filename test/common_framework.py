@@ -1,66 +1,412 @@
+import asyncio
+import atexit
+import json
 import pexpect
 import string
 import random
 import re
 import unittest
 
+from contextlib import contextmanager
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
 from datetime import datetime
+from fcntl import ioctl
 from hashlib import sha1
-from os import environ, getcwd, makedirs, mkdir, rename, unlink
-from os.path import exists, join
+from io import StringIO
+from multiprocessing import get_context
+from os import (environ, getcwd, getpid, chdir, link, listdir, makedirs,
+                mkdir, rename, stat, symlink, sysconf, unlink, wait4,
+                waitstatus_to_exitcode, walk, WNOHANG)
+from os.path import (abspath, dirname, exists, getmtime, getsize, join,
+                     relpath, splitext)
+from pexpect.expect import Expecter, searcher_re
 from ptyprocess import PtyProcessError
-from shutil import copy, copytree, rmtree
-from subprocess import Popen, check_call, check_output, STDOUT, TimeoutExpired
+from shutil import copy, copyfile, copystat, copytree, rmtree
+from subprocess import (CalledProcessError, Popen, check_call, check_output,
+                        STDOUT)
 from sys import exit, version_info
 from tarfile import open as topen
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
 from unittest.util import strclass
 
+from fatimage import host_files, write_image
+
 BINSDIR = "test-binaries"
 WORKDIR = "test-imagedir/dXXXXs/c"
 PASS = 0
 SKIP = 1
 KNOWNFAIL = 2
 UNSUPPORTED = 3
+KNOWNFAILREASON = "known failure"
 
 IPROMPT = "Interactive Prompt!"
 
+# Printed in place of the boot output when a snapshot was restored
+SNAPRESTORED = "Restored from snapshot"
+
+# The IPROMPT line is the last thing autoexec.bat prints, so the command is
+# typed ahead as soon as it is seen. The shell prompt that follows, if echo
+# is on, is removed from the start of the output afterwards
+SHELLPROMPT = re.compile(r'^[\r\n]*[A-Z]:[^>\r\n]*>')
+
+# Verified boot trees, keyed on their contents, shared between test runs
+TESTCACHEDIR = "test-cache"
+BOOTTREEDIRS = [
+    ("2.0-pre8/commands", "dosemu"),
+    ("src/bindist/bat", "bat"),
+]
+FICLONE = 0x40049409
+
+# Warm boot pool: with TEST_POOL set, runDosemu() keeps the emulator running
+# after a test and reuses it for the next test with the same configuration.
+# The guest is rebooted between tests, so the drives are rescanned and
+# autoexec.bat runs again, but the host process startup is not repeated
+POOLREBOOT = "poolboot"
+POOLREBOOTSRC = r"""
+.text
+.code16
+
+    .globl  _start16
+_start16:
+    ljmp    $0xffff, $0
+"""
+
+# Parallel runner: each worker process runs from its own root directory
+# below PARALLELDIR, which has links back to the shared source tree so
+# that the relative paths used throughout the tests stay valid
+PARALLELDIR = "test-parallel"
+PARALLELLINKS = ["2.0-pre8", "bin", "etc", "src", "test", BINSDIR,
+                 TESTCACHEDIR]
+# reference files that the first test to need them writes: always linked,
+# so that one written by a worker lands in the top directory
+PARALLELFILES = ["test-i386.log", "test-bench.json"]
+
+
+# Per-test report: with TEST_REPORT set to a file name, one JSON line per
+# test is appended with its phase timings and, for each dosemu session it
+# ran, the peak RSS, CPU time and log size
+_report_file = None
+_report = None
+
+
+@contextmanager
+def reportphase(name):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        if _report is not None:
+            phases = _report["phases"]
+            phases[name] = phases.get(name, 0.0) + perf_counter() - start
+
+
+def _proc_tree(pid):
+    """Return pid and the pids of all its descendants"""
+    children = {}
+    for entry in listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % entry) as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+
+    pids = []
+    todo = [pid]
+    while todo:
+        p = todo.pop()
+        pids.append(p)
+        todo.extend(children.get(p, []))
+    return pids
+
+
+def _proc_usage(pid):
+    """Return (peak RSS in kB, CPU seconds) of pid and its descendants"""
+    rss, ticks = 0, 0
+    for p in _proc_tree(pid):
+        try:
+            with open("/proc/%d/stat" % p) as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            ticks += int(fields[11]) + int(fields[12])
+            with open("/proc/%d/status" % p) as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        rss = max(rss, int(line.split()[1]))
+        except (OSError, IndexError, ValueError):
+            continue
+    return rss, ticks / sysconf("SC_CLK_TCK")
+
+
+def _proc_reset_hwm(pid):
+    """Restart the peak RSS of pid and its descendants from the current RSS"""
+    for p in _proc_tree(pid):
+        try:
+            with open("/proc/%d/clear_refs" % p, "w") as f:
+                f.write("5")
+        except OSError:
+            continue
+
+
+def reportsession(logname, rss, cpu, phases=None):
+    if _report is None:
+        return
+    try:
+        logbytes = getsize(logname)
+    except OSError:
+        logbytes = None
+    session = {"peak_rss_kb": rss, "cpu_s": cpu, "log_bytes": logbytes}
+    if phases is not None:
+        session["phases"] = phases
+    _report["sessions"].append(session)
+
+
+def reportvalue(name, value):
+    if _report is not None:
+        _report[name] = value
+
+
+def _unshare(path):
+    # A file hardlinked from the boot tree cache gets its own copy first
+    try:
+        if stat(path).st_nlink == 1:
+            return
+    except FileNotFoundError:
+        return
+    tmp = "%s.%d" % (path, getpid())
+    copyfile(path, tmp)
+    copystat(path, tmp)
+    rename(tmp, path)
+
 
 def mkfile(fname, content, dname=WORKDIR, writemode="w", newline=None):
+    _unshare(join(dname, fname))
     with open(join(dname, fname), writemode, newline=newline) as f:
         f.write(content)
 
 
-def mkexe(fname, content, dname=WORKDIR):
-    basename = join(dname, fname)
-    with open(basename + ".c", "w") as f:
-        f.write(content)
-    check_call(["i586-pc-msdosdjgpp-gcc",
-                "-o", basename + ".exe", basename + ".c"])
+MKEXE_CFLAGS = []
+MKCOM_LDFLAGS = ["-static",
+                 "-Wl,--section-start=.text=0x100,-e,_start16", "-nostdlib"]
+MKCOM_OBJCOPYFLAGS = ["-j", ".text", "-O", "binary"]
 
 
-def mkcom(fname, content, dname=WORKDIR):
-    basename = join(dname, fname)
-    with open(basename + ".S", "w") as f:
-        f.write(content)
+def _buildexe(basename):
+    check_call(["i586-pc-msdosdjgpp-gcc"] + MKEXE_CFLAGS +
+               ["-o", basename + ".exe", basename + ".c"])
+
+
+def _buildcom(basename):
     check_call(["as", "-o", basename + ".o", basename + ".S"])
-    check_call(["gcc",
-                "-static",
-                "-Wl,--section-start=.text=0x100,-e,_start16", "-nostdlib",
-                "-o", basename + ".com.elf",
+    check_call(["gcc"] + MKCOM_LDFLAGS +
+               ["-o", basename + ".com.elf",
                 basename + ".o"])
-    check_call(["objcopy",
-                "-j", ".text", "-O", "binary",
-                basename + ".com.elf",
+    check_call(["objcopy"] + MKCOM_OBJCOPYFLAGS +
+               [basename + ".com.elf",
                 basename + ".com"])
     check_call(["rm", basename + ".o", basename + ".com.elf"])
 
 
+# source suffix: (output suffix, toolchain, flags, builder)
+BUILDERS = {
+    ".c": (".exe", ["i586-pc-msdosdjgpp-gcc"], [MKEXE_CFLAGS], _buildexe),
+    ".S": (".com", ["as", "gcc", "objcopy"],
+           [MKCOM_LDFLAGS, MKCOM_OBJCOPYFLAGS], _buildcom),
+}
+
+_toolchain_ids = {}
+
+
+def _buildkey(srcsuffix, content):
+    _, tools, flags, _ = BUILDERS[srcsuffix]
+    if srcsuffix not in _toolchain_ids:
+        h = sha1(repr(flags).encode())
+        for tool in tools:
+            h.update(check_output([tool, "--version"]))
+        _toolchain_ids[srcsuffix] = h.hexdigest()
+    return sha1((_toolchain_ids[srcsuffix] + srcsuffix +
+                 content).encode()).hexdigest()
+
+
+def _buildcached(basename, srcsuffix, content):
+    with open(basename + srcsuffix, "w") as f:
+        f.write(content)
+
+    suffix, _, _, builder = BUILDERS[srcsuffix]
+    cachedir = join(TESTCACHEDIR, "build")
+    cached = join(cachedir, _buildkey(srcsuffix, content) + suffix)
+    if exists(cached):
+        clonefile(cached, basename + suffix)
+        return
+
+    builder(basename)
+
+    makedirs(join(cachedir, "src"), exist_ok=True)
+    tmp = "%s.%d" % (cached, getpid())
+    copyfile(basename + suffix, tmp)
+    rename(tmp, cached)
+
+    # Keep the source so that mkprebuild() can redo it for a new toolchain
+    source = join(cachedir, "src",
+                  sha1(content.encode()).hexdigest() + srcsuffix)
+    if not exists(source):
+        copyfile(basename + srcsuffix, source)
+
+
+def mkexe(fname, content, dname=WORKDIR):
+    with reportphase("compile"):
+        _buildcached(join(dname, fname), ".c", content)
+
+
+def mkcom(fname, content, dname=WORKDIR):
+    with reportphase("compile"):
+        _buildcached(join(dname, fname), ".S", content)
+
+
+def mkprebuild(jobs):
+    """Rebuild every test program seen before that is not in the cache
+
+    Run before the tests, this pays for a toolchain or flag change once and
+    in parallel, rather than in each test.
+    """
+    srcdir = join(TESTCACHEDIR, "build", "src")
+    if not exists(srcdir):
+        return
+
+    def build(source):
+        srcsuffix = splitext(source)[1]
+        if srcsuffix not in BUILDERS:
+            return
+        with open(join(srcdir, source)) as f:
+            content = f.read()
+        try:
+            _buildkey(srcsuffix, content)
+        except (OSError, CalledProcessError):
+            return      # toolchain not installed
+        with TemporaryDirectory(dir=TESTCACHEDIR) as tmpdir:
+            try:
+                _buildcached(join(tmpdir, "prebuild"), srcsuffix, content)
+            except CalledProcessError:
+                pass    # the test itself reports this
+
+    # Compute the toolchain ids here, not racing in the threads
+    for srcsuffix in BUILDERS:
+        try:
+            _buildkey(srcsuffix, "")
+        except (OSError, CalledProcessError):
+            pass
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(build, sorted(listdir(srcdir))))
+
+
+async def expect_async(child, pattern, timeout=-1):
+    """Await pattern on a pexpect child from a running asyncio event loop
+
+    The result, child.before and child.after are as for child.expect().
+    This stands in for pexpect's own async_=True, which does not work
+    with the pexpect releases current Pythons ship alongside.
+    """
+    if timeout == -1:
+        timeout = child.timeout
+    exp = Expecter(child, searcher_re(child.compile_pattern_list(pattern)))
+    idx = exp.existing_data()
+    if idx is not None:
+        return idx
+
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    loop.add_reader(child.child_fd, ready.set)
+    end = None if timeout is None else loop.time() + timeout
+    try:
+        while True:
+            ready.clear()
+            try:
+                await asyncio.wait_for(
+                    ready.wait(),
+                    None if end is None else max(end - loop.time(), 0))
+            except asyncio.TimeoutError as e:
+                return exp.timeout(e)
+            try:
+                data = child.read_nonblocking(child.maxread, timeout=0)
+            except pexpect.TIMEOUT:
+                continue
+            except pexpect.EOF as e:
+                return exp.eof(e)
+            idx = exp.new_data(data)
+            if idx is not None:
+                return idx
+    finally:
+        loop.remove_reader(child.child_fd)
+
+
 def mkstring(length):
     return ''.join(random.choice(string.hexdigits) for x in range(length))
 
 
+def _reflink(src, dst):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except OSError:
+            return False
+
+
+def clonefile(src, dst):
+    # Share the data blocks with src if the filesystem supports reflinks
+    if not _reflink(src, dst):
+        copyfile(src, dst)
+    copystat(src, dst)
+    return dst
+
+
+def linkfile(src, dst):
+    """Like clonefile(), but hardlinks src where reflinks are not supported
+
+    Only for files that DOS just reads, as a write through the link would
+    change src as well. mkfile() unshares a file before writing to it.
+    """
+    if _reflink(src, dst):
+        copystat(src, dst)
+        return dst
+    unlink(dst)
+    try:
+        link(src, dst)
+    except OSError:
+        # a different filesystem
+        copyfile(src, dst)
+        copystat(src, dst)
+    return dst
+
+
+_boottree_keys = {}
+
+# signature: (child, session logname)
+_dosemu_pool = {}
+_dosemu_pool_count = 0
+
+
+def _close_dosemu_pool():
+    for child, _ in _dosemu_pool.values():
+        try:
+            child.close(force=True)
+        except PtyProcessError:
+            pass
+    _dosemu_pool.clear()
+
+
+atexit.register(_close_dosemu_pool)
+
+
 class BaseTestCase(object):
 
+    # runDosemu() restores from and saves snapshots by default
+    snapshot = False
+
     @classmethod
     def setUpClass(cls):
         imagedir = WORKDIR.split('/')[0]
@@ -103,34 +449,32 @@ class BaseTestCase(object):
         pass
 
     def setUp(self):
-        if self.actions.get(self._testMethodName) == SKIP:
-            self.skipTest("")
-        elif self.actions.get(self._testMethodName) == KNOWNFAIL:
-            self.skipTest("known failure")
-        elif self.actions.get(self._testMethodName) == UNSUPPORTED:
-            self.skipTest("unsupported")
-
-        rmtree(self.imagedir, ignore_errors=True)
-        makedirs(WORKDIR)
+        with reportphase("setup"):
+            if self.actions.get(self._testMethodName) == SKIP:
+                self.skipTest("")
+            elif self.actions.get(self._testMethodName) == KNOWNFAIL:
+                self.skipTest(KNOWNFAILREASON)
+            elif self.actions.get(self._testMethodName) == UNSUPPORTED:
+                self.skipTest("unsupported")
 
-        # Extract the boot files
-        if self.tarfile != "":
-            self.unTarOrSkip(self.tarfile, self.files)
+            rmtree(self.imagedir, ignore_errors=True)
+            makedirs(WORKDIR)
 
-        # Empty dosemu.conf for default values
-        mkfile("dosemu.conf", """$_force_fs_redirect = (off)\n""", self.imagedir)
+            # Populate the boot files and std dosemu commands from the
+            # cache. DOS only reads them, so they may be hardlinks.
+            copytree(self.getBootTreeOrSkip(), WORKDIR, symlinks=True,
+                     copy_function=linkfile, dirs_exist_ok=True)
 
-        # Copy std dosemu commands
-        copytree("2.0-pre8/commands", join(WORKDIR, "dosemu"), symlinks=True)
-        copytree("src/bindist/bat", join(WORKDIR, "bat"))
+            # Empty dosemu.conf for default values
+            mkfile("dosemu.conf", """$_force_fs_redirect = (off)\n""", self.imagedir)
 
-        # Create startup files
-        self.setUpDosAutoexec()
-        self.setUpDosConfig()
-        self.setUpDosVersion()
+            # Create startup files
+            self.setUpDosAutoexec()
+            self.setUpDosConfig()
+            self.setUpDosVersion()
 
-        # Tag the end of autoexec.bat for runDosemu()
-        mkfile(self.autoexec, "\r\n@echo " + IPROMPT + "\r\n", writemode="a")
+            # Tag the end of autoexec.bat for runDosemu()
+            mkfile(self.autoexec, "\r\n@echo " + IPROMPT + "\r\n", writemode="a")
 
     def setUpDosAutoexec(self):
         # Use the standard shipped autoexec
@@ -145,7 +489,7 @@ class BaseTestCase(object):
         mkfile("version.bat", "ver /r\r\nrem end\r\n")
 
     def tearDown(self):
-        pass
+        self.teardownstart = perf_counter()
 
     def shortDescription(self):
         doc = super(BaseTestCase, self).shortDescription()
@@ -153,15 +497,70 @@ class BaseTestCase(object):
 
 # helpers
 
-    def unTarOrSkip(self, tname, files):
+    def getBootTreeKey(self):
+        k = (self.tarfile, tuple(self.files))
+        if k in _boottree_keys:
+            return _boottree_keys[k]
+
+        h = sha1(self.tarfile.encode())
+        if self.tarfile != "":
+            try:
+                st = stat(join(BINSDIR, self.tarfile))
+            except OSError:
+                self.skipTest("Archive not found or unreadable(%s)" %
+                              join(BINSDIR, self.tarfile))
+            h.update(("%d %d" % (st.st_size, st.st_mtime_ns)).encode())
+        for f in self.files:
+            h.update(("%s %s" % f).encode())
+        if environ.get("TEST_POOL"):
+            h.update(POOLREBOOTSRC.encode())
+        for src, _ in BOOTTREEDIRS:
+            for root, dirs, files in walk(src):
+                dirs.sort()
+                for name in sorted(files):
+                    fname = join(root, name)
+                    st = stat(fname)
+                    h.update(("%s %d %d" % (relpath(fname, src), st.st_size,
+                                            st.st_mtime_ns)).encode())
+
+        _boottree_keys[k] = h.hexdigest()
+        return _boottree_keys[k]
+
+    def getBootTreeOrSkip(self):
+        tree = join(TESTCACHEDIR, "boot", self.getBootTreeKey())
+        if exists(tree):
+            return tree
+
+        # Build privately, then publish atomically for concurrent runners
+        tmp = "%s.%d" % (tree, getpid())
+        rmtree(tmp, ignore_errors=True)
+        makedirs(tmp)
+        try:
+            if self.tarfile != "":
+                self.unTarOrSkip(self.tarfile, self.files, dname=tmp)
+            for src, dst in BOOTTREEDIRS:
+                copytree(src, join(tmp, dst), symlinks=True)
+            if environ.get("TEST_POOL"):
+                mkcom(POOLREBOOT, POOLREBOOTSRC, dname=join(tmp, "dosemu"))
+                unlink(join(tmp, "dosemu", POOLREBOOT + ".S"))
+            try:
+                rename(tmp, tree)
+            except OSError:
+                pass    # Another worker published it first
+        finally:
+            rmtree(tmp, ignore_errors=True)
+
+        return tree
+
+    def unTarOrSkip(self, tname, files, dname=WORKDIR):
         tfile = join(BINSDIR, tname)
 
         try:
             with topen(tfile) as tar:
                 for f in files:
                     try:
-                        tar.extract(f[0], path=WORKDIR)
-                        with open(join(WORKDIR, f[0]), "rb") as g:
+                        tar.extract(f[0], path=dname)
+                        with open(join(dname, f[0]), "rb") as g:
                             s1 = sha1(g.read()).hexdigest()
                             self.assertEqual(
                                 f[1],
@@ -193,54 +592,114 @@ class BaseTestCase(object):
 
     def mkimage(self, fat, files, bootblk=True, cwd=None):
         if fat == "12":
-            tnum = "306"
-            hnum = "4"
+            tnum = 306
+            hnum = 4
             regx = "3.."
         elif fat == "16":
-            tnum = "615"
-            hnum = "4"
+            tnum = 615
+            hnum = 4
             regx = "6.."
         else:       # 16B
-            tnum = "900"
-            hnum = "15"
+            tnum = 900
+            hnum = 15
             regx = "[89].."
 
+        if cwd is None:
+            cwd = self.imagedir + "/dXXXXs/c/"
+
         if bootblk:
             blkname = "boot-%s-%s-17.blk" % (regx, hnum)
             self.unTarBootBlockOrSkip(blkname, True)
-            blkarg = ["-b", "boot.blk"]
+            with open(join(cwd, "boot.blk"), "rb") as f:
+                bootsect = f.read()
         else:
-            blkarg = []
-
-        xfiles = [x[0] for x in files]
+            bootsect = None
 
         name = "fat%s.img" % fat
 
-        if cwd is None:
-            cwd = self.imagedir + "/dXXXXs/c/"
-
-        # mkfatimage [-b bsectfile] [{-t tracks | -k Kbytes}]
-        #            [-l volume-label] [-f outfile] [-p ] [file...]
-        result = Popen(
-            ["../../../bin/mkfatimage16",
-                "-t", tnum,
-                "-h", hnum,
-                "-f", "../../" + name,
-                "-p"
-            ] + blkarg + xfiles,
-            cwd=cwd
-        )
-        result.wait()
+        write_image(join(self.imagedir, name),
+                    host_files(cwd, [x[0] for x in files]),
+                    cylinders=tnum, heads=hnum, sectors=17, bootsect=bootsect)
 
         return name
 
+    def getSnapshotName(self):
+        """Cache file for the snapshot of a session with this config
+
+        dosemu itself ignores a snapshot that doesn't match its memory
+        setup or disk contents, so this only has to tell apart configs.
+        The DOS startup files are part of the config, as they decide
+        whether a snapshot can be taken at all.
+        """
+        with open(join(self.imagedir, "dosemu.conf")) as f:
+            conf = "".join(l for l in f if not l.startswith("$_snapshot"))
+        for name in (self.confsys, self.autoexec):
+            try:
+                with open(join(WORKDIR, name), errors="replace") as f:
+                    conf += f.read()
+            except OSError:
+                pass
+        h = sha1((self.getBootTreeKey() + conf).encode()).hexdigest()
+        return abspath(join(TESTCACHEDIR, "snapshot", h + ".snap"))
+
+    def setUpSnapshot(self):
+        """Configures the snapshot file, returns its name"""
+        snapname = self.getSnapshotName()
+        makedirs(dirname(snapname), exist_ok=True)
+        line = '$_snapshot = "%s"\n' % snapname
+        with open(join(self.imagedir, "dosemu.conf")) as f:
+            if line not in f.read():
+                mkfile("dosemu.conf", line, dname=self.imagedir,
+                       writemode="a")
+        return snapname
+
+    def saveSnapshot(self, child, snapname, timeout=10):
+        """Saves the booted session for the next runDosemu(snapshot=True)
+
+        Returns False if dosemu refused, as the session has host-side
+        state that a snapshot doesn't keep. That is remembered, so that
+        later sessions with the same config don't try again.
+        """
+        try:
+            mtime = getmtime(snapname)
+        except OSError:
+            mtime = None
+        child.send("emusnap\r\n")
+        saved = child.expect(["emusnap: saving snapshot",
+                              "emusnap: can't save a snapshot now"]) == 0
+        # keep the command's output out of the results
+        child.expect([r'[\r\n]+[A-Z]:[^>\r\n]*>'])
+        if not saved:
+            mkfile(snapname + ".refused", "", dname=".")
+            return False
+        # written from the main loop once the command has returned
+        deadline = perf_counter() + timeout
+        while perf_counter() < deadline:
+            try:
+                if getmtime(snapname) != mtime:
+                    return True
+            except OSError:
+                pass
+            child.expect([pexpect.TIMEOUT], timeout=0.1)
+        raise pexpect.TIMEOUT("snapshot not written")
+
     def runDosemu(self, cmd, opts=None, outfile=None, config=None, timeout=5,
-                    interactions=[]):
+                    interactions=[], snapshot=None):
+        """Runs cmd in a freshly booted DOS
+
+        With snapshot set, DOS is restored from the snapshot of an earlier
+        session with the same config and disk contents if there is one.
+        Otherwise it is booted as usual and a snapshot is saved before cmd
+        runs, unless dosemu refused that for this config before. It
+        defaults to the snapshot attribute of the test case, unless
+        sessions are pooled.
+        """
         # Note: if debugging is turned on then times increase 10x
         dbin = "bin/dosemu"
         args = ["-f", join(self.imagedir, "dosemu.conf"),
                 "-n",
                 "-o", self.logname,
+                "-J", self.evname,
                 "-td",
                 #    "-Da",
                 "--Fimagedir", self.imagedir]
@@ -249,25 +708,53 @@ class BaseTestCase(object):
 
         if config is not None:
             mkfile("dosemu.conf", config, dname=self.imagedir, writemode="a")
+        if snapshot is None:
+            snapshot = self.snapshot and not environ.get("TEST_POOL")
+        if snapshot and exists(self.getSnapshotName() + ".refused"):
+            snapshot = False
+        if snapshot:
+            snapname = self.setUpSnapshot()
+
+        pooled = environ.get("TEST_POOL") and not snapshot
+        if pooled:
+            key = self.getPooledDosemuKey(args)
+            child, logname, logpos, warm = self.getPooledDosemu(key, dbin,
+                                                                args)
+        else:
+            child = pexpect.spawn(dbin, args)
+        # A warm pooled child has already used some CPU time, and its
+        # peak RSS would be that of its whole lifetime
+        cpu0 = 0
+        if _report is not None:
+            if pooled and warm:
+                _proc_reset_hwm(child.pid)
+            cpu0 = _proc_usage(child.pid)[1]
 
-        child = pexpect.spawn(dbin, args)
         ret = ''
         with open(self.xptname, "wb") as fout:
             child.logfile = fout
             child.setecho(False)
             try:
-                prompt = r'(system -e|unix -e|' + IPROMPT + ')'
-                child.expect([prompt + '[\r\n]*'], timeout=10)
-                child.expect(['>[\r\n]*', pexpect.TIMEOUT], timeout=1)
-                child.send(cmd + '\r\n')
-                for resp in interactions:
-                    child.expect(resp[0])
-                    child.send(resp[1])
-                    if outfile is None:
-                        ret += child.before.decode('ASCII', 'replace')
-                child.expect(['rem end'], timeout=timeout)
+                with reportphase("boot"):
+                    if pooled and warm:
+                        child.send("c:\\dosemu\\%s\r\n" % POOLREBOOT)
+                    prompt = r'(system -e|unix -e|' + IPROMPT + ')'
+                    booted = child.expect([prompt + '[\r\n]*',
+                                           SNAPRESTORED + '[\r\n]*'],
+                                          timeout=10) == 0
+                    if snapshot and booted:
+                        self.saveSnapshot(child, snapname)
+                with reportphase("run"):
+                    child.send(cmd + '\r\n')
+                    for resp in interactions:
+                        child.expect(resp[0])
+                        child.send(resp[1])
+                        if outfile is None:
+                            ret += child.before.decode('ASCII', 'replace')
+                    child.expect(['rem end'], timeout=timeout)
                 if outfile is None:
                     ret += child.before.decode('ASCII', 'replace')
+                    ret = SHELLPROMPT.sub('', ret, count=1)
                 else:
                     with open(join(WORKDIR, outfile), "r") as f:
                         ret = f.read()
@@ -276,13 +763,106 @@ class BaseTestCase(object):
             except pexpect.EOF:
                 ret = 'EndOfFile'
 
+        rss, cpu = _proc_usage(child.pid) if _report is not None else (0, 0)
+
+        if pooled:
+            self.releasePooledDosemu(key, child, logname, logpos,
+                                     ret not in ('Timeout', 'EndOfFile'))
+            reportsession(self.logname, rss, cpu - cpu0)
+            return ret
+
         try:
             child.close(force=True)
         except PtyProcessError:
             pass
+        reportsession(self.logname, rss, cpu - cpu0)
 
         return ret
 
+    def getPooledDosemuKey(self, args):
+        with open(join(self.imagedir, "dosemu.conf")) as f:
+            conf = f.read()
+        i = args.index("-o")
+        j = args.index("-J")
+        return (strclass(self.__class__), getcwd(), conf,
+                tuple(args[:i] + args[i + 2:j] + args[j + 2:]))
+
+    def getPooledDosemu(self, key, dbin, args):
+        """Return (child, session log, log offsets, warm) for this config
+
+        A warm child is sitting at the DOS prompt of an earlier test and
+        must be rebooted first. The log offsets are those of the session
+        log and of its event log.
+        """
+        global _dosemu_pool_count
+
+        if key in _dosemu_pool:
+            child, logname = _dosemu_pool.pop(key)
+            if child.isalive():
+                logpos = []
+                for name in (logname, splitext(logname)[0] + ".events"):
+                    try:
+                        logpos.append(getsize(name))
+                    except OSError:
+                        logpos.append(0)
+                return child, logname, logpos, True
+            try:
+                child.close(force=True)
+            except PtyProcessError:
+                pass
+
+        # Cold boot, the session log outlives this test's log
+        _dosemu_pool_count += 1
+        logname = "pool-%d-%d.log" % (getpid(), _dosemu_pool_count)
+        args = list(args)
+        args[args.index("-o") + 1] = logname
+        args[args.index("-J") + 1] = splitext(logname)[0] + ".events"
+        child = pexpect.spawn(dbin, args)
+        return child, logname, [0, 0], False
+
+    def releasePooledDosemu(self, key, child, logname, logpos, reusable):
+        # Give this test its own part of the session logs
+        evname = splitext(logname)[0] + ".events"
+        for src, dst, pos in ((logname, self.logname, logpos[0]),
+                              (evname, self.evname, logpos[1])):
+            try:
+                with open(src, "rb") as f, open(dst, "wb") as g:
+                    f.seek(pos)
+                    g.write(f.read())
+            except OSError:
+                pass
+
+        child.logfile = None
+        if reusable and child.isalive() and key not in _dosemu_pool:
+            _dosemu_pool[key] = (child, logname)
+            return
+
+        try:
+            child.close(force=True)
+        except PtyProcessError:
+            pass
+        for name in (logname, evname):
+            try:
+                unlink(name)
+            except OSError:
+                pass
+
+    def getEvents(self, ev=None):
+        """Return the events of the last session, only those named ev if given"""
+        events = []
+        try:
+            with open(self.evname) as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue    # cut off by a kill
+                    if ev is None or event["ev"] == ev:
+                        events.append(event)
+        except FileNotFoundError:
+            pass
+        return events
+
     def runDosemuCmdline(self, xargs, cwd=None, config=None, timeout=30):
         testroot = getcwd()
 
@@ -291,6 +871,7 @@ class BaseTestCase(object):
                 "-f", join(testroot, self.imagedir, "dosemu.conf"),
                 "-n",
                 "-o", join(testroot, self.logname),
+                "-J", join(testroot, self.evname),
                 "-td",
                 "-ks"]
         args.extend(xargs)
@@ -298,17 +879,180 @@ class BaseTestCase(object):
         if config is not None:
             mkfile("dosemu.conf", config, dname=self.imagedir, writemode="a")
 
+        # The child is gone before it can be looked at, so its usage is
+        # taken from wait4() when it is reaped
+        with reportphase("run"), open(self.xptname, "wb") as f:
+            proc = Popen(args, cwd=cwd, stdout=f, stderr=STDOUT)
+            deadline = perf_counter() + timeout
+            while True:
+                pid, status, ru = wait4(proc.pid, WNOHANG)
+                if pid:
+                    break
+                if perf_counter() > deadline:
+                    proc.kill()
+                    _, status, ru = wait4(proc.pid, 0)
+                    break
+                sleep(0.05)
+            proc.returncode = waitstatus_to_exitcode(status)
+        reportsession(self.logname, ru.ru_maxrss, ru.ru_utime + ru.ru_stime)
+
+        with open(self.xptname, "rb") as f:
+            ret = f.read()
+        if not pid:
+            return 'Timeout'
+        if proc.returncode:
+            raise CalledProcessError(proc.returncode, args, output=ret)
+        return ret
+
+    def getSessionNames(self, session):
+        """Log, transcript and event log names for one of several
+        concurrent sessions"""
+        if session is None:
+            return self.logname, self.xptname, self.evname
+        base = splitext(self.logname)[0]
+        return (base + ".%s.log" % session, base + ".%s.xpt" % session,
+                base + ".%s.events" % session)
+
+    def getSessionConfig(self, session, config):
+        """Returns the config file for session, with config appended
+
+        Concurrent sessions each get a copy of dosemu.conf, so that the
+        config of one doesn't leak into the others.
+        """
+        conf = join(self.imagedir, "dosemu.conf")
+        if session is not None:
+            sconf = join(self.imagedir, "dosemu.%s.conf" % session)
+            copyfile(conf, sconf)
+            conf = sconf
+        if config is not None:
+            mkfile(conf, config, dname=".", writemode="a")
+        return conf
+
+    async def runDosemuAsync(self, cmd, opts=None, outfile=None, config=None,
+                             timeout=5, interactions=[], session=None):
+        """As runDosemu(), but awaitable from an asyncio event loop
+
+        With session set, the dosemu logs, the expect transcript and the
+        config go to files of their own, so that several sessions can run
+        at once. The phase timings are reported with the session rather
+        than added to those of the test.
+        """
+        logname, xptname, evname = self.getSessionNames(session)
+        conf = self.getSessionConfig(session, config)
+        dbin = "bin/dosemu"
+        args = ["-f", conf,
+                "-n",
+                "-o", logname,
+                "-J", evname,
+                "-td",
+                "--Fimagedir", self.imagedir]
+        if opts is not None:
+            args.extend(["-I", opts])
+
+        child = pexpect.spawn(dbin, args)
+        cpu0 = _proc_usage(child.pid)[1] if _report is not None else 0
+
+        ret = ''
+        phases = {}
+        start = perf_counter()
+        with open(xptname, "wb") as fout:
+            child.logfile = fout
+            child.setecho(False)
+            try:
+                prompt = r'(system -e|unix -e|' + IPROMPT + ')'
+                await expect_async(child, [prompt + '[\r\n]*'], timeout=10)
+                phases["boot"] = perf_counter() - start
+                child.send(cmd + '\r\n')
+                for resp in interactions:
+                    await expect_async(child, resp[0])
+                    child.send(resp[1])
+                    if outfile is None:
+                        ret += child.before.decode('ASCII', 'replace')
+                await expect_async(child, ['rem end'], timeout=timeout)
+                phases["run"] = perf_counter() - start - phases["boot"]
+                if outfile is None:
+                    ret += child.before.decode('ASCII', 'replace')
+                    ret = SHELLPROMPT.sub('', ret, count=1)
+                else:
+                    with open(join(WORKDIR, outfile), "r") as f:
+                        ret = f.read()
+            except pexpect.TIMEOUT:
+                ret = 'Timeout'
+            except pexpect.EOF:
+                ret = 'EndOfFile'
+
+        rss, cpu = _proc_usage(child.pid) if _report is not None else (0, 0)
         try:
-            ret = check_output(args, cwd=cwd, timeout=timeout, stderr=STDOUT)
-            with open(self.xptname, "w") as f:
-                f.write(ret.decode('ASCII'))
-        except TimeoutExpired as e:
+            child.close(force=True)
+        except PtyProcessError:
+            pass
+        reportsession(logname, rss, cpu - cpu0, phases)
+
+        return ret
+
+    async def runDosemuCmdlineAsync(self, xargs, cwd=None, config=None,
+                                    timeout=30, session=None):
+        """As runDosemuCmdline(), but awaitable from an asyncio event loop"""
+        testroot = getcwd()
+        logname, xptname, evname = self.getSessionNames(session)
+        conf = self.getSessionConfig(session, config)
+
+        args = ["--Fimagedir", join(testroot, self.imagedir),
+                "-f", join(testroot, conf),
+                "-n",
+                "-o", join(testroot, logname),
+                "-J", join(testroot, evname),
+                "-td",
+                "-ks"]
+        args.extend(xargs)
+
+        start = perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            join(testroot, "bin", "dosemu"), *args, cwd=cwd,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        try:
+            out, _ = await asyncio.wait_for(proc.communicate(), timeout)
+            ret = out
+        except asyncio.TimeoutError:
+            proc.kill()
+            out, _ = await proc.communicate()
             ret = 'Timeout'
-            with open(self.xptname, "w") as f:
-                f.write(e.output.decode('ASCII'))
+        with open(xptname, "w") as f:
+            f.write(out.decode('ASCII'))
+        # asyncio reaps the child itself, so there is no usage to take
+        reportsession(logname, None, None, {"run": perf_counter() - start})
 
         return ret
 
+    def runDosemuSessions(self, sessions):
+        """Run several dosemu sessions concurrently from one event loop
+
+        Each entry of sessions is a dict of runDosemuAsync() keyword
+        arguments; an "xargs" entry selects runDosemuCmdlineAsync()
+        instead. Sessions are numbered in order for their file names.
+        Returns the results in the same order.
+        """
+        async def gather():
+            coros = []
+            for n, kwargs in enumerate(sessions):
+                if "xargs" in kwargs:
+                    coros.append(self.runDosemuCmdlineAsync(session=n,
+                                                            **kwargs))
+                else:
+                    coros.append(self.runDosemuAsync(session=n, **kwargs))
+            return await asyncio.gather(*coros)
+
+        with reportphase("sessions"):
+            return asyncio.run(gather())
+
+    def getSessionFiles(self):
+        """The logs, transcripts and event logs of concurrent sessions"""
+        base = splitext(self.logname)[0] + "."
+        return sorted(name for name in listdir(dirname(base) or ".")
+                      if name.startswith(base) and
+                      name[len(base):].split(".")[0].isdigit() and
+                      splitext(name)[1] in (".log", ".xpt", ".events"))
+
 
 class MyTestResult(unittest.TextTestResult):
 
@@ -318,18 +1062,72 @@ class MyTestResult(unittest.TextTestResult):
         return '%-80s' % test.shortDescription()
 
     def startTest(self, test):
+        global _report
+
         super(MyTestResult, self).startTest(test)
         self.starttime = datetime.utcnow()
         name = test.id().replace('__main__', test.pname)
         test.logname = name + ".log"
         test.logdisp = "dosemu.log"
+        test.evname = name + ".events"
+        test.evdisp = "events"
         test.xptname = name + ".xpt"
         test.xptdisp = "expect.log"
         test.firstsub = True
 
+        if _report_file is not None:
+            self.reportcounts = self.getReportCounts()
+            self.reportstart = perf_counter()
+            test.teardownstart = None
+            _report = {"test": name,
+                       "flavour": getattr(test, "prettyname", None),
+                       "started": self.starttime.isoformat(),
+                       "phases": {},
+                       "sessions": []}
+
+    def getReportCounts(self):
+        return (len(self.failures), len(self.errors), len(self.skipped),
+                len(self.expectedFailures))
+
+    def stopTest(self, test):
+        global _report
+
+        super(MyTestResult, self).stopTest(test)
+        if _report is None:
+            return
+        now = perf_counter()
+        if getattr(test, "teardownstart", None) is not None:
+            _report["phases"]["teardown"] = now - test.teardownstart
+        _report["duration"] = now - self.reportstart
+
+        counts = self.getReportCounts()
+        for status, before, after in zip(
+                ("fail", "error", "skip", "knownfail"),
+                self.reportcounts, counts):
+            if after > before:
+                _report["status"] = status
+                break
+        else:
+            _report["status"] = "ok"
+
+        with open(_report_file, "a") as f:
+            f.write(json.dumps(_report) + "\n")
+        _report = None
+
     def addFailure(self, test, err):
         super(MyTestResult, self).addFailure(test, err)
         if not test.nologs:
+            # the events first, they sum up what the log has in detail
+            self.stream.writeln("")
+            name = '{:^16}'.format(test.evdisp)
+            self.stream.writeln('{:*^80}'.format(name))
+            try:
+                with open(test.evname, errors='replace') as f:
+                    self.stream.writeln(f.read())
+            except FileNotFoundError:
+                self.stream.writeln("File not present")
+            self.stream.writeln("")
+
             self.stream.writeln("")
             name = '{:^16}'.format(test.logdisp)
             self.stream.writeln('{:*^80}'.format(name))
@@ -350,6 +1148,14 @@ class MyTestResult(unittest.TextTestResult):
                 self.stream.writeln("File not present")
             self.stream.writeln("")
 
+            for sname in test.getSessionFiles():
+                self.stream.writeln("")
+                name = '{:^16}'.format(sname)
+                self.stream.writeln('{:*^80}'.format(name))
+                with open(sname, errors='replace') as f:
+                    self.stream.writeln(f.read())
+                self.stream.writeln("")
+
     def addSuccess(self, test):
         super(unittest.TextTestResult, self).addSuccess(test)
         if self.showAll:
@@ -369,6 +1175,27 @@ class MyTestResult(unittest.TextTestResult):
             unlink(test.xptname)
         except OSError:
             pass
+        try:
+            unlink(test.evname)
+        except OSError:
+            pass
+        for sname in test.getSessionFiles():
+            try:
+                unlink(sname)
+            except OSError:
+                pass
+
+    def addSkip(self, test, reason):
+        if reason != KNOWNFAILREASON:
+            super(MyTestResult, self).addSkip(test, reason)
+            return
+        # Not run as it is known to fail, which is not the same as a skip
+        self.expectedFailures.append((test, reason))
+        if self.showAll:
+            self.stream.writeln("known failure")
+        elif self.dots:
+            self.stream.write('k')
+            self.stream.flush()
 
     def addSubTest(self, test, subtest, err):
         super(MyTestResult, self).addSubTest(test, subtest, err)
@@ -383,7 +1210,168 @@ class MyTestRunner(unittest.TextTestRunner):
     resultclass = MyTestResult
 
 
+# parallel runner
+
+_parallel_tests = []
+_parallel_topdir = None
+
+
+def _iter_tests(suite):
+    for t in suite:
+        if isinstance(t, unittest.TestSuite):
+            yield from _iter_tests(t)
+        else:
+            yield t
+
+
+def _parallel_worker_init(verbosity):
+    global _parallel_verbosity
+
+    _parallel_verbosity = verbosity
+
+    root = join(_parallel_topdir, PARALLELDIR, "w%d" % getpid())
+    rmtree(root, ignore_errors=True)
+    makedirs(root)
+    for name in PARALLELLINKS:
+        src = join(_parallel_topdir, name)
+        if exists(src):
+            symlink(src, join(root, name))
+    for name in PARALLELFILES:
+        symlink(join(_parallel_topdir, name), join(root, name))
+    chdir(root)
+
+
+def _parallel_worker_run(idx):
+    test = _parallel_tests[idx]
+
+    stream = StringIO()
+    result = MyTestResult(unittest.runner._WritelnDecorator(stream),
+                          True, _parallel_verbosity)
+    # A fresh suite per test so that setUpClass() runs in this worker
+    unittest.TestSuite([test]).run(result)
+
+    errstream = StringIO()
+    errresult = MyTestResult(unittest.runner._WritelnDecorator(errstream),
+                             True, _parallel_verbosity)
+    errresult.errors = result.errors
+    errresult.failures = result.failures
+    errresult.printErrors()
+
+    # Leave failure logs where the serial runner would have put them,
+    # including those of concurrent sessions from runDosemuSessions()
+    logname = getattr(test, "logname", None)
+    if logname is not None:
+        base = splitext(logname)[0]
+        for name in listdir("."):
+            if (name.startswith(base + ".") and
+                    splitext(name)[1] in (".log", ".xpt", ".events")):
+                rename(name, join(_parallel_topdir, name))
+
+    return (stream.getvalue(), errstream.getvalue(), result.testsRun,
+            len(result.failures), len(result.errors), len(result.skipped),
+            len(result.expectedFailures), len(result.unexpectedSuccesses))
+
+
+class MyParallelTestRunner(unittest.TextTestRunner):
+    """Runs each test method in a pool of worker processes
+
+    Every worker has its own image directory, log and expect files so the
+    tests cannot interfere with one another. The per test output is the
+    same as that of MyTestRunner, but is written as each test completes.
+    """
+
+    resultclass = MyTestResult
+
+    def __init__(self, jobs=1, **kwargs):
+        super(MyParallelTestRunner, self).__init__(**kwargs)
+        self.jobs = jobs
+
+    def run(self, test):
+        global _parallel_tests, _parallel_topdir
+
+        _parallel_tests = list(_iter_tests(test))
+        _parallel_topdir = abspath(getcwd())
+        rmtree(PARALLELDIR, ignore_errors=True)
+        makedirs(TESTCACHEDIR, exist_ok=True)
+
+        result = self._makeResult()
+        errors = []
+        counts = [0] * 6
+
+        starttime = perf_counter()
+        with ProcessPoolExecutor(max_workers=self.jobs,
+                                 mp_context=get_context("fork"),
+                                 initializer=_parallel_worker_init,
+                                 initargs=(self.verbosity,)) as pool:
+            futures = [pool.submit(_parallel_worker_run, i)
+                       for i in range(len(_parallel_tests))]
+            for future in as_completed(futures):
+                out, err, *nums = future.result()
+                self.stream.write(out)
+                self.stream.flush()
+                if err.strip():
+                    errors.append(err)
+                counts = [a + b for a, b in zip(counts, nums)]
+        timetaken = perf_counter() - starttime
+
+        for err in errors:
+            self.stream.write(err)
+
+        run, failures, errs, skipped, expfail, unexpsucc = counts
+        self.stream.writeln(result.separator2)
+        self.stream.writeln("Ran %d test%s in %.3fs" %
+                            (run, run != 1 and "s" or "", timetaken))
+        self.stream.writeln()
+
+        infos = []
+        if failures or errs:
+            self.stream.write("FAILED")
+            if failures:
+                infos.append("failures=%d" % failures)
+            if errs:
+                infos.append("errors=%d" % errs)
+        else:
+            self.stream.write("OK")
+        if skipped:
+            infos.append("skipped=%d" % skipped)
+        if expfail:
+            infos.append("expected failures=%d" % expfail)
+        if unexpsucc:
+            infos.append("unexpected successes=%d" % unexpsucc)
+        if infos:
+            self.stream.writeln(" (%s)" % (", ".join(infos),))
+        else:
+            self.stream.write("\n")
+
+        # Provide wasSuccessful() for unittest.main()'s exit status
+        result.testsRun = run
+        result.failures = [(None, None)] * failures
+        result.errors = [(None, None)] * errs
+        return result
+
+
 def main():
     if version_info < (3, 0):
         exit("Python 3.0 or later is required.")
-    unittest.main(testRunner=MyTestRunner, verbosity=2)
+
+    # TEST_JOBS=N runs the tests in N worker processes
+    try:
+        jobs = int(environ.get("TEST_JOBS", "1"))
+    except ValueError:
+        jobs = 1
+
+    # TEST_REPORT=file appends a JSON line per test to file
+    global _report_file
+    if environ.get("TEST_REPORT"):
+        _report_file = abspath(environ["TEST_REPORT"])
+
+    # TEST_PREBUILD=1 refreshes the test program cache before the run
+    if environ.get("TEST_PREBUILD"):
+        mkprebuild(max(jobs, 1))
+
+    if jobs > 1:
+        runner = MyParallelTestRunner(jobs=jobs, verbosity=2)
+    else:
+        runner = MyTestRunner
+
+    unittest.main(testRunner=runner, verbosity=2)
@@ -0,0 +1,104 @@
+"""Poll the hot path counters of a running dosemu
+
+dosemu keeps the counters in the file given with $_counters_file while
+it runs. This script maps the file and prints the counters that changed
+since the last poll, as events per second, busiest first:
+
+    python3 test/counters.py [--interval SEC] [--top N] [--once] file
+
+With --once the current totals are printed and the script exits, which
+also works on the file left behind by a dosemu that has finished.
+"""
+
+import argparse
+import mmap
+import struct
+
+from time import monotonic, sleep
+
+MAGIC = b"DOSEMUCN"
+HEADER = struct.Struct("<8sIIIIII")
+NAME_LEN = 24
+
+# linux/kvm.h
+KVM_EXITS = {
+    0: "UNKNOWN", 1: "EXCEPTION", 2: "IO", 3: "HYPERCALL", 4: "DEBUG",
+    5: "HLT", 6: "MMIO", 7: "IRQ_WINDOW_OPEN", 8: "SHUTDOWN",
+    9: "FAIL_ENTRY", 10: "INTR", 17: "INTERNAL_ERROR",
+}
+
+
+class Counters:
+    """A read-only view of a counters file"""
+
+    def __init__(self, fname):
+        with open(fname, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+        (magic, version, self.count, names_off, self.values_off,
+         self.pid, _) = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != 1:
+            raise ValueError("%s is not a dosemu counters file" % fname)
+        self.names = []
+        for i in range(self.count):
+            off = names_off + i * NAME_LEN
+            name = self.map[off:off + NAME_LEN].split(b"\0")[0].decode()
+            self.names.append(pretty(name))
+
+    @property
+    def running(self):
+        return HEADER.unpack_from(self.map)[6] != 0
+
+    def values(self):
+        return struct.unpack_from("<%dQ" % self.count, self.map,
+                                  self.values_off)
+
+    def totals(self):
+        """Return a dict of the non-zero counters"""
+        return {n: v for n, v in zip(self.names, self.values()) if v}
+
+
+def pretty(name):
+    if name.startswith("kvm_exit."):
+        reason = int(name.split(".")[1])
+        return "kvm_exit." + KVM_EXITS.get(reason, str(reason))
+    return name
+
+
+def show(rows, top):
+    rows = sorted(rows, key=lambda r: -r[1])[:top]
+    for name, val in rows:
+        print("  %-24s %12.0f" % (name, val))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Poll dosemu hot path counters")
+    ap.add_argument("file", help="file given with $_counters_file")
+    ap.add_argument("--interval", type=float, default=1.0,
+                    help="seconds between polls (default 1)")
+    ap.add_argument("--top", type=int, default=20,
+                    help="counters shown per poll (default 20)")
+    ap.add_argument("--once", action="store_true",
+                    help="print the totals and exit")
+    args = ap.parse_args()
+
+    c = Counters(args.file)
+    if args.once:
+        show(c.totals().items(), args.top)
+        return
+
+    prev, t0 = c.values(), monotonic()
+    try:
+        while c.running:
+            sleep(args.interval)
+            cur, t1 = c.values(), monotonic()
+            rates = [(n, (b - a) / (t1 - t0))
+                     for n, a, b in zip(c.names, prev, cur) if b != a]
+            print("pid %d, %d counters changed:" % (c.pid, len(rates)))
+            show(rates, args.top)
+            prev, t0 = cur, t1
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,516 @@
+"""Write FAT12/16/32 hard disk images for the tests
+
+This does what bin/mkfatimage16 does, without the subprocess and without
+its limits: any geometry, subdirectories, FAT32, files that only exist in
+memory. The system area (MBR, boot sector, FATs and the FAT12/16 root
+directory) is built in memory and written with a single write, the data
+clusters follow with one write per contiguous run of data. Everything
+else is left as a hole in the image file unless sparse=False.
+
+A file list entry is a (name, data) or (name, data, mtime) tuple. The name
+is an 8.3 path that may contain '/' or '\\' separated subdirectories, which
+are created as needed. The data is bytes, an int for a file of that many
+zero bytes (which stays sparse) or None for an empty directory.
+
+With the default geometry and FAT type the images are the same as those
+of mkfatimage16 -p: the same MBR and boot code, BPB, cluster sizes and
+file placement. Only an empty file differs, which mkfatimage16 gets wrong
+by setting FAT[0] to 0xff.
+"""
+
+import struct
+
+from os import listdir, posix_fallocate, stat
+from os.path import isdir, join
+from stat import S_ISREG
+from time import localtime, time
+
+SECTOR_SIZE = 512
+HEADER_SIZE = 128
+IMAGE_MAGIC = b"DOSEMU\0"
+ROOT_ENTRIES = 512
+FAT_COPIES = 2
+MEDIA_DESCRIPTOR = 0xf8
+SERIAL_NUMBER = 0x12345678
+
+P_TYPE_12BIT = 0x01
+P_TYPE_16BIT = 0x04
+P_TYPE_32MB = 0x06
+P_TYPE_FAT32 = 0x0b
+P_TYPE_FAT32_LBA = 0x0c
+P_TYPE_32MB_LBA = 0x0e
+
+ATTR_VOLUME = 0x08
+ATTR_DIRECTORY = 0x10
+
+# src/plugin/periph/bootnorm.s assembled, the MBR code of mkfatimage16:
+# loads and runs the boot sector of the active partition
+MBR_CODE = bytes.fromhex(
+    "fafc31c08ed8bd007c8ed08d66e0fbb8e01f8ec089ee89efb90001f3a5ea227c"
+    "e01f8ed88ed031c08ec08dbebe01f60580757483c71081fffe7d72f2e8cd006e"
+    "6f2061637469766520706172746974696f6e20666f756e640d0a00f4ebfde8ab"
+    "0072656164206572726f72207768696c652072656164696e672064726976650d"
+    "0a00ebd7e88500706172746974696f6e207369676e617475726520213d203535"
+    "41410d0a00ebb4e8120072b226813efe7d55aa75cf89feea007c0000bbaa55b4"
+    "41cd13723281fb55aa752cf6c1017427eb1010000400007c0000000000000000"
+    "00008b4508a3da7c8b450aa3dc7cb80042bed27ccd13c3b80402bb007c8b4d02"
+    "8a7501cd13c331dbb40ecd105eac563c0075f3c3")
+
+# src/plugin/periph/bootsect.s from 0x3e on, the boot sector code of
+# mkfatimage16: prints a message and leaves dosemu
+BOOT_CODE = bytes.fromhex(
+    "b8c007501fbe5b00b9da00b40e31dbaccd10e2fbb400cd16b8ffffcde60d0a0d"
+    "0a202020202020202020746865204c696e757820444f5320456d756c61746f72"
+    "2c20342f312f39330d0a2020202020202020202020202056657273696f6e2030"
+    "2e34390d0a0d0a202020202020202020526f626572742053616e646572730d0a"
+    "2020202020202020206774383133346240707269736d2e6761746563682e6564"
+    "750d0a0d0a2020202053656520524541444d452e666972737420666f7220696e"
+    "737472756374696f6e730d0a0d0a20202020707265737320616e79206b657920"
+    "746f2072657475726e20746f204c696e75782e2e2e0d0a")
+
+# mov ax,0ffffh; int 0e6h - leaves dosemu if booted, jumped to from the
+# start of the boot sector past the FAT32 BPB
+BOOT_CODE32 = b"\xb8\xff\xff\xcd\xe6"
+
+INVALID_CHARS = set('"*+,/:;<=>?[\\]|')
+
+# keep runs of file data in memory up to this size before writing them
+WRITE_CHUNK = 16 * 1024 * 1024
+
+
+def dos_name(name):
+    """Returns the 11 byte directory entry name of an 8.3 name, None if
+    name is not a valid DOS name"""
+    base, _, ext = name.partition(".")
+    if not base or len(base) > 8 or len(ext) > 3 or "." in ext:
+        return None
+    if any(c in INVALID_CHARS or ord(c) < 0x20 for c in name):
+        return None
+    try:
+        return ("%-8s%-3s" % (base, ext)).upper().encode("cp437")
+    except UnicodeEncodeError:
+        return None
+
+
+def geometry(size, sectors=63, heads=255):
+    """Returns the (cylinders, heads, sectors) to hold an image of size bytes"""
+    per_cyl = heads * sectors * SECTOR_SIZE
+    return ((size + per_cyl - 1) // per_cyl, heads, sectors)
+
+
+def host_files(dname, names):
+    """Returns the file list entries for the host files or directories
+    names in dname. Like mkfatimage16, names that are not DOS compatible
+    are left out"""
+    ret = []
+
+    def add(path, name):
+        if isdir(path):
+            ret.append((name, None))
+            for sub in sorted(listdir(path)):
+                if dos_name(sub) is not None:
+                    add(join(path, sub), name + "/" + sub)
+            return
+        st = stat(path)
+        if not S_ISREG(st.st_mode):
+            return
+        with open(path, "rb") as f:
+            ret.append((name, f.read(), st.st_mtime))
+
+    for name in names:
+        if dos_name(name) is not None:
+            add(join(dname, name), name)
+    return ret
+
+
+class _Node(object):
+    def __init__(self, name, data=None, mtime=None, parent=None):
+        self.name = name
+        self.data = data
+        self.mtime = mtime
+        self.parent = parent
+        self.children = [] if data is None else None
+        self.cluster = 0
+        self.nclusters = 0
+
+    @property
+    def is_dir(self):
+        return self.children is not None
+
+    def size(self):
+        if self.is_dir:
+            return 0
+        if isinstance(self.data, int):
+            return self.data
+        return len(self.data)
+
+
+def _dos_datetime(mtime):
+    tm = localtime(mtime)
+    if tm.tm_year < 1980:
+        return (0, (1 << 5) | 1)
+    return (((tm.tm_hour & 0x1f) << 11) | ((tm.tm_min & 0x3f) << 5) |
+            ((tm.tm_sec >> 1) & 0x1f),
+            (((tm.tm_year - 1980) & 0x7f) << 9) | ((tm.tm_mon & 0xf) << 5) |
+            (tm.tm_mday & 0x1f))
+
+
+def _dirent(name, attr, cluster, size, mtime):
+    tm, dt = _dos_datetime(mtime)
+    return struct.pack("<11sB8xHHHHI", name, attr, cluster >> 16, tm, dt,
+                       cluster & 0xffff, size)
+
+
+def _chs(lba, heads, sectors):
+    cyl = lba // (heads * sectors)
+    if cyl > 1023:
+        return bytes((heads - 1, sectors | 0xc0, 0xff))
+    head = (lba // sectors) % heads
+    sec = lba % sectors + 1
+    return bytes((head, sec | ((cyl >> 2) & 0xc0), cyl & 0xff))
+
+
+class FatImage(object):
+    """An image being laid out; write_image() is the usual interface"""
+
+    def __init__(self, cylinders, heads, sectors, fat=None, label=None):
+        if not (0 < heads <= 255 and 0 < sectors <= 63 and cylinders > 0):
+            raise ValueError("invalid geometry %d/%d/%d" %
+                             (cylinders, heads, sectors))
+        self.cylinders = cylinders
+        self.heads = heads
+        self.sectors = sectors
+        # track 0, head 0 holds the MBR only
+        self.hidden = sectors
+        self.total = (heads * cylinders - 1) * sectors
+        if self.total >= 1 << 32:
+            raise ValueError("image too large")
+        self.label = label.upper()[:11] if label else None
+        self.root = _Node(b"", parent=None)
+        self._pick_fat(fat)
+
+    def _pick_fat(self, fat):
+        total = self.total
+        if fat is None:
+            if total <= 8 * 0xff7:
+                fat = 12
+            elif total // 64 <= 65535:
+                fat = 16
+            else:
+                fat = 32
+
+        # FAT12/16 cluster sizes and FAT sizes as in mkfatimage16
+        if fat == 12:
+            self.spc = 8
+            while total // self.spc > 0xff7:
+                self.spc *= 2
+            self.ptype = P_TYPE_12BIT
+        elif fat == 16:
+            if total <= 65535:
+                self.spc = 4
+                self.ptype = P_TYPE_16BIT
+            else:
+                self.spc = 1
+                while total // self.spc > 65535:
+                    self.spc *= 2
+                self.ptype = P_TYPE_32MB
+                if self.cylinders > 1024:
+                    self.ptype = P_TYPE_32MB_LBA
+        elif fat == 32:
+            # the cluster sizes Microsoft's format uses
+            for limit, spc in ((532480, 1), (16777216, 8), (33554432, 16),
+                               (67108864, 32), (1 << 32, 64)):
+                if total <= limit:
+                    self.spc = spc
+                    break
+            self.ptype = P_TYPE_FAT32
+            if self.cylinders > 1024:
+                self.ptype = P_TYPE_FAT32_LBA
+        else:
+            raise ValueError("unknown FAT type %r" % fat)
+        if self.spc > 128:
+            raise ValueError("image too large for FAT%d" % fat)
+        self.fat = fat
+
+        if fat == 32:
+            self.reserved = 32
+            self.root_sectors = 0
+            div = (256 * self.spc + FAT_COPIES) // 2
+            self.spf = (total - self.reserved + div - 1) // div
+        else:
+            self.reserved = 1
+            self.root_sectors = ROOT_ENTRIES * 32 // SECTOR_SIZE
+            clusters = total // self.spc
+            if fat == 12:
+                self.spf = (3 * clusters + 1023) // 1024
+            else:
+                self.spf = (clusters + 255) // 256
+        self.data_start = (self.reserved + FAT_COPIES * self.spf +
+                           self.root_sectors)
+        self.clusters = (total - self.data_start) // self.spc
+        if ((fat == 12 and self.clusters >= 4085) or
+                (fat == 16 and not 4085 <= self.clusters < 65525) or
+                (fat == 32 and self.clusters < 65525)):
+            raise ValueError("%d clusters don't make a valid FAT%d" %
+                             (self.clusters, fat))
+        self.cluster_size = self.spc * SECTOR_SIZE
+
+    def add(self, name, data=None, mtime=None):
+        """Adds a file, or a directory if data is None"""
+        if mtime is None:
+            mtime = time()
+        parts = [p for p in name.replace("\\", "/").split("/") if p]
+        if not parts:
+            raise ValueError("empty file name %r" % name)
+        node = self.root
+        for i, part in enumerate(parts):
+            dname = dos_name(part)
+            if dname is None:
+                raise ValueError("%s: File name is not DOS-compatible" % name)
+            last = i == len(parts) - 1
+            for child in node.children:
+                if child.name == dname:
+                    if not child.is_dir or (last and data is not None):
+                        raise ValueError("%s: already exists" % name)
+                    break
+            else:
+                child = _Node(dname, data if last else None,
+                              mtime, parent=node)
+                node.children.append(child)
+            node = child
+
+    def _dir_entries(self, node):
+        ents = []
+        if node is not self.root:
+            parent = node.parent.cluster if node.parent is not self.root else 0
+            ents.append(_dirent(b".          ", ATTR_DIRECTORY,
+                                node.cluster, 0, node.mtime))
+            ents.append(_dirent(b"..         ", ATTR_DIRECTORY,
+                                parent, 0, node.mtime))
+        for child in node.children:
+            ents.append(_dirent(child.name,
+                                ATTR_DIRECTORY if child.is_dir else 0,
+                                child.cluster, child.size(), child.mtime))
+        if node is self.root and self.label:
+            # last, to allow booting that needs the first entry
+            ents.append(struct.pack("<11sB20x",
+                                    self.label.ljust(11).encode("cp437"),
+                                    ATTR_VOLUME))
+        return b"".join(ents)
+
+    def _nr_dirents(self, node):
+        n = len(node.children)
+        if node is self.root:
+            return n + (1 if self.label else 0)
+        return n + 2
+
+    def _allocate(self):
+        """Places the files and directories breadth first, each in
+        contiguous clusters, as mkfatimage16 places the root files"""
+        nxt = 2
+        order = []
+
+        def place(node, nbytes):
+            nonlocal nxt
+            node.nclusters = (nbytes + self.cluster_size - 1) // \
+                self.cluster_size
+            if node.nclusters:
+                node.cluster = nxt
+                nxt += node.nclusters
+                order.append(node)
+
+        if self._nr_dirents(self.root) > ROOT_ENTRIES and self.fat != 32:
+            raise ValueError("Root directory full")
+        if self.fat == 32:
+            place(self.root, max(self._nr_dirents(self.root) * 32, 1))
+        queue = [self.root]
+        while queue:
+            node = queue.pop(0)
+            for child in node.children:
+                if child.is_dir:
+                    place(child, self._nr_dirents(child) * 32)
+                    queue.append(child)
+                else:
+                    place(child, child.size())
+        if nxt - 2 > self.clusters:
+            raise ValueError("Disk full, %d clusters needed, %d available" %
+                             (nxt - 2, self.clusters))
+        self.next_free = nxt
+        return order
+
+    def _build_fat(self, order):
+        if self.fat == 12:
+            fat = bytearray(self.spf * SECTOR_SIZE)
+
+            def put(n, v):
+                off = n // 2 * 3
+                if n & 1:
+                    fat[off + 1] = (fat[off + 1] & 0x0f) | ((v & 0x0f) << 4)
+                    fat[off + 2] = (v >> 4) & 0xff
+                else:
+                    fat[off] = v & 0xff
+                    fat[off + 1] = (fat[off + 1] & 0xf0) | ((v >> 8) & 0x0f)
+
+            put(0, 0xff8)
+            put(1, 0xfff)
+            for node in order:
+                end = node.cluster + node.nclusters - 1
+                for n in range(node.cluster, end):
+                    put(n, n + 1)
+                put(end, 0xfff)
+            return fat
+
+        if self.fat == 16:
+            fmt, eoc, media = "H", 0xffff, 0xfff8
+        else:
+            fmt, eoc, media = "I", 0x0fffffff, 0x0ffffff8
+        entries = [0] * (self.spf * SECTOR_SIZE // struct.calcsize(fmt))
+        entries[0] = media
+        entries[1] = eoc
+        for node in order:
+            end = node.cluster + node.nclusters - 1
+            entries[node.cluster:end] = range(node.cluster + 1, end + 1)
+            entries[end] = eoc
+        return struct.pack("<%d%s" % (len(entries), fmt), *entries)
+
+    def _mbr(self, bootable):
+        mbr = bytearray(SECTOR_SIZE)
+        mbr[:len(MBR_CODE)] = MBR_CODE
+        end = self.hidden + self.total - 1
+        mbr[446:462] = (bytes((0x80 if bootable else 0,)) +
+                        _chs(self.hidden, self.heads, self.sectors) +
+                        bytes((self.ptype,)) +
+                        _chs(end, self.heads, self.sectors) +
+                        struct.pack("<II", self.hidden, self.total))
+        mbr[510:512] = b"\x55\xaa"
+        return mbr
+
+    def _boot_sector(self, bootsect):
+        if bootsect:
+            boot = bytearray(bootsect[:SECTOR_SIZE].ljust(SECTOR_SIZE, b"\0"))
+        else:
+            code, text = (0x5a, BOOT_CODE32) if self.fat == 32 else \
+                (0x3e, BOOT_CODE)
+            boot = bytearray(SECTOR_SIZE)
+            boot[:3] = bytes((0xeb, code - 2, 0x90))
+            boot[code:code + len(text)] = text
+            boot[3:11] = b"IBM  3.3"
+            # assume FreeDOS or a later DOS that wants the extended BPB
+            boot[0x26] = 0x29
+        label = (self.label or "").ljust(11).encode("cp437")
+        small = self.total if self.total < 65536 and self.fat != 32 else 0
+        struct.pack_into("<HBHBHHBHHH", boot, 0x0b, SECTOR_SIZE, self.spc,
+                         self.reserved, FAT_COPIES,
+                         0 if self.fat == 32 else ROOT_ENTRIES, small,
+                         MEDIA_DESCRIPTOR, 0 if self.fat == 32 else self.spf,
+                         self.sectors, self.heads)
+
+        if self.fat == 32:
+            struct.pack_into("<IIIHHIHH12xBBBI11s8s", boot, 0x1c,
+                             self.hidden, self.total, self.spf, 0, 0,
+                             self.root.cluster, 1, 6, 0x80, 0, 0x29,
+                             SERIAL_NUMBER, label, b"FAT32   ")
+        elif boot[0x26] in (0x28, 0x29):
+            struct.pack_into("<IIBBBI", boot, 0x1c, self.hidden,
+                             0 if small else self.total, 0x80, 0, boot[0x26],
+                             SERIAL_NUMBER)
+            if boot[0x26] == 0x29:
+                boot[0x2b:0x36] = label
+                boot[0x36:0x3e] = b"FAT12   " if self.fat == 12 else \
+                    b"FAT16   "
+        else:
+            # BPB of DOS 3.x, see mkfatimage16
+            if 0x80 <= boot[0x1fd] <= 0x83:
+                boot[0x1fd] = 0x80
+            if small:
+                struct.pack_into("<H", boot, 0x1c, self.hidden)
+            else:
+                struct.pack_into("<II", boot, 0x1c, self.hidden, self.total)
+        boot[510:512] = b"\x55\xaa"
+        return boot
+
+    def _fsinfo(self, used):
+        info = bytearray(SECTOR_SIZE)
+        struct.pack_into("<I", info, 0, 0x41615252)
+        struct.pack_into("<IIII", info, 484, 0x61417272,
+                         self.clusters - used, self.next_free, 0xaa550000)
+        return info
+
+    def write(self, path, bootsect=None, raw=False, sparse=True):
+        order = self._allocate()
+        used = sum(node.nclusters for node in order)
+
+        system = bytearray()
+        if not raw:
+            system += struct.pack("<7sIIII1xI", IMAGE_MAGIC, self.heads,
+                                  self.sectors, self.cylinders, HEADER_SIZE,
+                                  0).ljust(HEADER_SIZE, b"\0")
+        base = len(system)
+        system += self._mbr(bootsect is not None)
+        system += bytes((self.hidden - 1) * SECTOR_SIZE)
+        boot = self._boot_sector(bootsect)
+        if self.fat == 32:
+            area = bytearray(self.reserved * SECTOR_SIZE)
+            area[0:SECTOR_SIZE] = boot
+            area[SECTOR_SIZE:2 * SECTOR_SIZE] = self._fsinfo(used)
+            area[6 * SECTOR_SIZE:7 * SECTOR_SIZE] = boot
+            area[7 * SECTOR_SIZE:8 * SECTOR_SIZE] = self._fsinfo(used)
+            system += area
+        else:
+            system += boot
+        fat = self._build_fat(order)
+        for _ in range(FAT_COPIES):
+            system += fat
+        if self.fat != 32:
+            root = self._dir_entries(self.root)
+            system += root.ljust(self.root_sectors * SECTOR_SIZE, b"\0")
+
+        data_base = base + (self.hidden + self.data_start) * SECTOR_SIZE
+        size = base + (self.hidden + self.total) * SECTOR_SIZE
+        with open(path, "wb") as f:
+            f.truncate(size)
+            if not sparse:
+                posix_fallocate(f.fileno(), 0, size)
+            f.write(system)
+
+            # coalesce the data of adjacent clusters into one write
+            run, run_start = bytearray(), None
+            for node in order:
+                if node.is_dir:
+                    data = self._dir_entries(node)
+                elif isinstance(node.data, int):
+                    data = None
+                else:
+                    data = node.data
+                start = data_base + (node.cluster - 2) * self.cluster_size
+                if run_start is not None and (
+                        data is None or
+                        len(run) + len(data) > WRITE_CHUNK):
+                    f.seek(run_start)
+                    f.write(run)
+                    run, run_start = bytearray(), None
+                if data is None:
+                    continue
+                if run_start is None:
+                    run_start = start
+                else:
+                    run += bytes(start - run_start - len(run))
+                run += data
+            if run_start is not None:
+                f.seek(run_start)
+                f.write(run)
+
+
+def write_image(path, files, cylinders=36, heads=4, sectors=17, fat=None,
+                label=None, bootsect=None, raw=False, sparse=True):
+    """Writes a partitioned hard disk image holding files to path.
+
+    fat is 12, 16 or 32, by default the type mkfatimage16 would choose,
+    or FAT32 for images above 2GB. bootsect is the partition boot sector
+    to use, the partition is then marked active. Without raw the image
+    starts with the dosemu hdimage header."""
+    img = FatImage(cylinders, heads, sectors, fat=fat, label=label)
+    for ent in files:
+        img.add(*ent)
+    img.write(path, bootsect=bootsect, raw=raw, sparse=sparse)
+    return img
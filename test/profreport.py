@@ -0,0 +1,93 @@
+"""Reports from a dosemu guest profile
+
+The profile is written at exit when $_guest_profile is set. It is in the
+folded stack format of flame graph tools, one line per location:
+
+    mode;CS:EIP;zone count
+
+where mode is vm86 or dpmi plus the CPU backend (e.g. "dpmi-kvm") and
+zone tells where the host time went: guest, emu, idle, mfs or intNN.
+The file can be fed to flamegraph.pl as it is; this script prints plain
+text summaries. For vm86 samples the linear address is shown as well.
+
+    python3 test/profreport.py [--top N] [--by mode,zone,ip] profile
+"""
+
+import argparse
+
+from collections import Counter, namedtuple
+
+Sample = namedtuple("Sample", "mode cs eip zone count")
+
+
+def parse(fname):
+    """Return the samples of a profile as a list of Sample tuples"""
+    samples = []
+    with open(fname) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            stack, count = line.rsplit(" ", 1)
+            mode, addr, zone = stack.split(";")
+            cs, eip = addr.split(":")
+            samples.append(Sample(mode, int(cs, 16), int(eip, 16), zone,
+                                  int(count)))
+    return samples
+
+
+def location(s):
+    if s.mode.startswith("vm86"):
+        return "%04x:%04x (%05x)" % (s.cs, s.eip, (s.cs << 4) + s.eip)
+    return "%04x:%08x" % (s.cs, s.eip)
+
+
+KEYS = {
+    "mode": lambda s: s.mode,
+    "zone": lambda s: s.zone,
+    "ip": lambda s: "%-24s %s" % (location(s), s.zone),
+}
+
+
+def totals(samples, by):
+    """Return a Counter of sample counts grouped by mode, zone or ip"""
+    key = KEYS[by]
+    c = Counter()
+    for s in samples:
+        c[key(s)] += s.count
+    return c
+
+
+def report(samples, by=("mode", "zone", "ip"), top=20):
+    total = sum(s.count for s in samples)
+    out = ["%d samples" % total]
+    for b in by:
+        out.append("")
+        out.append("by %s:" % b)
+        for k, n in totals(samples, b).most_common(top):
+            out.append("  %6.2f%% %8d  %s" % (100.0 * n / total, n, k))
+    return "\n".join(out)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Summarize a guest profile")
+    ap.add_argument("profile", help="file written via $_guest_profile")
+    ap.add_argument("--top", type=int, default=20,
+                    help="entries shown per report (default 20)")
+    ap.add_argument("--by", default="mode,zone,ip",
+                    help="comma separated reports out of mode, zone, ip")
+    args = ap.parse_args()
+
+    by = args.by.split(",")
+    for b in by:
+        if b not in KEYS:
+            ap.error("unknown report '%s'" % b)
+    samples = parse(args.profile)
+    if not samples:
+        print("no samples")
+        return
+    print(report(samples, by, args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,23 @@
+import fcntl
+import json
 import unittest
 
 import re
 
 from datetime import datetime
 from glob import glob
-from os import (makedirs, statvfs, listdir, uname, remove,
+from os import (makedirs, statvfs, listdir, uname, remove, getpid,
                 getcwd, mkdir, utime, rename, environ, access, R_OK, W_OK)
-from os.path import exists, isdir, join
+from os.path import abspath, exists, isdir, join, realpath
 from shutil import copy
 from subprocess import call, check_call, CalledProcessError, DEVNULL, STDOUT, TimeoutExpired
 from time import mktime
 
-from common_framework import (BaseTestCase, main,
+from common_framework import (BaseTestCase, main, reportvalue,
                               mkfile, mkexe, mkcom, mkstring, WORKDIR,
-                              IPROMPT, KNOWNFAIL, UNSUPPORTED)
+                              IPROMPT, KNOWNFAIL, SNAPRESTORED, UNSUPPORTED)
+import counters
+import profreport
 
 SYSTYPE_DRDOS_ENHANCED = "Enhanced DR-DOS"
 SYSTYPE_DRDOS_ORIGINAL = "Original DR-DOS"
@@ -35,6 +39,7 @@ PRGFIL_LFN = "Program Files"
 class OurTestCase(BaseTestCase):
 
     pname = "test_dos"
+    snapshot = True
 
     # Tests using assembler
 
@@ -3537,18 +3542,15 @@ $_floppy_a = ""
         """SysType"""
         self.runDosemu("version.bat", config="""\
 $_hdimage = "dXXXXs/c:hdtype1 +1"
-$_debug = "-D+d"
 """)
 
-        # read the logfile
-        systypeline = "Not found in logfile"
-        with open(self.logname, "r") as f:
-            for line in f:
-                if "system type is" in line:
-                    systypeline = line
-                    break
+        systypes = [x["name"] for x in self.getEvents("systype")]
+        self.assertTrue(systypes, "No systype event")
+        self.assertIn(self.systype, systypes[0])
 
-        self.assertIn(self.systype, systypeline)
+        disks = [x for x in self.getEvents("disk") if x["drive"] == "0x80"]
+        self.assertTrue(disks, "No disk event for C:")
+        self.assertEqual(disks[0]["type"], "Directory")
 
     def _test_memory_dpmi_ecm(self, name):
         ename = "%s.com" % name
@@ -3954,6 +3956,35 @@ $_hdimage = "dXXXXs/c:hdtype1 %s +1"
         """FAT16 image file D writable"""
         self._test_fat_img_d_writable("16")
 
+    def test_fat_img_d_cow(self):
+        """FAT image file D copy-on-write"""
+        mkfile("testit.bat", """\
+D:
+mkdir test
+echo hello > hello.txt
+DIR
+rem end
+""", newline="\r\n")
+
+        name = self.mkimage("12", [("testit.bat", "0")], bootblk=False)
+        with open(join(self.imagedir, name), "rb") as f:
+            before = f.read()
+
+        results = self.runDosemu("testit.bat", config="""\
+$_hdimage = "dXXXXs/c:hdtype1 %s:cow +1"
+""" % name)
+
+        self.assertRegex(results,
+                r"TEST[\t ]+<DIR>"
+                r"|"
+                r"\d{4}-\d{2}-\d{2}\s\d{2}:\d{2}\s<DIR>\s+TEST")
+        self.assertRegex(results,
+                r"HELLO[\t ]+TXT[\t ]+8"
+                r"|"
+                r"\d{4}-\d{2}-\d{2}\s\d{2}:\d{2}\s+8\s+HELLO.TXT")
+        with open(join(self.imagedir, name), "rb") as f:
+            self.assertTrue(f.read() == before, "Image was modified")
+
     def test_mfs_lredir_auto_hdc(self):
         """MFS lredir auto C drive redirection"""
         mkfile("testit.bat", "lredir\r\nrem end\r\n")
@@ -3989,6 +4020,10 @@ $_lredir_paths = "/tmp"
 
         self.assertRegex(results, r"X: = .*LINUX\\FS\\tmp")
 
+        redirs = [x for x in self.getEvents("redirect") if x["drive"] == "X"]
+        self.assertTrue(redirs, "No redirect event for X:")
+        self.assertEqual(redirs[0]["path"], "/tmp/")
+
     def test_mfs_lredir_command_no_perm(self):
         """MFS lredir command redirection permission fail"""
         mkfile("testit.bat", """\
@@ -4009,6 +4044,53 @@ $_floppy_a = ""
 
         self.assertRegex(results, r"Error 5 \(access denied\) while redirecting drive X:")
 
+    def test_mfs_mangle_cache_file(self):
+        """MFS short names kept in $_mangle_cache_file between runs"""
+        testdir = "test-imagedir/dXXXXs/d"
+        makedirs(testdir)
+        longname = "Long file name.txt"
+        mkfile(longname, "mangled file contents\r\n", dname=testdir)
+        cachefile = abspath(join(self.imagedir, "mangle.cache"))
+
+        # the short name is resolved by opening the file with it
+        mkfile("testit.bat", """\
+d:
+set LFN=n
+for %%f in (*.txt) do type %%f
+rem end
+""", newline="\r\n")
+
+        def run():
+            results = self.runDosemu("testit.bat", config="""\
+$_hdimage = "dXXXXs/c:hdtype1 dXXXXs/d:hdtype1 +1"
+$_floppy_a = ""
+$_lfn_support = (on)
+$_mangle_cache_file = "%s"
+""" % cachefile)
+            if results == 'Timeout':
+                raise self.failureException("Timeout:\n")
+            try:
+                with open(cachefile) as f:
+                    entries = [l.rstrip("\n").split("\t") for l in f]
+            except FileNotFoundError:
+                self.fail("Mangle cache file missing")
+            return results, {e[2]: e[1] for e in entries if len(e) == 3}
+
+        results, names = run()
+        self.assertIn("mangled file contents", results)
+        self.assertIn(longname, names)
+        sfn = names[longname]
+
+        # read back and written out again at the next start
+        results, names = run()
+        self.assertIn("mangled file contents", results)
+        self.assertEqual(names.get(longname), sfn)
+
+        # dropped once the file is gone
+        remove(join(testdir, longname))
+        results, names = run()
+        self.assertNotIn(longname, names)
+
 # Tests using the DJGPP DOS compiler
 
     def _test_mfs_file_find(self, nametype):
@@ -6070,7 +6152,7 @@ int main(int argc, char *argv[]) {
         """FAT DOSv3 share open rename FCB"""
         self._test_ds3_share_open_delren("FAT", "RENFCB")
 
-    def _test_cpu(self, cpu_vm, cpu_vm_dpmi, cpu_emu):
+    def _test_cpu(self, cpu_vm, cpu_vm_dpmi, cpu_emu, extra=""):
         mkfile("testit.bat", """\
 test > test.log
 rem end
@@ -6085,7 +6167,7 @@ $_cpu_vm = "%s"
 $_cpu_vm_dpmi = "%s"
 $_cpu_emu = "%s"
 $_ignore_djgpp_null_derefs = (off)
-"""%(cpu_vm, cpu_vm_dpmi, cpu_emu))
+%s"""%(cpu_vm, cpu_vm_dpmi, cpu_emu, extra))
 
         try:
             with open(join(WORKDIR, "test.log")) as f:
@@ -6097,9 +6179,13 @@ $_ignore_djgpp_null_derefs = (off)
                 except IOError:
                     lines = list(f)
                     self.assertEqual(len(lines), 5056)
-                    # copy as reference file
-                    with open("test-i386.log", "w") as g:
+                    # copy as reference file; parallel workers may be
+                    # reading it through their links, so replace it whole
+                    ref = realpath("test-i386.log")
+                    tmp = "%s.%d" % (ref, getpid())
+                    with open(tmp, "w") as g:
                         g.write("".join(lines))
+                    rename(tmp, ref)
         except FileNotFoundError:
             self.fail("One or more log files missing")
 
@@ -6151,6 +6237,533 @@ $_ignore_djgpp_null_derefs = (off)
         """CPU test: simulated vm86 + simulated DPMI"""
         self._test_cpu("emulated", "emulated", "fullsim")
 
+    def test_cpu_tierednative(self):
+        """CPU test: tiered vm86 + native DPMI"""
+        self._test_cpu("emulated", "native", "vm86tiered")
+
+    def test_cpu_tiered(self):
+        """CPU test: tiered vm86 + tiered DPMI"""
+        self._test_cpu("emulated", "emulated", "fulltiered")
+
+    def test_cpu_jit_cache(self):
+        """CPU test: JIT vm86 + JIT DPMI with a translation cache"""
+        cache = abspath(join(WORKDIR, "../../jit.cache"))
+        cnt = abspath(join(WORKDIR, "../../counters.bin"))
+        if exists(cache):
+            remove(cache)
+        extra = """\
+$_jit_cache = "%s"
+$_counters_file = "%s"
+""" % (cache, cnt)
+
+        # cold run fills the cache, warm run must give the same results
+        self._test_cpu("emulated", "emulated", "full", extra)
+        cold = counters.Counters(cnt).totals()
+        self.assertTrue(exists(cache), "JIT cache not written")
+        self._test_cpu("emulated", "emulated", "full", extra)
+        warm = counters.Counters(cnt).totals()
+
+        reportvalue("jit_cache", {
+            "cold_xlate": cold.get("jit.xlate", 0),
+            "warm_xlate": warm.get("jit.xlate", 0),
+            "warm_cache_hit": warm.get("jit.cache_hit", 0),
+        })
+        self.assertEqual(cold.get("jit.cache_hit", 0), 0)
+        self.assertGreater(warm.get("jit.cache_hit", 0), 0)
+
+    def test_cpu_jit_smc(self):
+        """CPU test: JIT vm86 + JIT DPMI with invalidation counters"""
+        cnt = abspath(join(WORKDIR, "../../counters.bin"))
+        extra = """\
+$_counters_file = "%s"
+""" % cnt
+
+        # test-i386 patches its own code in test_self_modifying_code()
+        self._test_cpu("emulated", "emulated", "full", extra)
+        totals = counters.Counters(cnt).totals()
+
+        smc = {k: totals.get(k, 0) for k in
+               ("smc.code", "smc.data", "smc.page", "smc.wthru")}
+        reportvalue("jit_smc", smc)
+        # the patched stores must be seen as code writes, not only as
+        # whole pages thrown away
+        self.assertGreater(smc["smc.code"], 0)
+        # each store let through costs two mprotect() calls; there must
+        # be at most one per code or data write that reached a stub
+        self.assertLessEqual(smc["smc.wthru"],
+                             smc["smc.code"] + smc["smc.data"])
+
+    def _bench_cpu(self, cpu_vm, cpu_vm_dpmi, cpu_emu):
+        if not environ.get("TEST_BENCH"):
+            self.skipTest("benchmarks not requested")
+
+        mkfile("testit.bat", """\
+bench > bench.log
+rem end
+""", newline="\r\n")
+
+        copy("src/tests/bench-i386.exe", join(WORKDIR, "bench.exe"))
+
+        self.runDosemu("testit.bat", timeout=120, config="""\
+$_hdimage = "dXXXXs/c:hdtype1 +1"
+$_floppy_a = ""
+$_cpu_vm = "%s"
+$_cpu_vm_dpmi = "%s"
+$_cpu_emu = "%s"
+$_ignore_djgpp_null_derefs = (off)
+"""%(cpu_vm, cpu_vm_dpmi, cpu_emu))
+
+        # operations per second for each workload
+        results = {}
+        try:
+            with open(join(WORKDIR, "bench.log")) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 4 and fields[0] == "bench":
+                        results[fields[1]] = \
+                            int(fields[2]) * 1000000 / max(int(fields[3]), 1)
+        except FileNotFoundError:
+            self.fail("Benchmark log file missing")
+        self.assertIn("dpmi", results, "Benchmark did not complete")
+        self._bench_baseline("%s/%s/%s" % (cpu_vm, cpu_vm_dpmi, cpu_emu),
+                             results)
+
+    def _bench_baseline(self, key, results):
+        """Compare rates (higher is better) with the baseline file
+
+        A workload fails when it is slower than its baseline by more than
+        TEST_BENCH_THRESHOLD. Missing baselines are added from this run,
+        also for workloads that are new to a key with a baseline already.
+        """
+        reportvalue("bench", results)
+        threshold = float(environ.get("TEST_BENCH_THRESHOLD", "0.25"))
+        # parallel workers share the file: lock the read-modify-write
+        with open("test-bench.json", "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            data = f.read()
+            baseline = json.loads(data) if data else {}
+            old = baseline.setdefault(key, {})
+            new = {name: rate for name, rate in results.items()
+                   if name not in old}
+            if new:
+                old.update(new)
+                f.seek(0)
+                f.truncate()
+                json.dump(baseline, f, indent=2, sort_keys=True)
+
+        slow = ["%s %.0f/s (baseline %.0f/s)" % (name, rate, old[name])
+                for name, rate in sorted(results.items())
+                if name not in new and rate < old[name] * (1 - threshold)]
+        if slow:
+            self.fail("Slower than baseline: " + ", ".join(slow))
+
+    def test_bench_mfs_io(self):
+        """MFS bench: file I/O throughput on a redirected drive"""
+        if not environ.get("TEST_BENCH"):
+            self.skipTest("benchmarks not requested")
+
+        size = int(environ.get("TEST_BENCH_MFS_MB", "64"))
+        testdir = "test-imagedir/dXXXXs/d"
+        makedirs(testdir)
+
+        mkfile("testit.bat", """\
+d:
+c:\\mfsbench %d > c:\\bench.log
+rem end
+""" % size, newline="\r\n")
+
+        # DJGPP splits transfers larger than its 16k transfer buffer, so
+        # the largest block size shows the cost of back to back calls
+        mkexe("mfsbench", r"""
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+#include <unistd.h>
+
+static char buf[65536];
+static const int bsizes[] = {512, 4096, 16384, 65536};
+
+static void report(const char *op, int bs, unsigned long long bytes,
+                   unsigned long ops, uclock_t start) {
+  unsigned long long usecs =
+      (unsigned long long)(uclock() - start) * 1000000 / UCLOCKS_PER_SEC;
+  printf("bench %s_%d %llu %lu %llu\n", op, bs, bytes, ops, usecs);
+}
+
+int main(int argc, char *argv[]) {
+  unsigned long long size = (unsigned long long)atoi(argv[1]) << 20;
+  unsigned i, b;
+  int f;
+
+  for (b = 0; b < sizeof(bsizes) / sizeof(bsizes[0]); b++) {
+    int bs = bsizes[b];
+    unsigned long n = size / bs;
+    uclock_t start;
+
+    start = uclock();
+    f = open("bench.dat", O_WRONLY | O_CREAT | O_TRUNC | O_BINARY, 0644);
+    if (f < 0) {
+      printf("open failed\n");
+      return 1;
+    }
+    for (i = 0; i < n; i++)
+      if (write(f, buf, bs) != bs) {
+        printf("write failed\n");
+        return 1;
+      }
+    close(f);
+    report("seqwrite", bs, size, n, start);
+
+    start = uclock();
+    f = open("bench.dat", O_RDONLY | O_BINARY);
+    for (i = 0; i < n; i++)
+      if (read(f, buf, bs) != bs) {
+        printf("read failed\n");
+        return 1;
+      }
+    close(f);
+    report("seqread", bs, size, n, start);
+
+    srand(bs);
+    start = uclock();
+    f = open("bench.dat", O_RDWR | O_BINARY);
+    for (i = 0; i < n; i++) {
+      lseek(f, (off_t)(rand() % n) * bs, SEEK_SET);
+      if (read(f, buf, bs) != bs) {
+        printf("read failed\n");
+        return 1;
+      }
+    }
+    report("randread", bs, size, n, start);
+
+    start = uclock();
+    for (i = 0; i < n; i++) {
+      lseek(f, (off_t)(rand() % n) * bs, SEEK_SET);
+      if (write(f, buf, bs) != bs) {
+        printf("write failed\n");
+        return 1;
+      }
+    }
+    close(f);
+    report("randwrite", bs, size, n, start);
+
+    unlink("bench.dat");
+  }
+  printf("bench done\n");
+  return 0;
+}
+""")
+
+        self.runDosemu("testit.bat", timeout=3600, config="""\
+$_hdimage = "dXXXXs/c:hdtype1 dXXXXs/d:hdtype1 +1"
+$_floppy_a = ""
+""")
+
+        # MB/s and operations per second for each operation and block size
+        results = {}
+        try:
+            with open(join(WORKDIR, "bench.log")) as f:
+                lines = [l.split() for l in f]
+        except FileNotFoundError:
+            self.fail("Benchmark log file missing")
+        self.assertIn(["bench", "done"], lines, "Benchmark did not complete")
+        for fields in lines:
+            if len(fields) == 5 and fields[0] == "bench":
+                secs = max(int(fields[4]), 1) / 1000000
+                results[fields[1] + "_mbs"] = int(fields[2]) / secs / 1048576
+                results[fields[1] + "_ops"] = int(fields[3]) / secs
+
+        self._bench_baseline("mfs/%dM" % size, results)
+
+    def test_bench_mfs_find(self):
+        """MFS bench: full directory scan on a redirected drive"""
+        if not environ.get("TEST_BENCH"):
+            self.skipTest("benchmarks not requested")
+
+        nfiles = int(environ.get("TEST_BENCH_DIR_FILES", "50000"))
+        testdir = "test-imagedir/dXXXXs/d"
+        makedirs(testdir)
+
+        # half of the names are 8.3, the others need mangling for SFN
+        for i in range(nfiles):
+            if i % 2:
+                name = "f%07d.txt" % i
+            else:
+                name = "Long file name %07d.text" % i
+            open(join(testdir, name), "w").close()
+
+        mkfile("testit.bat", """\
+d:
+set LFN=n
+c:\\findbnch sfn > c:\\sfn.log
+set LFN=y
+c:\\findbnch lfn > c:\\lfn.log
+rem end
+""", newline="\r\n")
+
+        # the second scan of the same directory shows the effect of
+        # caching on the dosemu side
+        mkexe("findbnch", r"""
+#include <dir.h>
+#include <stdio.h>
+#include <time.h>
+
+int main(int argc, char *argv[]) {
+  int pass;
+
+  for (pass = 0; pass < 2; pass++) {
+    struct ffblk ff;
+    unsigned long count = 0;
+    unsigned long long usecs;
+    uclock_t start = uclock();
+    int ret;
+
+    for (ret = findfirst("*.*", &ff, 0); ret == 0; ret = findnext(&ff))
+      count++;
+    usecs = (unsigned long long)(uclock() - start) * 1000000 / UCLOCKS_PER_SEC;
+    printf("bench %s_%s %lu %llu\n", argv[1], pass ? "warm" : "cold",
+           count, usecs);
+  }
+  printf("bench done\n");
+  return 0;
+}
+""")
+
+        self.runDosemu("testit.bat", timeout=3600, config="""\
+$_hdimage = "dXXXXs/c:hdtype1 dXXXXs/d:hdtype1 +1"
+$_floppy_a = ""
+$_lfn_support = (on)
+""")
+
+        # entries per second for each name type and pass
+        results = {}
+        for mode in ("sfn", "lfn"):
+            try:
+                with open(join(WORKDIR, mode + ".log")) as f:
+                    lines = [l.split() for l in f]
+            except FileNotFoundError:
+                self.fail("Benchmark log file missing")
+            self.assertIn(["bench", "done"], lines,
+                          "%s benchmark did not complete" % mode.upper())
+            for fields in lines:
+                if len(fields) == 4 and fields[0] == "bench":
+                    self.assertEqual(int(fields[2]), nfiles,
+                                     "%s scan found %s of %d files" %
+                                     (fields[1], fields[2], nfiles))
+                    secs = max(int(fields[3]), 1) / 1000000
+                    results[fields[1] + "_eps"] = nfiles / secs
+
+        self._bench_baseline("mfs-dir/%d" % nfiles, results)
+
+    def test_bench_mfs_path(self):
+        """MFS bench: deep short path resolution with and without name cache"""
+        if not environ.get("TEST_BENCH"):
+            self.skipTest("benchmarks not requested")
+
+        depth = int(environ.get("TEST_BENCH_PATH_DEPTH", "8"))
+        nfiles = int(environ.get("TEST_BENCH_PATH_FILES", "2000"))
+        testdir = "test-imagedir/dXXXXs/d"
+        makedirs(testdir)
+
+        # every level has a long named subdirectory among many long named
+        # files, so that each component needs mangling
+        path = testdir
+        for level in range(depth):
+            for i in range(nfiles):
+                open(join(path, "Long sibling file %05d.text" % i), "w").close()
+            path = join(path, "Long directory name %d" % level)
+            makedirs(path)
+        with open(join(path, "Target file.text"), "w") as f:
+            f.write("target\n")
+
+        mkfile("testit.bat", """\
+d:
+set LFN=n
+c:\\pathbnch > c:\\bench.log
+rem end
+""", newline="\r\n")
+
+        # the short names are looked up first so that only the resolution
+        # of a known short path is timed, as is the short form of the long
+        # path via int21/7160 CL=1
+        mkexe("pathbnch", r"""
+#include <dir.h>
+#include <dpmi.h>
+#include <go32.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <string.h>
+#include <sys/movedata.h>
+#include <time.h>
+#include <unistd.h>
+
+#define MIN_USECS 250000
+
+static char sfnpath[256], lfnpath[512];
+
+static int find(char *path, const char *pattern, int attr) {
+  struct ffblk ff;
+  char spec[300];
+
+  sprintf(spec, "%s\\%s", path, pattern);
+  if (findfirst(spec, &ff, attr) != 0)
+    return -1;
+  strcat(path, "\\");
+  strcat(path, ff.ff_name);
+  return 0;
+}
+
+static unsigned do_open(unsigned n) {
+  unsigned i;
+  for (i = 0; i < n; i++) {
+    int f = open(sfnpath, O_RDONLY);
+    if (f < 0)
+      return 0;
+    close(f);
+  }
+  return n;
+}
+
+static unsigned do_shortname(unsigned n) {
+  __dpmi_regs r;
+  unsigned i;
+
+  dosmemput(lfnpath, strlen(lfnpath) + 1, __tb);
+  for (i = 0; i < n; i++) {
+    memset(&r, 0, sizeof(r));
+    r.x.ax = 0x7160;
+    r.x.cx = 0x0001;
+    r.x.ds = r.x.es = __tb >> 4;
+    r.x.si = __tb & 0x0f;
+    r.x.di = (__tb & 0x0f) + 512;
+    __dpmi_int(0x21, &r);
+    if (r.x.flags & 1)
+      return 0;
+  }
+  return n;
+}
+
+static int run(const char *name, unsigned (*fn)(unsigned)) {
+  unsigned long long usecs;
+  unsigned n = 16;
+  uclock_t start;
+
+  for (;;) {
+    start = uclock();
+    if (fn(n) != n) {
+      printf("%s failed\n", name);
+      return -1;
+    }
+    usecs = (unsigned long long)(uclock() - start) * 1000000 / UCLOCKS_PER_SEC;
+    if (usecs >= MIN_USECS)
+      break;
+    n *= 2;
+  }
+  printf("bench %s %u %llu\n", name, n, usecs);
+  return 0;
+}
+
+int main(int argc, char *argv[]) {
+  int level;
+
+  strcpy(sfnpath, "D:");
+  strcpy(lfnpath, "D:");
+  for (level = 0; find(sfnpath, "LONGD*.*", FA_DIREC) == 0; level++)
+    sprintf(lfnpath + strlen(lfnpath), "\\Long directory name %d", level);
+  if (find(sfnpath, "TARGE*.*", 0) != 0) {
+    printf("target not found in %s\n", sfnpath);
+    return 1;
+  }
+  strcat(lfnpath, "\\Target file.text");
+  printf("path %d %s\n", level, sfnpath);
+
+  if (run("open", do_open) || run("shortname", do_shortname))
+    return 1;
+  printf("bench done\n");
+  return 0;
+}
+""")
+
+        # operations per second for each workload, with the default cache
+        # and with the cache disabled
+        results = {}
+        for suffix, cache in (("", "4096"), ("_nocache", "0")):
+            self.runDosemu("testit.bat", timeout=3600, config="""\
+$_hdimage = "dXXXXs/c:hdtype1 dXXXXs/d:hdtype1 +1"
+$_floppy_a = ""
+$_lfn_support = (on)
+$_mangle_cache = (%s)
+""" % cache)
+
+            try:
+                with open(join(WORKDIR, "bench.log")) as f:
+                    lines = [l.split() for l in f]
+            except FileNotFoundError:
+                self.fail("Benchmark log file missing")
+            self.assertIn(["bench", "done"], lines, "Benchmark did not complete")
+            self.assertIn(["path", str(depth)], [l[:2] for l in lines],
+                          "Short path not found at depth %d" % depth)
+            for fields in lines:
+                if len(fields) == 4 and fields[0] == "bench":
+                    secs = max(int(fields[3]), 1) / 1000000
+                    results[fields[1] + suffix + "_ops"] = int(fields[2]) / secs
+
+        self._bench_baseline("mfs-path/%dx%d" % (depth, nfiles), results)
+
+    def test_bench_cpu_1_vm86native(self):
+        """CPU bench: native vm86 + native DPMI (i386 only)"""
+        if uname()[4] == 'x86_64':
+            self.skipTest("x86_64 doesn't support native vm86()")
+        self._bench_cpu("vm86", "native", "off")
+
+    def test_bench_cpu_2_jitnative(self):
+        """CPU bench: JIT vm86 + native DPMI"""
+        self._bench_cpu("emulated", "native", "vm86")
+
+    def test_bench_cpu_jitkvm(self):
+        """CPU bench: JIT vm86 + KVM DPMI"""
+        self._bench_cpu("emulated", "kvm", "vm86")
+
+    def test_bench_cpu_simnative(self):
+        """CPU bench: simulated vm86 + native DPMI"""
+        self._bench_cpu("emulated", "native", "vm86sim")
+
+    def test_bench_cpu_simkvm(self):
+        """CPU bench: simulated vm86 + KVM DPMI"""
+        self._bench_cpu("emulated", "kvm", "vm86sim")
+
+    def test_bench_cpu_kvmnative(self):
+        """CPU bench: KVM vm86 + native DPMI"""
+        self._bench_cpu("kvm", "native", "off")
+
+    def test_bench_cpu_kvm(self):
+        """CPU bench: KVM vm86 + KVM DPMI"""
+        if not access("/dev/kvm", W_OK|R_OK):
+            self.skipTest("Emulation fallback fails for full KVM")
+        self._bench_cpu("kvm", "kvm", "off")
+
+    def test_bench_cpu_kvmjit(self):
+        """CPU bench: KVM vm86 + JIT DPMI"""
+        self._bench_cpu("kvm", "emulated", "full")
+
+    def test_bench_cpu_kvmsim(self):
+        """CPU bench: KVM vm86 + simulated DPMI"""
+        self._bench_cpu("kvm", "emulated", "fullsim")
+
+    def test_bench_cpu_jit(self):
+        """CPU bench: JIT vm86 + JIT DPMI"""
+        self._bench_cpu("emulated", "emulated", "full")
+
+    def test_bench_cpu_sim(self):
+        """CPU bench: simulated vm86 + simulated DPMI"""
+        self._bench_cpu("emulated", "emulated", "fullsim")
+
+    def test_bench_cpu_tiered(self):
+        """CPU bench: tiered vm86 + tiered DPMI"""
+        self._bench_cpu("emulated", "emulated", "fulltiered")
+
     def test_libi86_build(self):
         """libi86 build and test script"""
         if environ.get("SKIP_EXPENSIVE"):
@@ -6245,6 +6858,271 @@ $_floppy_a = ""
             msg = "Output file(s) missing %s\n" % str(missing)
             raise self.failureException(msg)
 
+    def test_batch_mode(self):
+        """Batch mode manifest with per-command results"""
+        dira = join(WORKDIR, "../../batcha")
+        dirb = join(WORKDIR, "../../batchb")
+        makedirs(dira, exist_ok=True)
+        makedirs(join(dirb, "sub"), exist_ok=True)
+        mkfile("one.bat", "@echo batch one\r\n", dname=dira)
+        mkfile("two.bat", "@echo batch two\r\n", dname=join(dirb, "sub"))
+
+        manifest = join(WORKDIR, "../../batch.lst")
+        mkfile(manifest, """\
+# dir\ttimeout\tcommand
+%s\t30\tone.bat
+
+%s:sub\t30\ttwo.bat
+%s\t0\tone.bat
+""" % (abspath(dira), abspath(dirb), abspath(dira)), dname=".")
+
+        results = self.runDosemuCmdline(["-b", manifest], config="""\
+$_hdimage = "dXXXXs/c:hdtype1 +1"
+$_floppy_a = ""
+""")
+        if results == 'Timeout':
+            raise self.failureException("Timeout:\n")
+
+        with open(manifest + ".results") as f:
+            records = [json.loads(x) for x in f]
+        self.assertEqual([x["index"] for x in records], [0, 1, 2])
+        self.assertEqual([x["command"] for x in records],
+                         ["one.bat", "two.bat", "one.bat"])
+        for r in records:
+            self.assertEqual(r["exit"], 0)
+            self.assertNotIn("timeout", r)
+            self.assertGreaterEqual(r["elapsed"], 0)
+        self.assertIn("batch one", records[0]["output"])
+        self.assertIn("batch two", records[1]["output"])
+        self.assertIn("batch one", records[2]["output"])
+
+    def test_guest_profile(self):
+        """Guest profile written at exit"""
+        prof = join(WORKDIR, "../../guest.prof")
+        if exists(prof):
+            remove(prof)
+
+        results = self.runDosemu("version.bat", config="""\
+$_hdimage = "dXXXXs/c:hdtype1 +1"
+$_floppy_a = ""
+$_guest_profile = "%s"
+""" % abspath(prof))
+        if results == 'Timeout':
+            raise self.failureException("Timeout:\n")
+
+        samples = profreport.parse(prof)
+        self.assertTrue(samples, "No samples in profile")
+        zones = profreport.totals(samples, "zone")
+        self.assertTrue(any(z in zones for z in ("guest", "idle", "emu")), zones)
+
+    def test_counters_file(self):
+        """Hot path counters exported to a file"""
+        cnt = join(WORKDIR, "../../counters.bin")
+        if exists(cnt):
+            remove(cnt)
+
+        results = self.runDosemu("version.bat", config="""\
+$_hdimage = "dXXXXs/c:hdtype1 +1"
+$_floppy_a = ""
+$_counters_file = "%s"
+""" % abspath(cnt))
+        if results == 'Timeout':
+            raise self.failureException("Timeout:\n")
+
+        c = counters.Counters(cnt)
+        self.assertFalse(c.running)
+        totals = c.totals()
+        self.assertTrue(totals, "No counters")
+        self.assertIn("coopth.switch", totals)
+
+    def test_log_ring(self):
+        """Debug messages kept in memory and written at exit"""
+        mkfile("testit.bat", """\
+dir c:\\version.bat
+rem end
+""", newline="\r\n")
+
+        # the boot has to run for its disk reads to be logged
+        results = self.runDosemu("testit.bat", snapshot=False, config="""\
+$_hdimage = "dXXXXs/c:hdtype1 +1"
+$_floppy_a = ""
+$_debug = "+d"
+$_log_ring = (65536)
+""")
+        if results == 'Timeout':
+            raise self.failureException("Timeout:\n")
+
+        with open(self.logname, errors="replace") as f:
+            log = f.read()
+        # disk reads during boot are only ever logged through the ring
+        self.assertRegex(log, r"DISK: .*Trying to read")
+        self.assertNotIn("log messages lost", log)
+        # %.8s of a name that is not NUL-terminated keeps to its precision
+        self.assertRegex(log, r"MFS: 'VERSION '\.'BAT' hlist=")
+
+    def setUpSnapshotDos(self):
+        """Leaves out what keeps state on the host: HMA, UMB, EMS and the
+        redirector"""
+        nohost = re.compile(r"^\s*(dos\s*=|dosdata\s*=|device(high)?\s*=.*"
+                            r"dosemu\\|emufs\s*$)", re.I)
+        for name in (self.confsys, self.autoexec):
+            with open(join(WORKDIR, name), newline="") as f:
+                lines = f.readlines()
+            mkfile(name, "".join(l for l in lines if not nohost.match(l)),
+                   newline="")
+
+    def test_snapshot(self):
+        """Snapshot restored in place of booting"""
+        mkfile("dosemu.conf", """\
+$_hdimage = "dXXXXs/c:hdtype1 +1"
+$_floppy_a = ""
+""", dname=self.imagedir, writemode="a")
+        self.setUpSnapshotDos()
+        for name in (self.getSnapshotName(),
+                     self.getSnapshotName() + ".refused"):
+            try:
+                remove(name)
+            except FileNotFoundError:
+                pass
+
+        def words(results):
+            # the prompt may have been printed before the snapshot was taken
+            return [w for w in results.split()
+                    if not re.match(r'[A-Z]:\\[^>]*>$', w)]
+
+        booted = self.runDosemu("version.bat", snapshot=True)
+        if booted == 'Timeout':
+            raise self.failureException("Timeout booting:\n")
+        with open(self.xptname, errors="replace") as f:
+            xpt = f.read()
+        self.assertIn(IPROMPT, xpt)
+        self.assertIn("emusnap: saving snapshot", xpt)
+        self.assertTrue(exists(self.getSnapshotName()), "No snapshot saved")
+
+        restored = self.runDosemu("version.bat", snapshot=True)
+        if restored == 'Timeout':
+            raise self.failureException("Timeout after restore:\n")
+        with open(self.xptname, errors="replace") as f:
+            xpt = f.read()
+        self.assertIn(SNAPRESTORED, xpt)
+        self.assertNotIn(IPROMPT, xpt)
+        self.assertEqual(words(restored), words(booted))
+
+        # as setUp() does for every test: new times, but the same contents
+        self.setUpDosAutoexec()
+        self.setUpDosConfig()
+        self.setUpDosVersion()
+        mkfile(self.autoexec, "\r\n@echo " + IPROMPT + "\r\n", writemode="a")
+        self.setUpSnapshotDos()
+        rewritten = self.runDosemu("version.bat", snapshot=True)
+        with open(self.xptname, errors="replace") as f:
+            xpt = f.read()
+        self.assertIn(SNAPRESTORED, xpt)
+        self.assertEqual(words(rewritten), words(booted))
+
+        # a changed boot drive must not be restored with stale DOS buffers
+        mkfile("new.txt", "changed\r\n")
+        rebooted = self.runDosemu("version.bat", snapshot=True)
+        if rebooted == 'Timeout':
+            raise self.failureException("Timeout after disk change:\n")
+        with open(self.xptname, errors="replace") as f:
+            xpt = f.read()
+        self.assertIn(IPROMPT, xpt)
+        self.assertNotIn(SNAPRESTORED, xpt)
+
+    def test_snapshot_refused(self):
+        """Snapshot refused while DOS uses host-side state"""
+        mkfile("testit.bat", """\
+emusnap
+rem end
+""", newline="\r\n")
+        mkfile("dosemu.conf", """\
+$_hdimage = "dXXXXs/c:hdtype1 +1"
+$_floppy_a = ""
+""", dname=self.imagedir, writemode="a")
+        snapname = self.setUpSnapshot()
+        try:
+            remove(snapname)
+        except FileNotFoundError:
+            pass
+
+        # the shipped config loads DOS high and the UMB and EMS drivers
+        results = self.runDosemu("testit.bat", snapshot=False)
+        if results == 'Timeout':
+            raise self.failureException("Timeout:\n")
+        self.assertIn("emusnap: can't save a snapshot now", results)
+        self.assertFalse(exists(snapname), "Snapshot saved anyway")
+
+    def test_sessions(self):
+        """Concurrent sessions with their own config and input"""
+        ename = "askkey"
+
+        mkfile("testit.bat", """\
+c:\\%s
+rem end
+""" % ename, newline="\r\n")
+
+        # print a prompt, read a key and echo it back
+        mkcom(ename, r"""
+.text
+.code16
+
+    .globl  _start16
+_start16:
+
+    push    %cs
+    pop     %ds
+
+    movw    $askmsg, %dx
+    movb    $0x9, %ah
+    int     $0x21
+
+    movb    $0x1, %ah
+    int     $0x21
+    movb    %al, key
+
+    movw    $gotmsg, %dx
+    movb    $0x9, %ah
+    int     $0x21
+
+    movb    $0x4c, %ah
+    int     $0x21
+
+askmsg:
+    .ascii  "Key?$"
+gotmsg:
+    .ascii  "\r\nGot "
+key:
+    .ascii  " \r\n$"
+""")
+
+        hdimage = '$_hdimage = "dXXXXs/c:hdtype1 +1"\n$_floppy_a = ""\n'
+        configs = [hdimage + '$_xms = (%d)\n' % xms for xms in (1024, 2048)]
+        results = self.runDosemuSessions([
+            {"cmd": "testit.bat", "config": configs[0],
+             "interactions": [(r"Key\?", "a")]},
+            {"cmd": "testit.bat", "config": configs[1],
+             "interactions": [(r"Key\?", "b")]},
+        ])
+
+        for n, key in enumerate("ab"):
+            self.assertNotIn(results[n], ('Timeout', 'EndOfFile'),
+                             "Session %d didn't finish" % n)
+            self.assertIn("Got " + key, results[n])
+            logname, xptname, _ = self.getSessionNames(n)
+            self.assertTrue(exists(logname), "No log for session %d" % n)
+            self.assertTrue(exists(xptname), "No transcript for session %d" % n)
+
+        # each session has its own copy of the config
+        with open(join(self.imagedir, "dosemu.conf")) as f:
+            conf = f.read()
+        self.assertNotIn("$_xms", conf)
+        for n in range(2):
+            with open(join(self.imagedir, "dosemu.%d.conf" % n)) as f:
+                conf = f.read()
+            self.assertIn(configs[n], conf)
+            self.assertNotIn(configs[1 - n], conf)
+
 
 class DRDOS701TestCase(OurTestCase, unittest.TestCase):
     # OpenDOS 7.01
@@ -6442,6 +7320,8 @@ class PPDOSGITTestCase(OurTestCase, unittest.TestCase):
         cls.actions = {
             "test_floppy_img": UNSUPPORTED,
             "test_floppy_vfs": UNSUPPORTED,
+            # the kernel state is on the host side
+            "test_snapshot": UNSUPPORTED,
         }
 
         # Use the default files that FDPP installed
@@ -0,0 +1,223 @@
+"""Checks the images of fatimage.py by reading them back"""
+
+import struct
+import unittest
+
+from os import stat
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from fatimage import (BOOT_CODE, HEADER_SIZE, IMAGE_MAGIC, MBR_CODE,
+                      SECTOR_SIZE, write_image)
+
+MTIME = 1577934246      # 2020-01-02 03:04:06 UTC
+
+
+class FatReader(object):
+    """Just enough of a FAT reader to walk what write_image() wrote"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        magic, self.heads, self.sectors, self.cylinders, self.offset = \
+            struct.unpack_from("<7sIIII", self.data, 0)
+        assert magic == IMAGE_MAGIC
+        self.mbr = self.data[self.offset:self.offset + SECTOR_SIZE]
+        (self.active, self.ptype, self.pstart,
+         self.psize) = struct.unpack_from("<B3xB3xII", self.mbr, 446)
+        self.part = self.offset + self.pstart * SECTOR_SIZE
+        self.boot = self.data[self.part:self.part + SECTOR_SIZE]
+        (self.bps, self.spc, self.reserved, self.nfats, self.root_entries,
+         small, self.media, spf16, self.spt, self.nheads, self.hidden,
+         large) = struct.unpack_from("<HBHBHHBHHHII", self.boot, 0x0b)
+        self.total = small or large
+        if spf16:
+            self.fat = 12 if self.boot[0x36:0x3e] == b"FAT12   " else 16
+            self.spf = spf16
+            self.root_cluster = 0
+        else:
+            self.fat = 32
+            self.spf, = struct.unpack_from("<I", self.boot, 0x24)
+            self.root_cluster, = struct.unpack_from("<I", self.boot, 0x2c)
+        self.fat_start = self.part + self.reserved * SECTOR_SIZE
+        self.root_start = self.fat_start + self.nfats * self.spf * SECTOR_SIZE
+        self.data_start = self.root_start + self.root_entries * 32
+
+    def sector(self, n):
+        return self.data[self.part + n * SECTOR_SIZE:
+                         self.part + (n + 1) * SECTOR_SIZE]
+
+    def entry(self, n, copy=0):
+        fat = self.fat_start + copy * self.spf * SECTOR_SIZE
+        if self.fat == 12:
+            v, = struct.unpack_from("<H", self.data, fat + n * 3 // 2)
+            return v >> 4 if n & 1 else v & 0xfff
+        if self.fat == 16:
+            return struct.unpack_from("<H", self.data, fat + n * 2)[0]
+        return struct.unpack_from("<I", self.data, fat + n * 4)[0] & 0xfffffff
+
+    def chain(self, cluster):
+        eoc = {12: 0xff8, 16: 0xfff8, 32: 0xffffff8}[self.fat]
+        ret = []
+        while cluster < eoc:
+            ret.append(cluster)
+            cluster = self.entry(cluster)
+        return ret
+
+    def cluster(self, n):
+        size = self.spc * SECTOR_SIZE
+        start = self.data_start + (n - 2) * size
+        return self.data[start:start + size]
+
+    def read(self, cluster, size=None):
+        data = b"".join(self.cluster(n) for n in self.chain(cluster))
+        return data if size is None else data[:size]
+
+    def listdir(self, cluster=0):
+        if cluster:
+            data = self.read(cluster)
+        else:
+            data = self.data[self.root_start:self.data_start]
+        ret = {}
+        for off in range(0, len(data), 32):
+            ent = data[off:off + 32]
+            if ent[0] == 0:
+                break
+            name, attr, hi, lo, size = struct.unpack("<11sB8xH4xHI", ent)
+            ret[name] = (attr, hi << 16 | lo, size)
+        return ret
+
+
+class FatImageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, files, **kwargs):
+        path = join(self.tmpdir.name, "test.img")
+        write_image(path, files, **kwargs)
+        return path
+
+    def test_fat12(self):
+        """FAT12 with the mkfatimage16 defaults"""
+        big = bytes(range(256)) * 20
+        path = self.write([("A.TXT", b"hello\r\n", MTIME),
+                           ("b.bin", big, MTIME)], cylinders=306, heads=4)
+        img = FatReader(path)
+
+        self.assertEqual((img.cylinders, img.heads, img.sectors, img.offset),
+                         (306, 4, 17, HEADER_SIZE))
+        self.assertEqual(img.mbr[:len(MBR_CODE)], MBR_CODE)
+        self.assertEqual(img.mbr[510:], b"\x55\xaa")
+        self.assertEqual((img.active, img.ptype, img.pstart, img.psize),
+                         (0, 0x01, 17, (306 * 4 - 1) * 17))
+
+        self.assertEqual(img.boot[0x3e:0x3e + len(BOOT_CODE)], BOOT_CODE)
+        self.assertEqual(img.boot[510:], b"\x55\xaa")
+        self.assertEqual((img.bps, img.spc, img.reserved, img.nfats,
+                          img.root_entries, img.media, img.spt, img.nheads,
+                          img.hidden, img.total, img.fat, img.spf),
+                         (512, 8, 1, 2, 512, 0xf8, 17, 4, 17, 20791, 12, 8))
+
+        self.assertEqual((img.entry(0), img.entry(1)), (0xff8, 0xfff))
+        files = img.listdir()
+        self.assertEqual(files[b"A       TXT"], (0, 2, 7))
+        self.assertEqual(files[b"B       BIN"], (0, 3, len(big)))
+        self.assertEqual(img.chain(2), [2])
+        self.assertEqual(img.chain(3), [3, 4])
+        self.assertEqual(img.entry(5), 0)
+        self.assertEqual(img.read(2, 7), b"hello\r\n")
+        self.assertEqual(img.read(3, len(big)), big)
+        for n in range(6):
+            self.assertEqual(img.entry(n), img.entry(n, copy=1))
+
+    def test_fat16_subdirs(self):
+        """FAT16 with subdirectories and a bootable partition"""
+        bootsect = b"\xeb\x3c\x90" + bytes(509)
+        path = self.write([("DOS/SUB/C.TXT", b"c" * 3000, MTIME),
+                           ("DOS/D.TXT", b"d", MTIME),
+                           ("E", None, MTIME)],
+                          cylinders=615, heads=4, bootsect=bootsect)
+        img = FatReader(path)
+
+        self.assertEqual((img.active, img.ptype), (0x80, 0x04))
+        self.assertEqual((img.fat, img.spc, img.total, img.spf),
+                         (16, 4, 41803, 41))
+        self.assertEqual(img.boot[:3], b"\xeb\x3c\x90")
+        self.assertEqual(img.boot[0x26], 0)
+        self.assertEqual((img.entry(0), img.entry(1)), (0xfff8, 0xffff))
+
+        root = img.listdir()
+        self.assertEqual(sorted(root), [b"DOS        ", b"E          "])
+        attr, dos, _ = root[b"DOS        "]
+        self.assertEqual(attr, 0x10)
+        self.assertEqual(root[b"E          "][0], 0x10)
+
+        ents = img.listdir(dos)
+        self.assertEqual(ents[b".          "], (0x10, dos, 0))
+        self.assertEqual(ents[b"..         "], (0x10, 0, 0))
+        attr, sub, _ = ents[b"SUB        "]
+        self.assertEqual(attr, 0x10)
+        self.assertEqual(ents[b"D       TXT"][2], 1)
+
+        ents = img.listdir(sub)
+        self.assertEqual(ents[b"..         "], (0x10, dos, 0))
+        _, c, size = ents[b"C       TXT"]
+        self.assertEqual(size, 3000)
+        self.assertEqual(len(img.chain(c)), 2)
+        self.assertEqual(img.read(c, size), b"c" * 3000)
+
+    def test_fat32(self):
+        """FAT32 with the root directory in a cluster chain"""
+        path = self.write([("F.TXT", b"f" * 1000, MTIME)],
+                          cylinders=100, heads=16, sectors=63, fat=32,
+                          label="test")
+        img = FatReader(path)
+
+        self.assertEqual((img.ptype, img.fat, img.spc, img.reserved,
+                          img.root_entries, img.total, img.hidden),
+                         (0x0b, 32, 1, 32, 0, (100 * 16 - 1) * 63, 63))
+        self.assertEqual(img.root_cluster, 2)
+        self.assertEqual(img.boot[0x52:0x5a], b"FAT32   ")
+        self.assertEqual(img.boot[0x47:0x52], b"TEST       ")
+        self.assertEqual(img.sector(6), img.boot)
+
+        info = img.sector(1)
+        self.assertEqual(struct.unpack_from("<I", info, 0)[0], 0x41615252)
+        sig, free, nxt = struct.unpack_from("<III", info, 484)
+        self.assertEqual(sig, 0x61417272)
+        self.assertEqual(nxt, 5)
+
+        self.assertEqual(img.chain(2), [2])
+        root = img.listdir(2)
+        self.assertEqual(root[b"TEST       "][0], 0x08)
+        _, f, size = root[b"F       TXT"]
+        self.assertEqual(img.chain(f), [3, 4])
+        self.assertEqual(img.read(f, size), b"f" * 1000)
+
+    def test_sparse(self):
+        """Only written data takes up space unless sparse=False"""
+        size = 8 * 1024 * 1024
+        files = [("BIG.DAT", size), ("S.TXT", b"s", MTIME)]
+        path = self.write(files, cylinders=615, heads=4)
+        st = stat(path)
+        if st.st_blocks * 512 >= st.st_size:
+            self.skipTest("no sparse files here")
+        self.assertLess(st.st_blocks * 512, size)
+
+        img = FatReader(path)
+        _, big, bsize = img.listdir()[b"BIG     DAT"]
+        self.assertEqual(bsize, size)
+        self.assertEqual(len(img.chain(big)), size // (4 * SECTOR_SIZE))
+        self.assertEqual(img.read(big, size), bytes(size))
+        _, s, _ = img.listdir()[b"S       TXT"]
+        self.assertEqual(img.read(s, 1), b"s")
+
+        path = self.write(files, cylinders=615, heads=4, sparse=False)
+        st = stat(path)
+        self.assertGreaterEqual(st.st_blocks * 512, st.st_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
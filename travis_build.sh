@@ -24,4 +24,4 @@ git clone --depth 1 --no-single-branch https://github.com/stsp/fdpp.git ${LOCALF
 export PKG_CONFIG_PATH=${LOCALFDPPINST}/lib/pkgconfig
 ./default-configure -d
 make
-make -C src/tests test-i386.exe
+make -C src/tests test-i386.exe bench-i386.exe
@@ -43,6 +43,8 @@ python3 test/test_dos.py
 # python3 test/test_dos.py FRDOS120TestCase
 # single test example
 # python3 test/test_dos.py FRDOS120TestCase.test_mfs_fcb_rename_wild_1
+# parallel example, each worker gets its own directory below test-parallel
+# TEST_JOBS=`nproc` python3 test/test_dos.py
 
 for i in test_*.*.*.log ; do
   test -f $i || exit 0